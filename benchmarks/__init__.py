@@ -0,0 +1,19 @@
+"""Benchmarks for the endpoints in dcalalan_cs348_project/main.py
+
+Generates synthetic catalogs into a local SQLite database and drives the app
+in-process through its ASGI interface, at several concurrency levels. Results
+(p50/p95/p99 latency, throughput, peak RSS, queries per request) are written to
+a JSON file that can be compared with the results of another commit.
+
+Run from the repository root:
+
+    python -m benchmarks run --sizes 1000,100000 --concurrency 1,8,32 --out results.json
+    python -m benchmarks compare old.json new.json
+
+`python -m benchmarks startup` guards the time to import and start the app, and
+that pandas, DuckDB, PyArrow, NumPy and SciPy aren't loaded by importing it
+(see startup.py).
+
+`python -m benchmarks plans` EXPLAINs the app's key queries and fails when any
+of them falls back to a full table scan (see plans.py).
+"""
@@ -0,0 +1,112 @@
+"""Command line entry point, see benchmarks/__init__.py"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks import plans, startup
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    results = {'commit': _commit(),
+               'python': platform.python_version(),
+               'started': time.strftime('%Y-%m-%dT%H:%M:%S'),
+               'concurrency': args.concurrency,
+               'requests': args.requests,
+               'sizes': {}}
+
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in [int(size) for size in args.sizes.split(',')]:
+            print(f"{size} tracks", file=sys.stderr)
+            part = os.path.join(workdir, f'{size}.json')
+            command = [sys.executable, '-m', 'benchmarks.driver', '--tracks', str(size),
+                       '--db', args.db or os.path.join(workdir, 'catalog.db'),
+                       '--concurrency', args.concurrency, '--requests', str(args.requests),
+                       '--seed', str(args.seed), '--out', part]
+            if args.scenarios:
+                command += ['--scenarios', args.scenarios]
+            # One process per size, the app binds its database when imported
+            subprocess.run(command, cwd=ROOT, check=True)
+            with open(part) as part_file:
+                results['sizes'][str(size)] = json.load(part_file)
+
+    with open(args.out, 'w') as out:
+        json.dump(results, out, indent=2)
+    print(f"Wrote {args.out}", file=sys.stderr)
+
+
+def compare(args):
+    with open(args.old) as old_file, open(args.new) as new_file:
+        old, new = json.load(old_file), json.load(new_file)
+    print(f"{old.get('commit') or args.old} -> {new.get('commit') or args.new}")
+    print(f"{'size':>9} {'scenario':<26} {'c':>3} {'p50 ms':>18} {'p95 ms':>18} {'rps':>16} {'q/req':>11}")
+
+    def change(before, after):
+        if not before or after is None:
+            return f"{after}"
+        return f"{after} ({(after - before) / before:+.0%})"
+
+    for size, new_size in new['sizes'].items():
+        old_size = old['sizes'].get(size, {})
+        for name, levels in new_size['scenarios'].items():
+            for level, result in levels.items():
+                before = old_size.get('scenarios', {}).get(name, {}).get(level, {})
+                print(f"{size:>9} {name:<26} {level:>3} {change(before.get('p50_ms'), result['p50_ms']):>18} "
+                      f"{change(before.get('p95_ms'), result['p95_ms']):>18} "
+                      f"{change(before.get('throughput_rps'), result['throughput_rps']):>16} "
+                      f"{change(before.get('queries_per_request'), result['queries_per_request']):>11}")
+        if old_size:
+            print(f"{size:>9} startup {change(old_size.get('startup_seconds'), new_size['startup_seconds'])} s, "
+                  f"ready {change(old_size.get('ready_seconds'), new_size.get('ready_seconds'))} s, "
+                  f"peak RSS {change(old_size.get('peak_rss_mb'), new_size['peak_rss_mb'])} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description="Benchmark the app on synthetic catalogs")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help="generate catalogs and benchmark every endpoint")
+    run_parser.add_argument('--sizes', default='1000,10000', help="comma separated track counts, 1000 to 10000000")
+    run_parser.add_argument('--concurrency', default='1,8,32')
+    run_parser.add_argument('--requests', type=int, default=200, help="requests per scenario and concurrency level")
+    run_parser.add_argument('--scenarios', default=None, help="comma separated, defaults to all (see scenarios.py)")
+    run_parser.add_argument('--db', default=None, help="SQLite file to use, defaults to a temporary one")
+    run_parser.add_argument('--seed', type=int, default=0)
+    run_parser.add_argument('--out', default='benchmark_results.json')
+    run_parser.set_defaults(handler=run)
+
+    compare_parser = commands.add_parser('compare', help="compare two result files")
+    compare_parser.add_argument('old')
+    compare_parser.add_argument('new')
+    compare_parser.set_defaults(handler=compare)
+
+    startup_parser = commands.add_parser('startup', help="fail if importing or starting the app got slow")
+    startup.add_arguments(startup_parser)
+    startup_parser.set_defaults(handler=startup.run)
+
+    plans_parser = commands.add_parser('plans', help="fail if a key query reads a whole table")
+    plans.add_arguments(plans_parser)
+    plans_parser.set_defaults(handler=plans.run)
+
+    args = parser.parse_args()
+    sys.exit(args.handler(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+"""Benchmark one catalog size in this process
+
+The app binds its database when it is imported, so every size runs in its own
+process: `python -m benchmarks` starts this module once per size.
+
+    python -m benchmarks.driver --tracks 10000 --db /tmp/bench.db --out part.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import resource
+import statistics
+import sys
+import time
+from pathlib import Path
+
+APP_DIR = Path(__file__).resolve().parent.parent / 'dcalalan_cs348_project'
+
+
+def _percentiles(latencies):
+    if len(latencies) < 2:
+        value = latencies[0] if latencies else 0.0
+        return value, value, value
+    cuts = statistics.quantiles(latencies, n=100, method='inclusive')
+    return cuts[49], cuts[94], cuts[98]
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class QueryCounter:
+    """Counts the statements an engine executes"""
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self._on_execute)
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+
+async def _measure(client, scenario, state, concurrency, requests, queries):
+    latencies = []
+    errors = 0
+    per_worker = max(1, requests // concurrency)
+
+    async def worker():
+        nonlocal errors
+        for _ in range(per_worker):
+            method, url, kwargs = scenario(state)
+            start = time.perf_counter()
+            response = await client.request(method, url, **kwargs)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                errors += 1
+
+    queries_before = queries.count
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+
+    p50, p95, p99 = _percentiles(latencies)
+    return {'requests': len(latencies),
+            'errors': errors,
+            'p50_ms': round(p50 * 1000, 3),
+            'p95_ms': round(p95 * 1000, 3),
+            'p99_ms': round(p99 * 1000, 3),
+            'throughput_rps': round(len(latencies) / elapsed, 1) if elapsed else None,
+            'queries_per_request': round((queries.count - queries_before) / len(latencies), 2),
+            'peak_rss_mb': round(_peak_rss_mb(), 1)}
+
+
+async def _drive(main, counts, names, concurrency_levels, requests, seed):
+    import httpx
+    from database import async_engine, async_session_local
+    from benchmarks import scenarios
+
+    results = {'scenarios': {}}
+    queries = QueryCounter(async_engine.sync_engine)
+
+    start = time.perf_counter()
+    async with main.app.router.lifespan_context(main.app):
+        results['startup_seconds'] = round(time.perf_counter() - start, 3)
+        # Measured once the indexes loading in the background are in
+        await main.coherence.reload()
+        results['ready_seconds'] = round(time.perf_counter() - start, 3)
+
+        async with async_session_local() as db:
+            state = await scenarios.prepare(db, counts, seed)
+
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://benchmark') as client:
+            for name in names:
+                scenario = scenarios.SCENARIOS[name]
+                if name == 'main_table_not_modified':
+                    state.etags['/main_table'] = (await client.get('/main_table')).headers.get('etag', '"none"')
+                # Warm up caches the way a running server would have them
+                method, url, kwargs = scenario(state)
+                await client.request(method, url, **kwargs)
+
+                results['scenarios'][name] = {
+                    str(concurrency): await _measure(client, scenario, state, concurrency, requests, queries)
+                    for concurrency in concurrency_levels}
+                print(f"  {name}: " + ", ".join(f"c={c} p50={r['p50_ms']}ms"
+                                                for c, r in results['scenarios'][name].items()), file=sys.stderr)
+    return results
+
+
+def run(db_path, tracks, concurrency_levels, requests, names=None, seed=0):
+    """Generate a catalog of `tracks` tracks at `db_path` and benchmark the app on it"""
+    db_path = Path(db_path).resolve()
+    if db_path.exists():
+        db_path.unlink()
+    os.environ['DATABASE_URL'] = f'sqlite:///{db_path}'
+    # The app imports its modules by their bare names and reads html_files/ relative to its directory
+    sys.path.insert(0, str(APP_DIR))
+    os.chdir(APP_DIR)
+
+    import schema
+    from benchmarks import scenarios, synthetic
+
+    schema.upgrade()
+    start = time.perf_counter()
+    counts = synthetic.generate(db_path, tracks, seed)
+    generate_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    import main
+    import_seconds = time.perf_counter() - start
+
+    names = names or list(scenarios.SCENARIOS)
+    results = asyncio.run(_drive(main, counts, names, concurrency_levels, requests, seed))
+    results.update({'tracks': tracks,
+                    'rows': counts,
+                    'generate_seconds': round(generate_seconds, 3),
+                    'import_seconds': round(import_seconds, 3),
+                    'peak_rss_mb': round(_peak_rss_mb(), 1)})
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tracks', type=int, required=True)
+    parser.add_argument('--db', required=True, help="SQLite file to (re)create")
+    parser.add_argument('--concurrency', default='1,8,32')
+    parser.add_argument('--requests', type=int, default=200, help="requests per scenario and concurrency level")
+    parser.add_argument('--scenarios', default=None, help="comma separated, defaults to all")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', required=True)
+    args = parser.parse_args(argv)
+
+    results = run(args.db, args.tracks, [int(level) for level in args.concurrency.split(',')], args.requests,
+                  args.scenarios.split(',') if args.scenarios else None, args.seed)
+    with open(args.out, 'w') as out:
+        json.dump(results, out, indent=2)
+
+
+if __name__ == '__main__':
+    main()
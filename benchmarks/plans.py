@@ -0,0 +1,200 @@
+"""Query plan regression check
+
+Seeds a synthetic catalog into a temporary SQLite database (or uses the one at
+DATABASE_URL with --existing), runs the app's key queries through the code that
+builds them, and EXPLAINs every statement they sent. Fails when any of them reads
+a whole table instead of going through an index.
+
+    python -m benchmarks plans --tracks 20000
+    DATABASE_URL=mysql+pymysql://... python -m benchmarks plans --existing
+
+Writes are rolled back, so an existing database is left as it was.
+"""
+
+import argparse
+import asyncio
+import os
+import re
+import sys
+import tempfile
+from types import SimpleNamespace
+
+from benchmarks.driver import APP_DIR
+
+# Tables the app reads; a full scan of anything else (subqueries, temporary b-trees) is fine
+APP_TABLES = ('artists', 'listeners', 'tracks', 'albums', 'genres', 'playlists', 'playlist_tracks',
+              'track_popularity', 'artist_popularity')
+
+
+class StatementLog:
+    """Collects the statements an engine executes, with their parameters"""
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+
+        self.statements = []
+        event.listen(engine, 'before_cursor_execute', self._on_execute)
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        # Bulk inserts and updates don't have a plan worth checking
+        if not executemany and statement.lstrip().upper().startswith(('SELECT', 'WITH', 'UPDATE', 'DELETE')):
+            self.statements.append((statement, parameters))
+
+    def take(self):
+        statements, self.statements = self.statements, []
+        return statements
+
+
+def _sqlite_scans(conn, statement, parameters):
+    rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).all()
+    plan = [row[-1] for row in rows]
+    scans = []
+    for detail in plan:
+        # "SCAN tracks", "SCAN T" (aliased) or "SCAN tracks USING INDEX ..." for a whole index
+        match = re.match(r'SCAN (\w+)(?: AS (\w+))?', detail)
+        if match and match.group(1) in APP_TABLES:
+            scans.append(detail)
+    return plan, scans
+
+
+def _mysql_scans(conn, statement, parameters):
+    result = conn.exec_driver_sql(f"EXPLAIN {statement}", parameters)
+    rows = [dict(zip(result.keys(), row)) for row in result]
+    plan = [f"{row['table']}: type={row['type']} key={row['key']} rows={row['rows']}" for row in rows]
+    # ALL reads every row, index reads every entry of an index
+    scans = [line for line, row in zip(plan, rows)
+             if row['type'] in ('ALL', 'index') and row['table'] in APP_TABLES]
+    return plan, scans
+
+
+def _checks(counts):
+    """(name, async function of db running one of the app's key queries)"""
+    import main
+    import models
+    import deletes
+    import playlist_view
+    import listener_report
+    import popularity
+    from analytics import live
+    from pagination import encode_cursor
+    from sqlalchemy import select
+
+    track_id = max(1, counts['tracks'] // 2)
+    user_id = max(1, counts['listeners'] // 2)
+    playlist_id = max(1, counts['playlists'] // 2)
+    album_id = max(1, counts['albums'] // 2)
+    artist_id = max(1, counts['artists'] // 2)
+
+    async def track_page(db, sort_attribute, order):
+        column = main.TRACK_SORT_COLUMNS[sort_attribute]
+        value = (await db.execute(select(column).where(models.Tracks.track_id == track_id))).scalar()
+        await main.render_track_page(db, sort_attribute, order, encode_cursor([value, track_id]))
+
+    checks = []
+    for sort_attribute in main.TRACK_SORT_COLUMNS:
+        for order in ('ASC', 'DESC'):
+            checks.append((f"/main_table sorted by {sort_attribute} {order}",
+                           lambda db, sort_attribute=sort_attribute, order=order: track_page(db, sort_attribute, order)))
+
+    checks += [
+        ("/playlist_access page", lambda db: playlist_view.render_playlist_page(
+            db, SimpleNamespace(playlist_id=playlist_id), encode_cursor([track_id, track_id]))),
+        ("/listener_report/{id} playlists", lambda db: listener_report.playlist_rows(live(db), user_id)),
+        ("/listener_report overview", lambda db: listener_report.overview(live(db), user_id, user_id + 49)),
+        ("/listener_report top artists", lambda db: listener_report.top_artists(live(db), user_id, user_id + 49)),
+        ("/listener_report top genres", lambda db: listener_report.top_genres(live(db), user_id, user_id + 49)),
+        ("popularity after adding a track", lambda db: popularity.tracks_added(db, [track_id])),
+        ("popularity recount", lambda db: popularity.recount_tracks(db, [track_id])),
+        ("popularity after deleting a track", lambda db: popularity.tracks_deleted(db, [track_id])),
+        ("deleting tracks", lambda db: deletes.delete_tracks(db, [track_id, track_id + 1])),
+        ("deleting an album", lambda db: deletes.delete_album(db, album_id)),
+        ("deleting an artist", lambda db: deletes.delete_artist(db, artist_id)),
+        ("playlist entries of a track", lambda db: db.execute(
+            select(models.Playlist_Tracks).where(models.Playlist_Tracks.track_id == track_id))),
+        ("tracks of an album", lambda db: db.execute(
+            select(models.Tracks).where(models.Tracks.album_id == album_id))),
+        ("albums of an artist", lambda db: db.execute(
+            select(models.Albums).where(models.Albums.artist_id == artist_id))),
+        ("playlists of a listener", lambda db: db.execute(
+            select(models.Playlists).where(models.Playlists.user_id == user_id))),
+    ]
+    return checks
+
+
+async def _collect(counts):
+    """[(check name, [(statement, parameters), ...])], every write rolled back"""
+    from database import async_engine, async_session_local
+
+    log = StatementLog(async_engine.sync_engine)
+    collected = []
+    for name, check in _checks(counts):
+        async with async_session_local() as db:
+            await check(db)
+            await db.rollback()
+        collected.append((name, log.take()))
+    return collected
+
+
+def _counts(engine):
+    import models
+    from sqlalchemy import func, select
+
+    tables = {'tracks': models.Tracks, 'albums': models.Albums, 'artists': models.Artists,
+              'listeners': models.Listeners, 'playlists': models.Playlists}
+    with engine.connect() as conn:
+        return {name: conn.execute(select(func.count()).select_from(model)).scalar() for name, model in tables.items()}
+
+
+def run(args):
+    with tempfile.TemporaryDirectory() as workdir:
+        if not args.existing:
+            db_path = os.path.join(workdir, 'catalog.db')
+            os.environ['DATABASE_URL'] = f'sqlite:///{db_path}'
+        os.environ.setdefault('VERSIONS_FILE', os.path.join(workdir, 'versions'))
+        # The app imports its modules by their bare names
+        sys.path.insert(0, str(APP_DIR))
+        os.chdir(APP_DIR)
+        import schema
+        from database import engine
+
+        if not args.existing:
+            from benchmarks import synthetic
+
+            schema.upgrade()
+            synthetic.generate(db_path, args.tracks)
+            with engine.begin() as conn:
+                # Give the planner the statistics a real database would have
+                conn.exec_driver_sql('ANALYZE')
+
+        collected = asyncio.run(_collect(_counts(engine)))
+
+        explain = _sqlite_scans if engine.dialect.name == 'sqlite' else _mysql_scans
+        failures = 0
+        with engine.connect() as conn:
+            for name, statements in collected:
+                for statement, parameters in statements:
+                    plan, scans = explain(conn, statement, parameters)
+                    if scans:
+                        failures += 1
+                        print(f"FAIL: {name} scans {', '.join(scans)}", file=sys.stderr)
+                        print(f"    {' '.join(statement.split())}", file=sys.stderr)
+                        for line in plan:
+                            print(f"    | {line}", file=sys.stderr)
+                    elif args.verbose:
+                        print(f"{name}: {'; '.join(plan)}")
+
+    checked = sum(len(statements) for _, statements in collected)
+    print(f"{checked} statements from {len(collected)} queries, {failures} with a full scan")
+    return 1 if failures else 0
+
+
+def add_arguments(parser):
+    parser.add_argument('--tracks', type=int, default=20000, help="size of the seeded catalog")
+    parser.add_argument('--existing', action='store_true', help="check the database at DATABASE_URL instead of seeding one")
+    parser.add_argument('--verbose', action='store_true', help="print the plan of every statement")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_arguments(parser)
+    sys.exit(run(parser.parse_args()))
@@ -0,0 +1,147 @@
+"""The requests each benchmark sends, one scenario per endpoint of main.py
+
+A scenario is a function taking the shared `State` and returning the
+(method, url, keyword arguments for httpx) of the next request. Reads come
+first and writes last, and /delete_track deletes each track only once.
+"""
+
+import random
+
+from pagination import encode_cursor
+
+
+class State:
+    def __init__(self, counts, cursors, seed=0):
+        self.counts = counts
+        # `after` cursors of a few pages deep into the track_name DESC order
+        self.cursors = cursors
+        self.rng = random.Random(seed)
+        self.etags = {}
+        self.next_delete = counts['tracks']
+
+    def track_id(self):
+        return self.rng.randint(1, self.counts['tracks'])
+
+    def row_id(self, table):
+        return self.rng.randint(1, self.counts[table])
+
+
+async def prepare(db, counts, seed=0):
+    """Build the State, reading the cursors it needs from the database"""
+    import models
+    from sqlalchemy import select
+
+    rows = (await db.execute(select(models.Tracks.track_name, models.Tracks.track_id)
+                             .order_by(models.Tracks.track_name.desc(), models.Tracks.track_id.desc())
+                             .limit(1000))).all()
+    cursors = [encode_cursor([name, track_id]) for name, track_id in rows[49::50]] or [None]
+    return State(counts, cursors, seed)
+
+
+def root(state):
+    return 'GET', '/', {}
+
+
+def main_table(state):
+    return 'GET', '/main_table', {}
+
+
+def main_table_sorted_page(state):
+    after = state.rng.choice(state.cursors)
+    params = {'sort_attribute': 'track_name', 'order': 'DESC'}
+    if after:
+        params['after'] = after
+    return 'GET', '/main_table', {'params': params}
+
+
+def main_table_not_modified(state):
+    # Filled in by the driver with the ETag of a previous /main_table response
+    return 'GET', '/main_table', {'headers': {'If-None-Match': state.etags.get('/main_table', '"none"')}}
+
+
+def sorted_redirect(state):
+    return 'POST', '/sorted', {'data': {'sort_attribute': state.rng.choice(['track_name', 'genre', 'album_id']),
+                                        'order': state.rng.choice(['ASC', 'DESC'])}}
+
+
+def report(state):
+    return 'GET', '/report', {}
+
+
+def playlist_report(state):
+    return 'GET', '/playlist_report', {}
+
+
+def playlist_access(state):
+    return 'POST', '/playlist_access', {'data': {'chosen_playlist_id': str(state.row_id('playlists'))}}
+
+
+def playlist_page(state):
+    return 'GET', f'/playlist_access/{state.row_id("playlists")}', {}
+
+
+def pool_stats(state):
+    return 'GET', '/pool_stats', {}
+
+
+def catalog_check(state):
+    return 'GET', '/catalog/check', {}
+
+
+def added_playlist(state):
+    return 'POST', '/added_playlist', {'data': {'playlist_name': f'bench {state.rng.random()}',
+                                                'user_id': str(state.row_id('listeners'))}}
+
+
+def added_to_playlist(state):
+    return 'POST', '/added_to_playlist', {'data': {'playlist_to_add_to': str(state.row_id('playlists')),
+                                                   'track': str(state.track_id())}}
+
+
+def added_tracks(state):
+    return 'POST', '/added_tracks', {'data': {'track_name': f'bench {state.rng.random()}',
+                                              'album_to_add_to': str(state.row_id('albums')),
+                                              'artist_to_add_to': str(state.row_id('artists')),
+                                              'genre_to_add_to': 'Pop'}}
+
+
+def added_album(state):
+    return 'POST', '/added_album', {'data': {'album_name': f'bench {state.rng.random()}',
+                                             'artist_to_add_to': str(state.row_id('artists'))}}
+
+
+def added_artist(state):
+    return 'POST', '/added_artist', {'data': {'artist_name': f'bench {state.rng.random()}'}}
+
+
+def update_track(state):
+    return 'POST', '/update_track', {'data': {'track_to_update': str(state.track_id()),
+                                              'new_track_name': f'bench {state.rng.random()}'}}
+
+
+def delete_track(state):
+    track_id = state.next_delete
+    state.next_delete -= 1
+    return 'POST', '/delete_track', {'data': {'track_to_delete': str(track_id)}}
+
+
+SCENARIOS = {
+    'root': root,
+    'main_table': main_table,
+    'main_table_sorted_page': main_table_sorted_page,
+    'main_table_not_modified': main_table_not_modified,
+    'sorted': sorted_redirect,
+    'report': report,
+    'playlist_report': playlist_report,
+    'playlist_access': playlist_access,
+    'playlist_page': playlist_page,
+    'pool_stats': pool_stats,
+    'catalog_check': catalog_check,
+    'added_playlist': added_playlist,
+    'added_to_playlist': added_to_playlist,
+    'added_tracks': added_tracks,
+    'added_album': added_album,
+    'added_artist': added_artist,
+    'update_track': update_track,
+    'delete_track': delete_track,
+}
@@ -0,0 +1,117 @@
+"""Startup time guard
+
+Imports the app and runs its startup in fresh processes against a synthetic
+catalog, and fails when the median time is over budget or when a module that
+should only be loaded by the endpoints needing it was imported. Startup is the
+time until the app serves requests, ready the time until the in-memory indexes
+it loads in the background are in as well.
+
+    python -m benchmarks startup --runs 5 --max-import-seconds 1.5 --max-startup-seconds 0.5
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.driver import APP_DIR
+
+# Loaded on demand (exports, analytics, recommendations), never by importing the app
+LAZY_MODULES = ('pandas', 'duckdb', 'pyarrow', 'numpy', 'scipy')
+
+
+def _prepare(db_path, tracks):
+    sys.path.insert(0, str(APP_DIR))
+    os.chdir(APP_DIR)
+    import schema
+    from benchmarks import synthetic
+
+    schema.upgrade()
+    synthetic.generate(db_path, tracks)
+
+
+def _probe():
+    """Import the app and run its startup once, in this process"""
+    import asyncio
+
+    sys.path.insert(0, str(APP_DIR))
+    os.chdir(APP_DIR)
+
+    start = time.perf_counter()
+    import main
+    import_seconds = time.perf_counter() - start
+    loaded = [name for name in LAZY_MODULES if name in sys.modules]
+
+    async def startup():
+        start = time.perf_counter()
+        async with main.app.router.lifespan_context(main.app):
+            startup_seconds = time.perf_counter() - start
+            await main.coherence.reload()
+            return startup_seconds, time.perf_counter() - start
+
+    startup_seconds, ready_seconds = asyncio.run(startup())
+    print(json.dumps({'import_seconds': import_seconds, 'startup_seconds': startup_seconds,
+                      'ready_seconds': ready_seconds, 'lazy_loaded': loaded}))
+
+
+def _run_self(*args, env):
+    return subprocess.run([sys.executable, '-m', 'benchmarks.startup', *args], env=env, check=True,
+                          capture_output=True, text=True, cwd=APP_DIR.parent).stdout
+
+
+def run(args):
+    with tempfile.TemporaryDirectory() as workdir:
+        db_path = os.path.join(workdir, 'catalog.db')
+        env = dict(os.environ, DATABASE_URL=f'sqlite:///{db_path}', ANALYTICS_DIR=os.path.join(workdir, 'analytics'),
+                   VERSIONS_FILE=os.path.join(workdir, 'versions'))
+        _run_self('--prepare', '--db', db_path, '--tracks', str(args.tracks), env=env)
+        probes = [json.loads(_run_self('--probe', env=env).splitlines()[-1]) for _ in range(args.runs)]
+
+    import_seconds = statistics.median(probe['import_seconds'] for probe in probes)
+    startup_seconds = statistics.median(probe['startup_seconds'] for probe in probes)
+    ready_seconds = statistics.median(probe['ready_seconds'] for probe in probes)
+    loaded = sorted({name for probe in probes for name in probe['lazy_loaded']})
+    print(f"import {import_seconds:.3f} s (budget {args.max_import_seconds} s), "
+          f"startup {startup_seconds:.3f} s (budget {args.max_startup_seconds} s), "
+          f"ready {ready_seconds:.3f} s (budget {args.max_ready_seconds} s), "
+          f"median of {args.runs} runs with {args.tracks} tracks")
+
+    failures = []
+    if import_seconds > args.max_import_seconds:
+        failures.append(f"importing the app took {import_seconds:.3f} s")
+    if startup_seconds > args.max_startup_seconds:
+        failures.append(f"starting the app took {startup_seconds:.3f} s")
+    if ready_seconds > args.max_ready_seconds:
+        failures.append(f"loading the indexes took {ready_seconds:.3f} s")
+    if loaded:
+        failures.append(f"importing the app loaded {', '.join(loaded)}")
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+def add_arguments(parser):
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--tracks', type=int, default=10000, help="size of the catalog loaded at startup")
+    parser.add_argument('--max-import-seconds', type=float, default=1.5)
+    parser.add_argument('--max-startup-seconds', type=float, default=0.5)
+    parser.add_argument('--max-ready-seconds', type=float, default=3.0)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--prepare', action='store_true')
+    parser.add_argument('--probe', action='store_true')
+    parser.add_argument('--db')
+    add_arguments(parser)
+    args = parser.parse_args()
+    if args.prepare:
+        _prepare(args.db, args.tracks)
+    elif args.probe:
+        _probe()
+    else:
+        sys.exit(run(args))
@@ -0,0 +1,106 @@
+"""Synthetic catalogs with a realistic skew
+
+A catalog is sized by its number of tracks. Artists, albums, listeners and
+playlists are derived from it, and popularity follows a Zipf distribution: a few
+artists have most of the albums, and a few tracks are in most of the playlists.
+Rows are written with the sqlite3 module in large executemany batches, the schema
+itself comes from the app's models.
+"""
+
+import itertools
+import random
+import sqlite3
+
+GENRES = ['Pop', 'Rock', 'Hip Hop', 'Jazz', 'Classical', 'Country', 'Electronic', 'R&B', 'Metal', 'Folk']
+WORDS = ['love', 'night', 'dance', 'heart', 'fire', 'rain', 'blue', 'baby', 'time', 'dream',
+         'summer', 'city', 'road', 'gold', 'river', 'light', 'wild', 'home', 'star', 'ghost']
+
+# Zipf exponent of the artist -> album and track -> playlist choices
+SKEW = 1.1
+BATCH_SIZE = 50000
+
+
+def sizes(tracks):
+    """Row counts of every table for a catalog of `tracks` tracks"""
+    return {
+        'artists': max(10, tracks // 100),
+        'albums': max(20, tracks // 10),
+        'tracks': tracks,
+        'listeners': max(10, tracks // 20),
+        'playlists': max(10, tracks // 50),
+        # Average playlist length is about 100 tracks
+        'playlist_tracks': max(100, tracks * 2),
+    }
+
+
+def _zipf_weights(n):
+    return list(itertools.accumulate(1 / (rank ** SKEW) for rank in range(1, n + 1)))
+
+
+def _name(rng, prefix, number):
+    return f"{' '.join(rng.choices(WORDS, k=2)).title()} {prefix}{number}"
+
+
+def _insert(db, table, rows):
+    rows = iter(rows)
+    while batch := list(itertools.islice(rows, BATCH_SIZE)):
+        placeholders = ', '.join('?' * len(batch[0]))
+        db.executemany(f"INSERT INTO {table} VALUES ({placeholders})", batch)
+
+
+def generate(path, tracks, seed=0):
+    """Fill the (already created, empty) tables of the SQLite database at `path`"""
+    rng = random.Random(seed)
+    counts = sizes(tracks)
+
+    db = sqlite3.connect(path)
+    db.execute("PRAGMA journal_mode = OFF")
+    db.execute("PRAGMA synchronous = OFF")
+
+    _insert(db, 'genres', [(genre,) for genre in GENRES])
+    _insert(db, 'artists', ((artist_id, _name(rng, 'Artist ', artist_id))
+                            for artist_id in range(1, counts['artists'] + 1)))
+    _insert(db, 'listeners', ((user_id, f"listener{user_id}") for user_id in range(1, counts['listeners'] + 1)))
+
+    album_artists = rng.choices(range(1, counts['artists'] + 1), cum_weights=_zipf_weights(counts['artists']),
+                                k=counts['albums'])
+    _insert(db, 'albums', ((album_id, _name(rng, 'Album ', album_id), album_artists[album_id - 1])
+                           for album_id in range(1, counts['albums'] + 1)))
+
+    genre_weights = _zipf_weights(len(GENRES))
+    _insert(db, 'tracks', ((track_id, _name(rng, 'Track ', track_id), album_id, album_artists[album_id - 1],
+                            rng.choices(GENRES, cum_weights=genre_weights)[0])
+                           for track_id, album_id in enumerate(rng.choices(range(1, counts['albums'] + 1),
+                                                                           k=counts['tracks']), start=1)))
+
+    _insert(db, 'playlists', ((playlist_id, _name(rng, 'Playlist ', playlist_id),
+                               rng.randint(1, counts['listeners']))
+                              for playlist_id in range(1, counts['playlists'] + 1)))
+
+    # Popular tracks are spread over the whole id range, not just the oldest ids
+    by_popularity = list(range(1, tracks + 1))
+    rng.shuffle(by_popularity)
+    track_weights = _zipf_weights(tracks)
+    per_playlist = counts['playlist_tracks'] // counts['playlists']
+
+    def playlist_tracks():
+        for playlist_id in range(1, counts['playlists'] + 1):
+            length = min(tracks, max(1, int(rng.expovariate(1 / per_playlist))))
+            picks = rng.choices(by_popularity, cum_weights=track_weights, k=length)
+            for track_id in sorted(set(picks)):
+                yield playlist_id, track_id
+
+    _insert(db, 'playlist_tracks', playlist_tracks())
+
+    # The app's popularity counters, as the schema migration fills them for existing playlists
+    db.execute("INSERT INTO track_popularity (track_id, artist_id, playlist_count) "
+               "SELECT tracks.track_id, tracks.artist_id, COUNT(*) FROM tracks "
+               "JOIN playlist_tracks ON playlist_tracks.track_id = tracks.track_id "
+               "GROUP BY tracks.track_id, tracks.artist_id")
+    db.execute("INSERT INTO artist_popularity (artist_id, top_playlist_count) "
+               "SELECT artist_id, MAX(playlist_count) FROM track_popularity "
+               "WHERE artist_id IS NOT NULL GROUP BY artist_id")
+
+    db.commit()
+    db.close()
+    return counts
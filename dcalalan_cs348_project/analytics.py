@@ -0,0 +1,324 @@
+"""Columnar analytics snapshot of the database
+
+Aggregate reports can read a Parquet copy of the tables through DuckDB instead
+of running their GROUP BYs against the database that serves the writes. It is off
+unless ANALYTICS_REFRESH_SECONDS is set. A refresh exports every table in
+models.py under ANALYTICS_DIR:
+
+- tables with a single integer primary key only export the rows above the
+  highest id already exported (the watermark) as a new part file,
+- playlist_tracks, genres, the popularity counters (updated in place, but one
+  row per track or artist) and any table whose row count shows deletes are
+  exported in full, and so is every table once FULL_REFRESH_SECONDS have passed,
+  which also picks up rows updated in place (e.g. renamed tracks).
+
+manifest.json lists the part files of every table and when they were taken. It
+is replaced atomically, so queries always see a complete snapshot, and the files
+of the snapshot before it are kept until the next refresh for queries still
+reading them. Reports state how old the snapshot is.
+
+With several workers, one of them (whichever holds the lock on the directory)
+refreshes the snapshot and bumps the 'analytics_snapshot' counter in versions.py,
+the others load the new manifest on their next report.
+
+Queries are SQLAlchemy statements over the models, compiled to SQL that DuckDB
+runs against views with the same table names, so a report has one definition
+for both sources.
+
+Configured through environment variables:
+
+ANALYTICS_DIR                    where the snapshot is written
+ANALYTICS_REFRESH_SECONDS        how often the app refreshes it, 0 (default) turns the snapshot off
+ANALYTICS_FULL_REFRESH_SECONDS   how often every table is exported in full
+
+To refresh it from the command line run `python analytics.py refresh [--full]`.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from sqlalchemy import Integer, select, func
+from sqlalchemy.dialects import postgresql
+
+import models
+import versions
+from database import Base, async_session_local
+
+SNAPSHOT_DIR = os.environ.get('ANALYTICS_DIR',
+                              os.path.join(os.path.dirname(os.path.abspath(__file__)), 'analytics_snapshot'))
+REFRESH_SECONDS = float(os.environ.get('ANALYTICS_REFRESH_SECONDS', 0))
+FULL_REFRESH_SECONDS = float(os.environ.get('ANALYTICS_FULL_REFRESH_SECONDS', 3600))
+
+# Rewritten in place on every playlist change, so the watermark doesn't catch up with them
+FULL_TABLES = {'track_popularity', 'artist_popularity'}
+
+# Rows per Parquet part file
+BATCH_SIZE = 100000
+MANIFEST = 'manifest.json'
+
+logger = logging.getLogger(__name__)
+
+
+def _watermark_column(table):
+    """The table's primary key column if it is a single integer, else None"""
+    columns = list(table.primary_key.columns)
+    if len(columns) == 1 and isinstance(columns[0].type, Integer):
+        return columns[0]
+    return None
+
+
+def _write_part(table, rows, path):
+    """Write `rows` (tuples in column order) to a Parquet file with DuckDB"""
+    import duckdb
+    import pandas as pd
+
+    frame = pd.DataFrame.from_records(rows, columns=[column.name for column in table.columns])
+    # Nullable integers keep their type instead of becoming floats
+    for column in table.columns:
+        if isinstance(column.type, Integer):
+            frame[column.name] = frame[column.name].astype('Int64')
+    with duckdb.connect() as con:
+        con.register('part', frame)
+        con.execute(f"COPY part TO '{path}' (FORMAT parquet)")
+
+
+async def _export(db, table, directory, where=None):
+    """Export the rows of `table` (matching `where`) into part files, returns (files, rows, highest id)"""
+    stmt = select(*table.columns).order_by(*table.primary_key.columns)
+    if where is not None:
+        stmt = stmt.where(where)
+    watermark_column = _watermark_column(table)
+
+    files = []
+    count = 0
+    highest = None
+    result = await db.stream(stmt.execution_options(yield_per=BATCH_SIZE))
+    async for rows in result.partitions():
+        path = os.path.join(directory, f"{table.name}-{uuid.uuid4().hex}.parquet")
+        await asyncio.to_thread(_write_part, table, rows, path)
+        files.append(os.path.basename(path))
+        count += len(rows)
+        if watermark_column is not None:
+            highest = getattr(rows[-1], watermark_column.name)
+    return files, count, highest
+
+
+class Snapshot:
+    def __init__(self, manifest):
+        self.manifest = manifest
+        self.taken_at = manifest['taken_at']
+        self._local = threading.local()
+
+    def files(self):
+        return {os.path.join(SNAPSHOT_DIR, name)
+                for entry in self.manifest['tables'].values() for name in entry['files']}
+
+    def _connection(self):
+        # DuckDB connections aren't shared between threads, each worker thread gets its own
+        con = getattr(self._local, 'con', None)
+        if con is None:
+            import duckdb
+
+            con = duckdb.connect()
+            for name, entry in self.manifest['tables'].items():
+                paths = [os.path.join(SNAPSHOT_DIR, file) for file in entry['files']]
+                if paths:
+                    con.execute(f"CREATE VIEW {name} AS SELECT * FROM read_parquet({paths!r})")
+                else:
+                    # An empty table, keep its columns so queries still bind
+                    columns = ", ".join(f"CAST(NULL AS {'BIGINT' if isinstance(column.type, Integer) else 'VARCHAR'})"
+                                        f" AS {column.name}" for column in Base.metadata.tables[name].columns)
+                    con.execute(f"CREATE VIEW {name} AS SELECT {columns} WHERE false")
+            self._local.con = con
+        return con
+
+    def query(self, stmt):
+        sql = str(stmt.compile(dialect=postgresql.dialect(), compile_kwargs={'literal_binds': True}))
+        return self._connection().execute(sql).fetchall()
+
+
+_snapshot = None
+# Version of 'analytics_snapshot' when _snapshot was loaded
+_loaded_version = None
+_refresh_lock = asyncio.Lock()
+_refresher_fd = None
+
+
+def current():
+    """The snapshot reports should read, or None when there is none yet"""
+    global _snapshot, _loaded_version
+    if REFRESH_SECONDS <= 0:
+        return None
+    version = versions.get('analytics_snapshot')
+    if version != _loaded_version:
+        # Another process refreshed it (or this one just started), read the new manifest
+        manifest = _load_manifest()
+        _snapshot = Snapshot(manifest) if manifest is not None else None
+        _loaded_version = version
+    return _snapshot
+
+
+def live(db):
+    """An async function returning the rows of a statement run on `db`"""
+    async def run(stmt):
+        return (await db.execute(stmt)).all()
+    return run
+
+
+def reader(db):
+    """(run, snapshot) where `await run(stmt)` returns the rows of `stmt` from the
+    current snapshot, or from `db` when there is no snapshot (then snapshot is None)"""
+    snapshot = current()
+    if snapshot is None:
+        return live(db), None
+
+    async def run(stmt):
+        # DuckDB blocks while it scans, keep the event loop free
+        return await asyncio.to_thread(snapshot.query, stmt)
+    return run, snapshot
+
+
+def tables(snapshot, live_tables):
+    """The versions a page's ETag depends on, depending on where it reads from"""
+    return ['analytics_snapshot'] if snapshot is not None else live_tables
+
+
+def _load_manifest():
+    try:
+        with open(os.path.join(SNAPSHOT_DIR, MANIFEST)) as manifest_file:
+            return json.load(manifest_file)
+    except FileNotFoundError:
+        return None
+
+
+def _save_manifest(manifest):
+    path = os.path.join(SNAPSHOT_DIR, MANIFEST)
+    with open(path + '.tmp', 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=1)
+    os.replace(path + '.tmp', path)
+
+
+def _claim_refresher():
+    """Whether this process refreshes the snapshot, only one worker does at a time
+
+    The lock on the directory is held until the process exits, then another
+    worker takes over."""
+    global _refresher_fd
+    if _refresher_fd is not None or fcntl is None:
+        return True
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    fd = os.open(os.path.join(SNAPSHOT_DIR, 'refresh.lock'), os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return False
+    _refresher_fd = fd
+    return True
+
+
+async def refresh(full=False):
+    """Bring the snapshot up to date and swap it in, returns the new manifest"""
+    global _snapshot, _loaded_version
+    if not _claim_refresher():
+        raise RuntimeError(f"Another process is refreshing the snapshot in {SNAPSHOT_DIR}")
+    async with _refresh_lock:
+        os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+        previous = _load_manifest()
+        taken_at = time.time()
+        manifest = {'taken_at': taken_at, 'tables': {}}
+
+        async with async_session_local() as db:
+            for name, table in Base.metadata.tables.items():
+                entry = (previous or {'tables': {}})['tables'].get(name)
+                watermark_column = _watermark_column(table)
+                incremental = (not full and entry is not None and watermark_column is not None
+                               and name not in FULL_TABLES
+                               and taken_at - entry['full_at'] < FULL_REFRESH_SECONDS)
+
+                if incremental:
+                    total = (await db.execute(select(func.count()).select_from(table))).scalar()
+                    new = watermark_column > entry['watermark'] if entry['watermark'] is not None else None
+                    files, count, highest = await _export(db, table, SNAPSHOT_DIR, new)
+                    if entry['rows'] + count == total:
+                        manifest['tables'][name] = {'files': entry['files'] + files, 'rows': total,
+                                                    'watermark': highest if highest is not None else entry['watermark'],
+                                                    'full_at': entry['full_at']}
+                        continue
+                    # Rows were deleted (or inserted below the watermark), start over
+                    for file in files:
+                        os.remove(os.path.join(SNAPSHOT_DIR, file))
+
+                files, count, highest = await _export(db, table, SNAPSHOT_DIR)
+                manifest['tables'][name] = {'files': files, 'rows': count, 'watermark': highest, 'full_at': taken_at}
+
+        _save_manifest(manifest)
+        _snapshot = Snapshot(manifest)
+        versions.bump('analytics_snapshot')
+        _loaded_version = versions.get('analytics_snapshot')
+
+        # Files of the snapshots before the previous one can't be in use anymore
+        keep = _snapshot.files()
+        if previous is not None:
+            keep |= Snapshot(previous).files()
+        for name in os.listdir(SNAPSHOT_DIR):
+            path = os.path.join(SNAPSHOT_DIR, name)
+            if name.endswith('.parquet') and path not in keep:
+                os.remove(path)
+
+        logger.info("Refreshed the analytics snapshot in %.1f s", time.time() - taken_at)
+        return manifest
+
+
+async def keep_fresh():
+    """Refresh the snapshot every REFRESH_SECONDS, run as a background task
+
+    The snapshot left by the last run is served until then, and the first refresh
+    only appends to it. Workers that aren't the refresher keep checking whether
+    they have to take over."""
+    if REFRESH_SECONDS <= 0:
+        return
+    while True:
+        if _claim_refresher():
+            try:
+                await refresh()
+            except Exception:
+                logger.exception("Refreshing the analytics snapshot failed")
+        await asyncio.sleep(REFRESH_SECONDS)
+
+
+def staleness(snapshot):
+    """A sentence saying how current a report's data is"""
+    if snapshot is None:
+        return "<p>Computed live from the database.</p>"
+    taken_at = time.strftime('%Y-%m-%d %H:%M:%S UTC', time.gmtime(snapshot.taken_at))
+    return (f"<p>Data as of {taken_at} (analytics snapshot, refreshed every {REFRESH_SECONDS / 60:g} minutes); "
+            f"changes made since then are not included yet.</p>")
+
+
+async def _main(full):
+    from database import async_engine
+
+    manifest = await refresh(full)
+    await async_engine.dispose()
+    for name, entry in manifest['tables'].items():
+        print(f"{name}: {entry['rows']} rows in {len(entry['files'])} files")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('command', choices=['refresh'])
+    parser.add_argument('--full', action='store_true', help="export every table in full")
+    args = parser.parse_args()
+    asyncio.run(_main(args.full))
@@ -0,0 +1,121 @@
+"""Paginated JSON read API
+
+Every list endpoint takes `limit` and an `after` cursor (see pagination.py), an
+optional comma separated `fields` list, and `ids=1,2,3` to fetch specific rows in
+one call. Responses look like {"items": [...], "next": <cursor or null>}.
+"""
+
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import ORJSONResponse
+from sqlalchemy import select
+
+import models
+from database import db_dependency
+from pagination import keyset_page, TRACK_SORT_COLUMNS
+from schemas import TracksOut, AlbumsOut, ArtistsOut, PlaylistsOut
+
+MAX_PAGE_SIZE = 500
+
+
+router = APIRouter(prefix="/api", default_response_class=ORJSONResponse)
+
+
+def _parse_fields(fields, schema):
+    if not fields:
+        return list(schema.model_fields)
+    selected = [field.strip() for field in fields.split(',') if field.strip()]
+    unknown = [field for field in selected if field not in schema.model_fields]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return selected
+
+
+def _parse_ids(ids):
+    try:
+        parsed = [int(item) for item in ids.split(',') if item.strip()]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="ids must be a comma separated list of integers")
+    if len(parsed) > MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_PAGE_SIZE} ids can be fetched at once")
+    return parsed
+
+
+async def _list(db, stmt, schema, key_column, sort_column=None, order='ASC', after=None, limit=50, fields=None, ids=None):
+    """Shared implementation of the list endpoints"""
+    selected = _parse_fields(fields, schema)
+
+    if ids is not None:
+        wanted = _parse_ids(ids)
+        rows = (await db.execute(stmt.where(key_column.in_(wanted)))).scalars().all()
+        # Return the rows in the order they were asked for
+        by_id = {getattr(row, key_column.key): row for row in rows}
+        rows = [by_id[row_id] for row_id in wanted if row_id in by_id]
+        next_cursor = None
+    else:
+        try:
+            rows, next_cursor = await keyset_page(db, stmt, sort_column if sort_column is not None else key_column, key_column,
+                                                  order, after, limit)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    # Returned as a response so the items skip jsonable_encoder and go straight to orjson
+    return ORJSONResponse({'items': [{field: getattr(row, field) for field in selected} for row in rows],
+                           'next': next_cursor})
+
+
+@router.get("/tracks")
+async def list_tracks(db: db_dependency,
+                      limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
+                      after: str = None,
+                      sort: str = 'track_id',
+                      order: str = 'ASC',
+                      fields: str = None,
+                      ids: str = None):
+    if sort not in TRACK_SORT_COLUMNS:
+        raise HTTPException(status_code=400, detail=f"Cannot sort by {sort}")
+    return await _list(db, select(models.Tracks), TracksOut, models.Tracks.track_id, TRACK_SORT_COLUMNS[sort], order,
+                       after, limit, fields, ids)
+
+
+@router.get("/albums")
+async def list_albums(db: db_dependency,
+                      limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
+                      after: str = None,
+                      fields: str = None,
+                      ids: str = None):
+    return await _list(db, select(models.Albums), AlbumsOut, models.Albums.album_id,
+                       after=after, limit=limit, fields=fields, ids=ids)
+
+
+@router.get("/artists")
+async def list_artists(db: db_dependency,
+                       limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
+                       after: str = None,
+                       fields: str = None,
+                       ids: str = None):
+    return await _list(db, select(models.Artists), ArtistsOut, models.Artists.artist_id,
+                       after=after, limit=limit, fields=fields, ids=ids)
+
+
+@router.get("/playlists")
+async def list_playlists(db: db_dependency,
+                         limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
+                         after: str = None,
+                         fields: str = None,
+                         ids: str = None):
+    return await _list(db, select(models.Playlists), PlaylistsOut, models.Playlists.playlist_id,
+                       after=after, limit=limit, fields=fields, ids=ids)
+
+
+@router.get("/playlists/{playlist_id}/tracks")
+async def list_playlist_tracks(playlist_id: int, db: db_dependency,
+                               limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
+                               after: str = None,
+                               fields: str = None):
+    if await db.get(models.Playlists, playlist_id) is None:
+        raise HTTPException(status_code=404, detail=f"Playlist {playlist_id} not found")
+
+    stmt = (select(models.Tracks)
+            .join(models.Playlist_Tracks, models.Playlist_Tracks.track_id == models.Tracks.track_id)
+            .where(models.Playlist_Tracks.playlist_id == playlist_id))
+    return await _list(db, stmt, TracksOut, models.Tracks.track_id, after=after, limit=limit, fields=fields)
@@ -0,0 +1,269 @@
+"""Streaming bulk import of artists, albums and tracks
+
+POST /bulk_import?entity=artists|albums|tracks with a CSV (header row first) or
+NDJSON request body. The body is parsed as it arrives, names are resolved to ids
+through lookups loaded once per request, and valid rows are inserted with one
+executemany per batch, each batch in its own transaction. Rows that can't be
+imported are reported back with their line number instead of failing the import.
+
+Columns:
+    artists  artist_name
+    albums   album_name, artist_name or artist_id
+    tracks   track_name, genre, album_name or album_id, artist_name or artist_id
+             (artist may be left out when album_id is given)
+"""
+
+import csv
+import json
+
+from fastapi import APIRouter, HTTPException, Query, Request
+from sqlalchemy import select, insert
+from sqlalchemy.exc import IntegrityError
+
+import models
+import versions
+import coherence
+from database import db_dependency
+
+MAX_REPORTED_ERRORS = 1000
+NAME_LENGTH = 50
+
+router = APIRouter()
+
+
+async def _lines(stream):
+    """Split a stream of byte chunks into decoded lines"""
+    buffer = b''
+    async for chunk in stream:
+        buffer += chunk
+        *lines, buffer = buffer.split(b'\n')
+        for line in lines:
+            yield line.decode('utf-8').rstrip('\r')
+    if buffer:
+        yield buffer.decode('utf-8').rstrip('\r')
+
+
+async def _records(stream, format):
+    """Yield (line number, record dict or error message) for each non-empty line"""
+    header = None
+    line_number = 0
+    async for line in _lines(stream):
+        line_number += 1
+        if not line.strip():
+            continue
+
+        if format == 'ndjson':
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield line_number, f"Invalid JSON: {e}"
+                continue
+            if not isinstance(record, dict):
+                yield line_number, "Expected a JSON object"
+                continue
+            yield line_number, record
+
+        else:
+            # Quoted fields may not contain newlines, every record is one line
+            values = next(csv.reader([line]))
+            if header is None:
+                header = [value.strip() for value in values]
+                continue
+            if len(values) != len(header):
+                yield line_number, f"Expected {len(header)} columns, got {len(values)}"
+                continue
+            yield line_number, dict(zip(header, values))
+
+
+def _name(record, field):
+    value = record.get(field)
+    if value is None or not str(value).strip():
+        raise ValueError(f"Missing {field}")
+    value = str(value).strip()
+    if len(value) > NAME_LENGTH:
+        raise ValueError(f"{field} is longer than {NAME_LENGTH} characters")
+    return value
+
+
+def _id(record, field):
+    value = record.get(field)
+    if value is None or str(value).strip() == '':
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{field} must be an integer")
+
+
+class _Lookups:
+    """Name -> id maps for resolving the rows of one import"""
+
+    @classmethod
+    async def load(cls, db):
+        self = cls()
+        self.artists = dict((await db.execute(select(models.Artists.artist_name, models.Artists.artist_id))).all())
+        self.artist_ids = set(self.artists.values())
+        albums = (await db.execute(select(models.Albums.album_id, models.Albums.album_name, models.Albums.artist_id))).all()
+        self.album_artists = {album_id: artist_id for album_id, _, artist_id in albums}
+        self.albums = {(artist_id, album_name): album_id for album_id, album_name, artist_id in albums}
+        self.genres = set((await db.execute(select(models.Genres.genre))).scalars())
+        self.new_artists = set()
+        return self
+
+    def artist(self, record, required=True):
+        artist_id = _id(record, 'artist_id')
+        if artist_id is not None:
+            if artist_id not in self.artist_ids:
+                raise ValueError(f"Unknown artist_id {artist_id}")
+            return artist_id
+        if record.get('artist_name') or required:
+            artist_name = _name(record, 'artist_name')
+            if artist_name not in self.artists:
+                raise ValueError(f"Unknown artist {artist_name!r}")
+            return self.artists[artist_name]
+        return None
+
+
+def _artist_row(lookups, record):
+    artist_name = _name(record, 'artist_name')
+    if artist_name in lookups.artists or artist_name in lookups.new_artists:
+        raise ValueError(f"Artist {artist_name!r} already exists")
+    # Remember it so a repeat further down the file is reported instead of failing the batch
+    lookups.new_artists.add(artist_name)
+    return {'artist_name': artist_name}
+
+
+def _album_row(lookups, record):
+    return {'album_name': _name(record, 'album_name'), 'artist_id': lookups.artist(record)}
+
+
+def _track_row(lookups, record):
+    track_name = _name(record, 'track_name')
+
+    genre = _name(record, 'genre')
+    if genre not in lookups.genres:
+        raise ValueError(f"Unknown genre {genre!r}")
+
+    album_id = _id(record, 'album_id')
+    if album_id is not None:
+        if album_id not in lookups.album_artists:
+            raise ValueError(f"Unknown album_id {album_id}")
+        artist_id = lookups.artist(record, required=False)
+        if artist_id is None:
+            artist_id = lookups.album_artists[album_id]
+    else:
+        artist_id = lookups.artist(record)
+        album_name = _name(record, 'album_name')
+        album_id = lookups.albums.get((artist_id, album_name))
+        if album_id is None:
+            raise ValueError(f"Unknown album {album_name!r} for artist {artist_id}")
+
+    return {'track_name': track_name, 'album_id': album_id, 'artist_id': artist_id, 'genre': genre}
+
+
+ENTITIES = {
+    'artists': (models.Artists, _artist_row),
+    'albums': (models.Albums, _album_row),
+    'tracks': (models.Tracks, _track_row),
+}
+
+CONTENT_TYPES = {
+    'text/csv': 'csv',
+    'application/x-ndjson': 'ndjson',
+    'application/ndjson': 'ndjson',
+    'application/jsonl': 'ndjson',
+}
+
+
+class _Report:
+    def __init__(self, entity):
+        self.entity = entity
+        self.inserted = 0
+        self.failed = 0
+        self.errors = []
+
+    def error(self, line_number, message):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line_number, 'error': message})
+
+    def as_dict(self):
+        return {'entity': self.entity, 'inserted': self.inserted, 'failed': self.failed,
+                'errors': self.errors, 'errors_truncated': self.failed > len(self.errors)}
+
+
+async def _flush(db, model, batch, report):
+    """Insert one batch in its own transaction"""
+    if not batch:
+        return
+    try:
+        await db.execute(insert(model), [row for _, row in batch])
+        await db.commit()
+        report.inserted += len(batch)
+    except IntegrityError:
+        # Something in the batch conflicts (e.g. a concurrent insert), retry row by row to find it
+        await db.rollback()
+        for line_number, row in batch:
+            try:
+                await db.execute(insert(model), [row])
+                await db.commit()
+                report.inserted += 1
+            except IntegrityError as e:
+                await db.rollback()
+                report.error(line_number, str(e.orig))
+    batch.clear()
+
+
+async def import_stream(db, entity, stream, format, batch_size=1000):
+    """Import every record in `stream` and return the report as a dict"""
+    model, to_row = ENTITIES[entity]
+    lookups = await _Lookups.load(db)
+    # Release the read transaction, each batch gets its own
+    await db.commit()
+
+    report = _Report(entity)
+    batch = []
+    try:
+        async for line_number, record in _records(stream, format):
+            if isinstance(record, str):
+                report.error(line_number, record)
+                continue
+            try:
+                batch.append((line_number, to_row(lookups, record)))
+            except ValueError as e:
+                report.error(line_number, str(e))
+                continue
+            if len(batch) >= batch_size:
+                await _flush(db, model, batch, report)
+        await _flush(db, model, batch, report)
+    finally:
+        # Derived views are refreshed once for the whole import instead of once per row,
+        # and also when it stops halfway (bad body, dropped client) after some batches committed
+        if report.inserted:
+            await db.rollback()
+            versions.bump(entity)
+            # The new ids aren't known, the workers rebuild their copies of the table
+            coherence.changed(entity)
+            await coherence.reload(entity)
+
+    return report.as_dict()
+
+
+@router.post("/bulk_import")
+async def bulk_import(request: Request, db: db_dependency, entity: str,
+                      format: str = None,
+                      batch_size: int = Query(1000, ge=1, le=10000)):
+    if entity not in ENTITIES:
+        raise HTTPException(status_code=400, detail=f"entity must be one of {', '.join(ENTITIES)}")
+
+    if format is None:
+        content_type = request.headers.get('content-type', '').split(';')[0].strip().lower()
+        format = CONTENT_TYPES.get(content_type)
+    if format not in ('csv', 'ndjson'):
+        raise HTTPException(status_code=400, detail="format must be csv or ndjson (or send a text/csv or application/x-ndjson body)")
+
+    try:
+        return await import_stream(db, entity, request.stream(), format, batch_size)
+    except UnicodeDecodeError as e:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail=f"Body is not valid UTF-8: {e}")
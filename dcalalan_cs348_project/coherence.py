@@ -0,0 +1,141 @@
+"""Keeps this worker's in-memory copies of tables in step with the other workers
+
+The lookup indexes and the search index are loaded once and then updated by the
+write endpoints of the worker that handled the write. Those endpoints also record
+the rows they changed in the change log in versions.py, with `changed`. Before each
+request, every other worker reads the log entries it hasn't seen yet and re-reads
+only those rows from the database. When a copy falls behind further than the log
+reaches, or a whole table changed (a bulk import), the copy is rebuilt in a
+background task. Readers keep the old copy until the new one is swapped in.
+
+    coherence.follow(['tracks'], search_index.load, search_index.apply)
+    app = FastAPI(dependencies=[Depends(coherence.catch_up)])
+
+`reload(db)` has to build the new copy aside and swap it in without awaiting in
+between; `apply(db, changes)` gets {table: changed row ids}.
+"""
+
+import asyncio
+import logging
+import time
+
+import versions
+from database import async_session_local
+
+logger = logging.getLogger(__name__)
+
+# Most ids per `IN (...)` when re-reading changed rows
+CHUNK_SIZE = 500
+
+
+class Follower:
+    def __init__(self, tables, reload, apply):
+        self.tables = tables
+        self.reload = reload
+        self.apply = apply
+        # Position in the change log the copy is current to, None until first loaded
+        self.seq = None
+        # Full reload running in the background
+        self.task = None
+
+    def reloading(self):
+        return self.task is not None and not self.task.done()
+
+
+_followers = []
+_lock = asyncio.Lock()
+
+
+def follow(tables, reload, apply):
+    """Keep state derived from `tables` current, see the module docstring"""
+    _followers.append(Follower(tables, reload, apply))
+
+
+def changed(table, row_ids=None):
+    """Record committed changes to `row_ids` of `table`, or to all of it when None"""
+    versions.log_changes(table, row_ids)
+
+
+async def rows_by_id(db, statement, id_column, row_ids):
+    """Rows of `statement` whose `id_column` is one of `row_ids`"""
+    row_ids = sorted(row_ids)
+    rows = []
+    for start in range(0, len(row_ids), CHUNK_SIZE):
+        rows += (await db.execute(statement.where(id_column.in_(row_ids[start:start + CHUNK_SIZE])))).all()
+    return rows
+
+
+async def _reload(follower):
+    started = time.perf_counter()
+    try:
+        while True:
+            seq = versions.log_head()
+            async with async_session_local() as db:
+                await follower.reload(db)
+                # Writes committed while loading may or may not be in the new copy, apply them
+                # again, including this worker's own (made to the copy that was replaced)
+                head, changes = versions.changes_since(seq, follower.tables, include_own=True)
+                if changes is not None and None not in changes.values():
+                    if changes:
+                        await follower.apply(db, changes)
+                    follower.seq = head
+                    break
+    except Exception:
+        # Retried by the next catch_up that finds the copy behind
+        logger.exception("Reloading %s failed", follower.tables)
+        return
+    logger.info("Reloaded %s in %.2f s", follower.tables, time.perf_counter() - started)
+
+
+def _start_reload(follower):
+    if not follower.reloading():
+        follower.task = asyncio.create_task(_reload(follower))
+    return follower.task
+
+
+def start():
+    """Load every copy in the background, run at startup"""
+    for follower in _followers:
+        _start_reload(follower)
+
+
+def stop():
+    for follower in _followers:
+        if follower.reloading():
+            follower.task.cancel()
+
+
+async def reload(*tables):
+    """Rebuild this worker's copies of `tables` (or all of them) and wait for it"""
+    tasks = [_start_reload(follower) for follower in _followers
+             if not tables or set(tables) & set(follower.tables)]
+    # Shielded so a dropped client doesn't cancel a reload other requests wait on too
+    await asyncio.shield(asyncio.gather(*tasks))
+
+
+async def catch_up():
+    """Apply other workers' changes, run before every request"""
+    head = versions.log_head()
+    if all(follower.seq == head or follower.reloading() for follower in _followers):
+        return
+    async with _lock:
+        pending = []
+        for follower in _followers:
+            if follower.reloading() or follower.seq == head:
+                continue
+            if follower.seq is None:
+                _start_reload(follower)
+                continue
+            follower_head, changes = versions.changes_since(follower.seq, follower.tables)
+            if changes is None or None in changes.values():
+                _start_reload(follower)
+            elif changes:
+                pending.append((follower, follower_head, changes))
+            else:
+                follower.seq = follower_head
+        if not pending:
+            return
+        async with async_session_local() as db:
+            for follower, follower_head, changes in pending:
+                await follower.apply(db, changes)
+                follower.seq = follower_head
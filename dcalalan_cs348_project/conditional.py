@@ -0,0 +1,79 @@
+"""HTTP conditional requests for the HTML pages
+
+A page's ETag is derived from the versions (see versions.py) of the tables it is
+built from, plus the query parameters that select what it shows. A request whose
+If-None-Match (or If-Modified-Since) still matches gets a 304 before the page
+touches the database. The tag also includes the epoch of the counters, which
+every worker shares: a tag from one worker is valid on the others, and after a
+restart of the app every old tag is stale.
+
+    validators = conditional.validators('report', ['tracks', 'track_popularity'])
+    if (response := conditional.not_modified(request, validators)) is not None:
+        return response
+    ...
+    return conditional.respond(html, validators)
+"""
+
+import hashlib
+from email.utils import formatdate, parsedate_to_datetime
+
+from fastapi import Response
+from fastapi.responses import HTMLResponse
+
+import versions
+
+# Caches may store the pages but have to revalidate them on every use, a write
+# can change a page at any moment
+CACHE_CONTROL = 'no-cache'
+
+_EPOCH = f'{versions.epoch():.6f}'
+
+
+class Validators:
+    def __init__(self, etag, last_modified):
+        self.etag = etag
+        self.last_modified = last_modified
+
+    def headers(self):
+        return {'ETag': self.etag,
+                'Last-Modified': formatdate(self.last_modified, usegmt=True),
+                'Cache-Control': CACHE_CONTROL}
+
+
+def validators(page, tables, *params):
+    """ETag and Last-Modified of `page` as built from `tables` and `params`"""
+    state = repr((_EPOCH, page, versions.snapshot(*tables), params))
+    etag = '"' + hashlib.sha1(state.encode()).hexdigest()[:20] + '"'
+    return Validators(etag, versions.last_modified(*tables))
+
+
+def _etag_matches(header, etag):
+    if header.strip() == '*':
+        return True
+    # Weak comparison, as If-None-Match requires
+    return any(tag.strip().removeprefix('W/') == etag for tag in header.split(','))
+
+
+def not_modified(request, validators):
+    """A 304 response if the client's copy is still current, otherwise None"""
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match is not None:
+        matches = _etag_matches(if_none_match, validators.etag)
+    else:
+        if_modified_since = request.headers.get('if-modified-since')
+        if if_modified_since is None:
+            return None
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return None
+        # HTTP dates have whole seconds
+        matches = int(validators.last_modified) <= since
+
+    if not matches:
+        return None
+    return Response(status_code=304, headers=validators.headers())
+
+
+def respond(content, validators):
+    return HTMLResponse(content=content, headers=validators.headers())
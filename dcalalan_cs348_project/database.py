@@ -1,11 +1,78 @@
+"""Database engines and sessions
+
+Configured through environment variables:
+
+DATABASE_URL       SQLAlchemy URL of the database, `local` uses a SQLite file
+                   next to this module (handy for testing)
+DB_POOL_SIZE       connections kept open in the pool
+DB_MAX_OVERFLOW    extra connections allowed on top of DB_POOL_SIZE under bursts
+DB_POOL_TIMEOUT    seconds to wait for a free connection before giving up
+DB_POOL_RECYCLE    seconds after which a connection is replaced, so idle
+                   connections dropped by the server aren't handed out
+DB_POOL_PRE_PING   test each connection on checkout (1/0)
+"""
+
+import os
+from typing import Annotated
+from fastapi import Depends
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
-import pymysql
+from pool_metrics import TimedQueuePool, TimedAsyncAdaptedQueuePool
+
+DEFAULT_URL_DATABASE = 'mysql+pymysql://root:@34.135.119.225:3306/cs348-project'
+LOCAL_URL_DATABASE = f"sqlite:///{os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cs348-project.db')}"
+
+URL_DATABASE = os.environ.get('DATABASE_URL', DEFAULT_URL_DATABASE)
+if URL_DATABASE == 'local':
+    URL_DATABASE = LOCAL_URL_DATABASE
+
+POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10))
+MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 20))
+POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))
+POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', '1').lower() not in ('0', 'false', 'no')
 
-URL_DATABASE = 'mysql+pymysql://root:@34.135.119.225:3306/cs348-project'
+# Async drivers for the sync URLs above, aiosqlite lets everything run against a local SQLite file
+ASYNC_DRIVERS = {
+    'mysql+pymysql': 'mysql+aiomysql',
+    'mysql': 'mysql+aiomysql',
+    'sqlite': 'sqlite+aiosqlite',
+    'sqlite+pysqlite': 'sqlite+aiosqlite',
+}
 
-engine = create_engine(URL_DATABASE)
+def async_url(url):
+    """Swap the driver in a sync database URL for its asyncio counterpart"""
+    scheme, rest = url.split('://', 1)
+    return f"{ASYNC_DRIVERS.get(scheme, scheme)}://{rest}"
+
+def pool_options(url, poolclass):
+    """Engine keyword arguments for the connection pool"""
+    url = make_url(url)
+    if url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:'):
+        # An in-memory database only exists inside its single connection, keep SQLAlchemy's default pool
+        return {}
+    return {'poolclass': poolclass,
+            'pool_size': POOL_SIZE,
+            'max_overflow': MAX_OVERFLOW,
+            'pool_timeout': POOL_TIMEOUT,
+            'pool_recycle': POOL_RECYCLE,
+            'pool_pre_ping': POOL_PRE_PING}
+
+# Sync engine, used for schema creation and scripts
+engine = create_engine(URL_DATABASE, **pool_options(URL_DATABASE, TimedQueuePool))
 session_local = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-Base = declarative_base()
\ No newline at end of file
+# Async engine, used by the routes so DB round trips don't block the event loop
+async_engine = create_async_engine(async_url(URL_DATABASE), **pool_options(URL_DATABASE, TimedAsyncAdaptedQueuePool))
+async_session_local = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+Base = declarative_base()
+
+async def get_db():
+    async with async_session_local() as db:
+        yield db
+
+db_dependency = Annotated[AsyncSession, Depends(get_db)]
@@ -0,0 +1,172 @@
+"""Deleting tracks, whole albums and whole artists
+
+POST /tracks/delete                {"track_ids": [...]}
+POST /albums/{album_id}/delete     the album and its tracks
+POST /artists/{artist_id}/delete   the artist, its albums and the tracks of both
+
+Each request is one transaction of a few set-based statements, whatever the
+number of tracks: the playlist entries and popularity counters of the deleted
+tracks go first, then the tracks, then the albums and the artist, so no row is
+left pointing at a deleted one. Once committed, the deleted rows are dropped
+from the in-memory copies (lookup and search indexes) and the
+versions of the tables and playlists they were in are bumped.
+"""
+
+from fastapi import APIRouter, HTTPException
+from sqlalchemy import select, delete
+
+import coherence
+import models
+import popularity
+import versions
+import lookup
+from search import search_index
+from playlist_view import version_key
+from database import db_dependency
+from schemas import TrackIdsBatch
+
+MAX_BATCH_SIZE = 10000
+# Ids per IN list, keeps each statement well under the backend's parameter limits
+CHUNK_SIZE = 500
+
+T = models.Tracks
+PT = models.Playlist_Tracks
+
+router = APIRouter()
+
+
+def _delete(model):
+    # Nothing deleted here is loaded in the session, skip looking for it there
+    return delete(model).execution_options(synchronize_session=False)
+
+
+class Deleted:
+    """Ids of the rows a delete removed, to update the in-memory copies with"""
+
+    def __init__(self):
+        self.track_ids = []
+        self.album_ids = []
+        self.artist_ids = []
+        self.playlist_ids = set()
+        # Versions bumped along with the tables above, e.g. the popularity counters
+        self.bumps = set()
+
+    def counts(self):
+        return {'tracks': len(self.track_ids),
+                'albums': len(self.album_ids),
+                'artists': len(self.artist_ids),
+                'playlists_changed': len(self.playlist_ids)}
+
+
+async def _delete_tracks_where(db, condition, deleted):
+    """Delete the tracks matching `condition` with their playlist entries and counters"""
+    tracks = select(T.track_id).where(condition)
+    track_ids = list((await db.execute(tracks)).scalars())
+    if not track_ids:
+        return
+
+    deleted.playlist_ids.update((await db.execute(select(PT.playlist_id)
+                                                  .where(PT.track_id.in_(tracks)).distinct())).scalars())
+    await db.execute(_delete(PT).where(PT.track_id.in_(tracks)))
+    deleted.bumps.update(await popularity.tracks_deleted_in(db, tracks))
+    await db.execute(_delete(T).where(condition))
+    deleted.track_ids += track_ids
+
+
+async def delete_tracks(db, track_ids):
+    """Delete `track_ids` without committing, unknown ids are skipped"""
+    wanted = list(dict.fromkeys(int(track_id) for track_id in track_ids))
+    deleted = Deleted()
+    for start in range(0, len(wanted), CHUNK_SIZE):
+        await _delete_tracks_where(db, T.track_id.in_(wanted[start:start + CHUNK_SIZE]), deleted)
+    return deleted
+
+
+async def delete_album(db, album_id):
+    """Delete an album and its tracks without committing"""
+    deleted = Deleted()
+    await _delete_tracks_where(db, T.album_id == album_id, deleted)
+    result = await db.execute(_delete(models.Albums).where(models.Albums.album_id == album_id))
+    if result.rowcount:
+        deleted.album_ids.append(album_id)
+    return deleted
+
+
+async def delete_artist(db, artist_id):
+    """Delete an artist, its albums and their tracks without committing"""
+    deleted = Deleted()
+    albums = select(models.Albums.album_id).where(models.Albums.artist_id == artist_id)
+    album_ids = list((await db.execute(albums)).scalars())
+
+    # Two index lookups rather than one OR, which some backends answer with a scan
+    await _delete_tracks_where(db, T.artist_id == artist_id, deleted)
+    if album_ids:
+        await _delete_tracks_where(db, T.album_id.in_(albums), deleted)
+        await db.execute(_delete(models.Albums).where(models.Albums.artist_id == artist_id))
+        deleted.album_ids += album_ids
+
+    deleted.bumps.update(await popularity.artists_deleted(db, [artist_id]))
+    result = await db.execute(_delete(models.Artists).where(models.Artists.artist_id == artist_id))
+    if result.rowcount:
+        deleted.artist_ids.append(artist_id)
+    return deleted
+
+
+def forget(deleted):
+    """Drop committed deletes from the in-memory copies, bump the versions and log them for the other workers"""
+    lookup.indexes['tracks'].remove_many(deleted.track_ids)
+    for track_id in deleted.track_ids:
+        search_index.remove_track(track_id)
+
+    bumped = sorted(deleted.bumps)
+    if deleted.track_ids:
+        bumped.append('tracks')
+        coherence.changed('tracks', deleted.track_ids)
+    if deleted.playlist_ids:
+        bumped += ['playlist_tracks'] + [version_key(playlist_id) for playlist_id in deleted.playlist_ids]
+    if deleted.album_ids:
+        bumped.append('albums')
+        coherence.changed('albums', deleted.album_ids)
+        lookup.indexes['albums'].remove_many(deleted.album_ids)
+        for album_id in deleted.album_ids:
+            search_index.album_names.pop(album_id, None)
+    if deleted.artist_ids:
+        bumped.append('artists')
+        coherence.changed('artists', deleted.artist_ids)
+        lookup.indexes['artists'].remove_many(deleted.artist_ids)
+        for artist_id in deleted.artist_ids:
+            search_index.artist_names.pop(artist_id, None)
+    if bumped:
+        versions.bump(*bumped)
+
+
+async def _commit(db, deleting):
+    try:
+        deleted = await deleting
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(status_code=500, detail=str(e))
+    forget(deleted)
+    return deleted.counts()
+
+
+@router.post("/tracks/delete")
+async def delete_track_list(batch: TrackIdsBatch, db: db_dependency):
+    if len(batch.track_ids) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_SIZE} tracks per request")
+    return await _commit(db, delete_tracks(db, batch.track_ids))
+
+
+@router.post("/albums/{album_id}/delete")
+async def delete_whole_album(album_id: int, db: db_dependency):
+    if await db.get(models.Albums, album_id) is None:
+        raise HTTPException(status_code=404, detail=f"Album {album_id} not found")
+    return await _commit(db, delete_album(db, album_id))
+
+
+@router.post("/artists/{artist_id}/delete")
+async def delete_whole_artist(artist_id: int, db: db_dependency):
+    if await db.get(models.Artists, artist_id) is None:
+        raise HTTPException(status_code=404, detail=f"Artist {artist_id} not found")
+    return await _commit(db, delete_artist(db, artist_id))
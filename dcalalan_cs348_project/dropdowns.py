@@ -0,0 +1,49 @@
+"""Cached <option> lists for the forms on /main_table
+
+Each fragment is built from a single table and kept until that table's version
+(see versions.py) changes, so adding a playlist only rebuilds the playlist options.
+Tracks, albums, artists and listeners are too many to list, the forms pick those
+through the typeahead lookups in lookup.py instead.
+"""
+
+from html import escape
+
+from sqlalchemy import select
+
+import models
+import versions
+
+
+def _options(pairs):
+    return "".join([f"<option value='{escape(str(value))}'>{escape(str(label))}</option>" for value, label in pairs])
+
+
+async def _genre_options(db):
+    return _options((genre, genre) for genre in (await db.execute(select(models.Genres.genre))).scalars())
+
+
+async def _playlist_options(db):
+    return _options((await db.execute(select(models.Playlists.playlist_id, models.Playlists.playlist_name))).all())
+
+
+# Fragment name -> (table it is built from, builder)
+DROPDOWNS = {
+    'genre_options': ('genres', _genre_options),
+    'playlist_options': ('playlists', _playlist_options),
+}
+
+_cache = {}
+
+
+async def fragment(db, name):
+    table, build = DROPDOWNS[name]
+    version = versions.get(table)
+    cached = _cache.get(name)
+    if cached is None or cached[0] != version:
+        cached = (version, await build(db))
+        _cache[name] = cached
+    return cached[1]
+
+
+async def fragments(db, names):
+    return {name: await fragment(db, name) for name in names}
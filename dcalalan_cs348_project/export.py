@@ -0,0 +1,152 @@
+"""Streaming export of the catalog and playlists
+
+GET /export/{tracks|albums|artists|playlists|playlist_tracks}?format=csv|ndjson|parquet&gzip=false
+
+Rows are read in primary key order through a server-side cursor (`yield_per`)
+and written out one batch at a time, so memory stays flat however big the table
+is. `gzip=true` compresses CSV and NDJSON on the fly (Parquet is compressed
+already). Parquet needs pyarrow, which is only imported when it is asked for.
+"""
+
+import csv
+import io
+import zlib
+
+import orjson
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy import Integer, select
+
+import models
+from database import async_session_local
+
+# Rows fetched from the cursor (and written out) at a time
+BATCH_SIZE = 5000
+
+TABLES = {
+    'tracks': models.Tracks,
+    'albums': models.Albums,
+    'artists': models.Artists,
+    'playlists': models.Playlists,
+    'playlist_tracks': models.Playlist_Tracks,
+}
+
+MEDIA_TYPES = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+router = APIRouter()
+
+
+async def _batches(table, batch_size):
+    """Yield the rows of `table` as lists of tuples, `batch_size` rows at a time"""
+    columns = list(table.__table__.columns)
+    stmt = (select(*columns)
+            .order_by(*table.__table__.primary_key.columns)
+            .execution_options(yield_per=batch_size))
+    # The response outlives the request's session, the stream gets its own
+    async with async_session_local() as db:
+        result = await db.stream(stmt)
+        async for partition in result.partitions():
+            yield partition
+
+
+async def _csv(table, batch_size):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow([column.name for column in table.__table__.columns])
+    async for rows in _batches(table, batch_size):
+        writer.writerows(rows)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+async def _ndjson(table, batch_size):
+    names = [column.name for column in table.__table__.columns]
+    async for rows in _batches(table, batch_size):
+        yield b''.join([orjson.dumps(dict(zip(names, row))) + b'\n' for row in rows])
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file that hands out what was written since the last `take`"""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def take(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+async def _parquet(table, batch_size, pa, pq):
+    columns = list(table.__table__.columns)
+    schema = pa.schema([(column.name, pa.int64() if isinstance(column.type, Integer) else pa.string())
+                        for column in columns])
+    sink = _ChunkSink()
+    # One row group per batch, each is sent as soon as it is written
+    with pq.ParquetWriter(sink, schema) as writer:
+        async for rows in _batches(table, batch_size):
+            writer.write_table(pa.Table.from_pylist([dict(zip(schema.names, row)) for row in rows], schema=schema))
+            yield sink.take()
+    yield sink.take()
+
+
+async def _gzipped(chunks):
+    compressor = zlib.compressobj(wbits=31)
+    async for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+@router.get("/export/{table}")
+async def export(table: str, format: str = 'csv', gzip: bool = False,
+                 batch_size: int = Query(BATCH_SIZE, ge=100, le=100000)):
+    if table not in TABLES:
+        raise HTTPException(status_code=404, detail=f"Unknown table {table}, expected one of {', '.join(TABLES)}")
+    if format not in MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail="format must be csv, ndjson or parquet")
+
+    model = TABLES[table]
+    filename = f"{table}.{format}"
+    if format == 'parquet':
+        if gzip:
+            raise HTTPException(status_code=400, detail="Parquet files are compressed already, gzip is only for csv and ndjson")
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise HTTPException(status_code=501, detail="Parquet export needs pyarrow, which isn't installed")
+        body = _parquet(model, batch_size, pa, pq)
+    elif format == 'ndjson':
+        body = _ndjson(model, batch_size)
+    else:
+        body = _csv(model, batch_size)
+
+    media_type = MEDIA_TYPES[format]
+    if gzip:
+        body = _gzipped(body)
+        media_type = 'application/gzip'
+        filename += '.gz'
+
+    return StreamingResponse(body, media_type=media_type,
+                             headers={'Content-Disposition': f'attachment; filename="{filename}"'})
@@ -0,0 +1,186 @@
+"""Listener report: an overview of each user's playlists and favourite artists and genres
+
+GET /listener_report/{user_id}
+GET /listener_report?after=<user_id>&limit=500
+
+Everything is aggregated with set-based GROUP BY queries over
+playlists ⋈ playlist_tracks ⋈ tracks ⋈ artists, and the top artists and genres of
+each listener are picked with ROW_NUMBER() in the same query, so the report costs
+three statements whatever the number of listeners or playlist entries.
+
+The paged report runs them on the analytics snapshot (see analytics.py) when
+there is one, the page of a single listener always reads the database. The
+functions below take `run`, an async function returning the rows of a statement
+from either source.
+"""
+
+from collections import defaultdict
+from html import escape
+
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import HTMLResponse
+from sqlalchemy import select, func, distinct
+
+import analytics
+import conditional
+import models
+from database import db_dependency
+from render import render_table
+
+# Tables the report is built from, their versions make up its ETag
+TABLES = ['listeners', 'playlists', 'playlist_tracks', 'tracks', 'artists']
+
+TOP_N = 3
+PAGE_SIZE = 500
+MAX_PAGE_SIZE = 5000
+
+OVERVIEW_COLUMNS = ('user_id', 'username', 'playlists', 'playlist_entries', 'distinct_tracks', 'distinct_artists',
+                    'top_artists', 'top_genres')
+
+L = models.Listeners
+P = models.Playlists
+PT = models.Playlist_Tracks
+T = models.Tracks
+
+
+async def overview(run, first, last):
+    """One row per listener with user_id in [first, last]"""
+    stmt = (select(L.user_id, L.username,
+                   func.count(distinct(P.playlist_id)),
+                   func.count(PT.track_id),
+                   func.count(distinct(PT.track_id)),
+                   func.count(distinct(T.artist_id)))
+            .select_from(L)
+            .outerjoin(P, P.user_id == L.user_id)
+            .outerjoin(PT, PT.playlist_id == P.playlist_id)
+            .outerjoin(T, T.track_id == PT.track_id)
+            .where(L.user_id.between(first, last))
+            .group_by(L.user_id, L.username)
+            .order_by(L.user_id))
+    return await run(stmt)
+
+
+def _ranked(column, first, last):
+    """Playlist entries per (listener, value of `column`), ranked within each listener"""
+    counts = (select(P.user_id.label('user_id'), column.label('value'), func.count().label('entries'))
+              .select_from(P)
+              .join(PT, PT.playlist_id == P.playlist_id)
+              .join(T, T.track_id == PT.track_id)
+              .where(P.user_id.between(first, last), column.isnot(None))
+              .group_by(P.user_id, column)
+              .subquery())
+    return (select(counts.c.user_id, counts.c.value, counts.c.entries,
+                   func.row_number().over(partition_by=counts.c.user_id,
+                                          order_by=(counts.c.entries.desc(), counts.c.value)).label('rank'))
+            .subquery())
+
+
+async def _top(run, stmt):
+    top = defaultdict(list)
+    for user_id, value, entries in await run(stmt):
+        top[user_id].append((value, entries))
+    return top
+
+
+async def top_artists(run, first, last, top_n=TOP_N):
+    """{user_id: [(artist_name, entries), ...]} of each listener's most chosen artists"""
+    ranked = _ranked(T.artist_id, first, last)
+    return await _top(run, select(ranked.c.user_id, models.Artists.artist_name, ranked.c.entries)
+                      .join(models.Artists, models.Artists.artist_id == ranked.c.value)
+                      .where(ranked.c.rank <= top_n)
+                      .order_by(ranked.c.user_id, ranked.c.rank))
+
+
+async def top_genres(run, first, last, top_n=TOP_N):
+    """{user_id: [(genre, entries), ...]} of each listener's most chosen genres"""
+    ranked = _ranked(T.genre, first, last)
+    return await _top(run, select(ranked.c.user_id, ranked.c.value, ranked.c.entries)
+                      .where(ranked.c.rank <= top_n)
+                      .order_by(ranked.c.user_id, ranked.c.rank))
+
+
+def _summary(pairs):
+    return ", ".join(f"{value} ({entries})" for value, entries in pairs)
+
+
+async def report_rows(run, first, last):
+    rows = await overview(run, first, last)
+    artists = await top_artists(run, first, last)
+    genres = await top_genres(run, first, last)
+    return [tuple(row) + (_summary(artists.get(row[0], [])), _summary(genres.get(row[0], [])))
+            for row in rows]
+
+
+async def playlist_rows(run, user_id):
+    """(playlist_id, playlist_name, tracks) of one listener's playlists"""
+    stmt = (select(P.playlist_id, P.playlist_name, func.count(PT.track_id))
+            .outerjoin(PT, PT.playlist_id == P.playlist_id)
+            .where(P.user_id == user_id)
+            .group_by(P.playlist_id, P.playlist_name)
+            .order_by(P.playlist_id))
+    return await run(stmt)
+
+
+def _page(title, body):
+    return f"""<!DOCTYPE html>
+<html>
+<head>
+<title>{title}</title>
+</head>
+<body>
+<h1>{title}</h1>
+{body}
+<br>
+<a href="/listener_report">All listeners</a> | <a href="/main_table">Return to Main Table</a>
+</body>
+</html>
+"""
+
+
+router = APIRouter()
+
+
+@router.get("/listener_report", response_class=HTMLResponse)
+async def all_listeners(request: Request, db: db_dependency, after: int = 0,
+                        limit: int = Query(PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE)):
+    run, snapshot = analytics.reader(db)
+    page_validators = conditional.validators('listener_report', analytics.tables(snapshot, TABLES), after, limit)
+    if (response := conditional.not_modified(request, page_validators)) is not None:
+        return response
+
+    # The page covers the next `limit` listeners by user_id, every aggregate is restricted to their range
+    user_ids = [row[0] for row in await run(select(L.user_id).where(L.user_id > after)
+                                            .order_by(L.user_id).limit(limit + 1))]
+    rows = await report_rows(run, user_ids[0], user_ids[:limit][-1]) if user_ids else []
+
+    body = ("<h2>Each listener's playlists, and the artists and genres they add to them the most.</h2>\n"
+            + analytics.staleness(snapshot) + "\n"
+            + render_table(OVERVIEW_COLUMNS, rows))
+    if len(user_ids) > limit:
+        body += f"\n<p><a href='/listener_report?after={user_ids[limit - 1]}&limit={limit}'>Next</a></p>"
+    return conditional.respond(_page("Listener report", body), page_validators)
+
+
+@router.get("/listener_report/{user_id}", response_class=HTMLResponse)
+async def one_listener(user_id: int, request: Request, db: db_dependency):
+    page_validators = conditional.validators('listener_report', TABLES, user_id)
+    if (response := conditional.not_modified(request, page_validators)) is not None:
+        return response
+
+    run = analytics.live(db)
+    rows = await overview(run, user_id, user_id)
+    if not rows:
+        raise HTTPException(status_code=404, detail=f"Listener {user_id} not found")
+    artists = await top_artists(run, user_id, user_id, top_n=10)
+    genres = await top_genres(run, user_id, user_id, top_n=10)
+
+    body = "\n".join([
+        render_table(OVERVIEW_COLUMNS[:6], rows),
+        "<h2>Playlists</h2>",
+        render_table(('playlist_id', 'playlist_name', 'tracks'), await playlist_rows(run, user_id)),
+        "<h2>Most chosen artists</h2>",
+        render_table(('artist_name', 'tracks_in_playlists'), artists.get(user_id, [])),
+        "<h2>Most chosen genres</h2>",
+        render_table(('genre', 'tracks_in_playlists'), genres.get(user_id, [])),
+    ])
+    return conditional.respond(_page(f"Listener report: {escape(str(rows[0][1]))}", body), page_validators)
@@ -0,0 +1,144 @@
+"""Typeahead lookups backed by in-memory prefix indexes
+
+GET /lookup/{tracks|albums|artists|listeners}?q=prefix&limit=20 returns the
+matching [{"id": ..., "name": ...}] pairs. Each index is a sorted list of
+(casefolded name, id) searched with bisect, loaded in the background at startup
+(the endpoint answers 503 until then) and updated by the
+write endpoints (and by coherence.py after other workers' writes), so the forms no
+longer need every row as an <option>.
+"""
+
+import asyncio
+from bisect import bisect_left, insort
+
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import ORJSONResponse
+from sqlalchemy import select
+
+import coherence
+import models
+
+MAX_LIMIT = 100
+
+
+class PrefixIndex:
+    """Sorted (key, id) pairs with the original names alongside"""
+
+    def __init__(self):
+        self._keys = []
+        self._names = {}
+        # False until built, the app starts serving before the indexes are loaded
+        self.loaded = False
+
+    def __len__(self):
+        return len(self._keys)
+
+    def build(self, pairs):
+        self._names = {row_id: name for row_id, name in pairs if name is not None}
+        self._keys = sorted((name.casefold(), row_id) for row_id, name in self._names.items())
+        self.loaded = True
+
+    def add(self, row_id, name):
+        if row_id in self._names:
+            self.remove(row_id)
+        if name is None:
+            return
+        self._names[row_id] = name
+        insort(self._keys, (name.casefold(), row_id))
+
+    def remove(self, row_id):
+        name = self._names.pop(row_id, None)
+        if name is None:
+            return
+        position = bisect_left(self._keys, (name.casefold(), row_id))
+        if position < len(self._keys) and self._keys[position] == (name.casefold(), row_id):
+            del self._keys[position]
+
+    def remove_many(self, row_ids):
+        """Remove `row_ids` with one pass over the keys instead of one list deletion each"""
+        removed = {row_id for row_id in row_ids if self._names.pop(row_id, None) is not None}
+        if removed:
+            self._keys = [key for key in self._keys if key[1] not in removed]
+
+    def name(self, row_id):
+        return self._names.get(row_id)
+
+    def search(self, prefix, limit=20):
+        """Up to `limit` (id, name) pairs whose name starts with `prefix`, ignoring case"""
+        prefix = prefix.casefold()
+        results = []
+        position = bisect_left(self._keys, (prefix,))
+        while position < len(self._keys) and len(results) < limit:
+            key, row_id = self._keys[position]
+            if not key.startswith(prefix):
+                break
+            results.append((row_id, self._names[row_id]))
+            position += 1
+        return results
+
+
+# Entity -> (id column, name column)
+ENTITIES = {
+    'tracks': (models.Tracks.track_id, models.Tracks.track_name),
+    'albums': (models.Albums.album_id, models.Albums.album_name),
+    'artists': (models.Artists.artist_id, models.Artists.artist_name),
+    'listeners': (models.Listeners.user_id, models.Listeners.username),
+}
+
+indexes = {entity: PrefixIndex() for entity in ENTITIES}
+
+
+async def load(db, *entities):
+    """(Re)build the indexes of `entities`, or all of them, lookups keep using the old ones meanwhile"""
+    for entity in entities or ENTITIES:
+        id_column, name_column = ENTITIES[entity]
+        index = PrefixIndex()
+        await asyncio.to_thread(index.build, (await db.execute(select(id_column, name_column))).all())
+        indexes[entity] = index
+
+
+async def apply(db, changes):
+    """Re-read the rows of {entity: row ids} and update their indexes"""
+    for entity, row_ids in changes.items():
+        id_column, name_column = ENTITIES[entity]
+        names = dict(await coherence.rows_by_id(db, select(id_column, name_column), id_column, row_ids))
+        index = indexes[entity]
+        index.remove_many(row_id for row_id in row_ids if row_id not in names)
+        for row_id, name in names.items():
+            if index.name(row_id) != name:
+                index.add(row_id, name)
+
+
+async def check_consistency(db, entity):
+    """Compare an index against its table.
+
+    Returns the ids that are missing from the index, that no longer exist in the
+    database, and that exist in both under different names.
+    """
+    id_column, name_column = ENTITIES[entity]
+    db_names = {row_id: name for row_id, name in (await db.execute(select(id_column, name_column))).all()
+                if name is not None}
+    names = indexes[entity]._names
+
+    missing = sorted(db_names.keys() - names.keys())
+    extra = sorted(names.keys() - db_names.keys())
+    mismatched = sorted(row_id for row_id in db_names.keys() & names.keys() if db_names[row_id] != names[row_id])
+
+    return {'consistent': not (missing or extra or mismatched),
+            'index_size': len(names),
+            'database_size': len(db_names),
+            'missing': missing,
+            'extra': extra,
+            'mismatched': mismatched}
+
+
+router = APIRouter()
+
+
+@router.get("/lookup/{entity}", response_class=ORJSONResponse)
+async def lookup(entity: str, q: str = '', limit: int = Query(20, ge=1, le=MAX_LIMIT)):
+    if entity not in indexes:
+        raise HTTPException(status_code=404, detail=f"Unknown entity {entity}")
+    if not indexes[entity].loaded:
+        raise HTTPException(status_code=503, detail=f"The {entity} index is still being loaded")
+    return ORJSONResponse([{'id': row_id, 'name': name} for row_id, name in indexes[entity].search(q, limit)])
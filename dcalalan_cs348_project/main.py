@@ -7,94 +7,121 @@ Run with `uvicorn main:app --reload`
 from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, status, Form, Request
 from fastapi.responses import HTMLResponse, RedirectResponse, FileResponse
 from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel
-from typing import Annotated
+from contextlib import asynccontextmanager
+import asyncio
 import models
-from database import engine, session_local
-from sqlalchemy.orm import Session
-from sqlalchemy import text
-import sqlalchemy
-import pandas as pd
-import duckdb
-
-app = FastAPI()
-models.Base.metadata.create_all(bind=engine)
-
-class ArtistsBase(BaseModel):
-        artist_name: str
-
-class ListenersBase(BaseModel):
-        username: str
-
-class TracksBase(BaseModel):
-        track_name: str
-        album_id: int
-        genre: str
-
-class AlbumsBase(BaseModel):
-        album_name: str
-        artist_id: int
-
-#class GenresBase(BaseModel):
-        # Empty???
-
-class PlaylistsBase(BaseModel):
-        playlist_name: str
-        user_id: int
-
-#class PlaylistTracksBase(BaseModel):
-        # Also Empty???
-
-def get_db():
-        db = session_local()
-        try:
-                yield db
-        finally:
-                db.close()
-
-db_dependency = Annotated[Session, Depends(get_db)]
+from database import engine, async_engine, db_dependency
+from api import router as api_router
+from bulk_import import router as bulk_import_router
+from playlist_tracks import router as playlist_tracks_router, add_tracks as add_playlist_tracks
+from lookup import router as lookup_router
+from search import router as search_router, search_index
+from playlist_view import router as playlist_view_router
+from export import router as export_router
+from metrics import router as metrics_router, MetricsMiddleware
+from recommend import router as recommend_router
+from listener_report import router as listener_report_router
+from deletes import router as deletes_router, delete_tracks, forget as forget_deleted
+import pool_metrics
+import metrics
+import recommend
+import analytics
+import popularity
+import versions
+import templates
+import conditional
+import schema
+import coherence
+import dropdowns
+import lookup
+from write_queue import write_queue
+from render import render_table
+from render_cache import RenderCache, track_table_cache
+from pagination import keyset_page, TRACK_SORT_COLUMNS
+from sqlalchemy import select
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+        # One read of the schema version instead of checking every table, see schema.py
+        await schema.ensure()
+        templates.compile_pages()
+
+        # Load the in-memory copies in the background, so the app serves pages right away and the
+        # lookup and search endpoints answer 503 until they're in. The write endpoints keep them
+        # up to date afterwards and coherence.catch_up applies the writes made by other workers
+        coherence.start()
+
+        # Recommendations are built in the background, the endpoints answer 503 until the first build is done
+        recommend_task = asyncio.create_task(recommend.keep_fresh())
+        # So do the reports' analytics snapshot refreshes, the reports read the database until the first one
+        analytics_task = asyncio.create_task(analytics.keep_fresh())
+        # Commits the form writes in batches when WRITE_BATCH_MS is set
+        write_queue.start()
+        yield
+        await write_queue.stop()
+        coherence.stop()
+        recommend_task.cancel()
+        analytics_task.cancel()
+        await async_engine.dispose()
+
+for entity in lookup.ENTITIES:
+        coherence.follow([entity], lambda db, entity=entity: lookup.load(db, entity), lookup.apply)
+coherence.follow(['tracks', 'albums', 'artists'], search_index.load, search_index.apply)
+
+app = FastAPI(lifespan=lifespan, dependencies=[Depends(coherence.catch_up)])
+app.include_router(api_router)
+app.include_router(bulk_import_router)
+app.include_router(playlist_tracks_router)
+app.include_router(lookup_router)
+app.include_router(search_router)
+app.include_router(playlist_view_router)
+app.include_router(export_router)
+app.include_router(metrics_router)
+app.include_router(recommend_router)
+app.include_router(listener_report_router)
+app.include_router(deletes_router)
+app.add_middleware(MetricsMiddleware)
+
+metrics.instrument(engine, async_engine.sync_engine)
+
+
+TRACK_PAGE_SIZE = 50
+TRACK_COLUMNS = tuple(TRACK_SORT_COLUMNS)
+
+MAIN_TABLE_DROPDOWNS = ['genre_options', 'playlist_options']
+
+# Tables each page is built from, their versions make up the page's ETag
+MAIN_TABLE_TABLES = ['tracks'] + [dropdowns.DROPDOWNS[name][0] for name in MAIN_TABLE_DROPDOWNS]
+REPORT_TABLES = ['track_popularity', 'tracks', 'artists']
+PLAYLIST_REPORT_TABLES = ['playlists']
+
+PLAYLIST_COLUMNS = ('playlist_id', 'playlist_name', 'user_id')
+playlist_table_cache = RenderCache(maxsize=1)
+
+async def render_track_page(db, sort_attribute, order, after):
+        """Render one page of the track table, sorted and paginated by the database"""
+        tracks, next_cursor = await keyset_page(db, select(models.Tracks), TRACK_SORT_COLUMNS[sort_attribute], models.Tracks.track_id,
+                                                order, after, TRACK_PAGE_SIZE)
+        rows = [(track.track_id, track.track_name, track.album_id, track.artist_id, track.genre) for track in tracks]
+
+        links = [f"<a href='/main_table?sort_attribute={sort_attribute}&order={order}'>First page</a>"]
+        if next_cursor:
+                links.append(f"<a href='/main_table?sort_attribute={sort_attribute}&order={order}&after={next_cursor}'>Next</a>")
+
+        return render_table(TRACK_COLUMNS, rows) + "\n<p>" + " | ".join(links) + "</p>"
         
 @app.get("/", status_code=status.HTTP_200_OK)
-async def list_all_tracks(db:db_dependency):
-        all_tracks = db.query(models.Tracks).all()
-
-        # Create an empty DataFrame with the desired columns
-        df = pd.DataFrame(columns=['track_id', 'track_name', 'album_id', 'artist_id', 'genre'])
-
-        track_dfs = [pd.DataFrame({'track_id': track.track_id,
-                                'track_name': track.track_name,
-                                'album_id': track.album_id,
-                                'artist_id': track.artist_id,
-                                'genre': track.genre}, index=[0]) for track in all_tracks]
-
-        df = pd.concat(track_dfs, ignore_index=True)
-
-        df.to_html('./html_files/basic.html', index=False)
-
-        # Instantiate playlists tables as of now
-        all_playlists = db.query(models.Playlists).all()
-
-        if (not all_playlists):
-               playlist_df = pd.DataFrame(columns=['playlist_id', 'playlist_name', 'user_id'])
-        else:
-
-                # Create an empty DataFrame with the desired columns
-                playlist_df = pd.DataFrame(columns=['playlist_id', 'playlist_name', 'user_id'])
-
-                playlists_dfs = [pd.DataFrame({'playlist_id': playlist.playlist_id,
-                                        'playlist_name': playlist.playlist_name,
-                                        'user_id': playlist.user_id}, index=[0]) for playlist in all_playlists]
-
-                playlist_df = pd.concat(playlists_dfs, ignore_index=True)
-
-        playlist_df.to_html('./html_files/playlist.html', index=False)
+async def list_all_tracks(request: Request):
+        # The root page is static, its tag only changes when the app restarts
+        page_validators = conditional.validators('root', [])
+        if (response := conditional.not_modified(request, page_validators)) is not None:
+                return response
 
         # Open root html page
         try:
-                with open('./html_files/root.html', 'r') as f:
-                        root = f.read()
+                root = templates.read_page('root.html')
 
-                return HTMLResponse(content=root, status_code=200)
+                return conditional.respond(root, page_validators)
                 #return templates.TemplateResponse("root.html", {"all_playlists": all_playlists})
         
         except FileNotFoundError as e:
@@ -103,170 +130,40 @@ async def list_all_tracks(db:db_dependency):
                 raise HTTPException(status_code=500, detail=f"Error reading files: {str(e)}")
 
 @app.get("/main_table", response_class=HTMLResponse)
-async def main_table(db:db_dependency):
-        all_tracks = db.query(models.Tracks).all()
-        all_albums = db.query(models.Albums).all()
-        all_artists = db.query(models.Artists).all()
-        all_genres = db.query(models.Genres).all()
-        all_playlists = db.query(models.Playlists).all()
-        all_listeners = db.query(models.Listeners).all()
+async def main_table(request: Request, db:db_dependency, sort_attribute: str = 'track_id', order: str = 'ASC', after: str = None):
+        if sort_attribute not in TRACK_SORT_COLUMNS or order.upper() not in ('ASC', 'DESC'):
+                raise HTTPException(status_code=400, detail=f"Cannot sort by {sort_attribute} {order}")
 
-        try:
-                # Read main.html
-                with open("./html_files/main.html", "r") as main_file:
-                        main_content = main_file.read()
-                
-                # Read basic.html
-                with open("./html_files/basic.html", "r") as basic_file:
-                        basic_content = basic_file.read()
-
-                # Create dropdown options for tracks
-                track_options = ""
-                for track in all_tracks:
-                        track_options += f"<option value='{track.track_id}'>{track.track_name}</option>"
-
-                track_id_options = ""
-                for track in all_tracks:
-                        track_id_options += f"<option value='{track.track_id}'>{track.track_id}</option>"
-
-                # Create dropdown options for albums
-                album_options = ""
-                for album in all_albums:
-                        album_options += f"<option value='{album.album_id}'>{album.album_name}</option>"
-                
-                # Create dropdown options for artists
-                artist_options = ""
-                for artist in all_artists:
-                        artist_options += f"<option value='{artist.artist_id}'>{artist.artist_name}</option>"
-
-                # Create dropdown options for genres
-                genre_options = ""
-                for genre in all_genres:
-                        genre_options += f"<option value='{genre.genre}'>{genre.genre}</option>"
-
-                playlist_options = ""
-                for playlist in all_playlists:
-                        playlist_options += f"<option value='{playlist.playlist_id}'>{playlist.playlist_name}</option>"
-
-                listener_options = ""
-                for listener in all_listeners:
-                        listener_options += f"<option value='{listener.user_id}'>{playlist.user_id}</option>"
-                
-                # Find the closing </body> tag and insert basic_content before it
-                merged_content = main_content.replace("</body>", f"""
-                <div class="data-content">
-                        <h3>For Artists: Add to database</h3>
-                        <form method="POST" action="/added_tracks">
-                                <label for="track_name">Track Name:</label>
-                                <input type="text" id="track_name" name="track_name">
-                                <select name="album_to_add_to">
-                                {album_options}
-                                </select>
-                                <select name="artist_to_add_to">
-                                {artist_options}
-                                </select>
-                                <select name="genre_to_add_to">
-                                {genre_options}
-                                </select>
-                                <input type="submit" value="Add Track...">
-                        </form>
-
-                        <form method="POST" action="/added_album">
-                                <label for="album_name">Album Name:</label>
-                                <input type="text" id="album_name" name="album_name">
-                                <select name="artist_to_add_to">
-                                {artist_options}
-                                </select>
-                                <input type="submit" value="Add Album...">
-                        </form>
-
-                        <form method="POST" action="/added_artist">
-                                <label for="artist_name">Artist Name:</label>
-                                <input type="text" id="artist_name" name="artist_name">
-                                <input type="submit" value="Add Artist...">
-                        </form>
-
-                        <h3>For Artists: Delete from database</h3>
-                        <form method="POST" action="/delete_track">
-                                <label for="track_to_delete">Track to Delete:</label>
-                                <select name="track_to_delete" id="track_to_delete">
-                                {track_options}
-                                </select>
-                                <input type="submit" value="Delete Track">
-                        </form>
-
-                        <h3>For Artists: Update from database</h3>
-                        <form method="POST" action="/update_track">
-                                <label for="track_to_update">Track to Update:</label>
-                                <select name="track_to_update" id="track_to_update">
-                                {track_id_options}
-                                </select>
-                                <label for="new_track_name">New Track Name:</label>
-                                <input type="text" id="new_track_name" name="new_track_name">
-                                <label for="new_album_id">New Album ID:</label>
-                                <input type="text" id="new_album_id" name="new_album_id">
-                                <label for="new_genre">New Genre:</label>
-                                <select name="new_genre" id="new_genre">
-                                        <option value="">Select Genre</option>
-                                        {genre_options}
-                                </select>
-                                <input type="submit" value="Update Track">
-                        </form>
-
-                        <h3>For Users: Add New Playlist</h3>
-                        <form method="POST" action="/added_playlist">
-                                <label for="playlist_name">Playlist Name:</label>
-                                <input type="text" id="playlist_name" name="playlist_name">
-                                <label for="user_id">User ID:</label>
-                                <select name="user_id">
-                                <option value="">Select User</option>
-                                {listener_options}
-                                </select>
-                                <input type="submit" value="Add Playlist...">
-                        </form>
-
-                        <h3>For Users: Add to Playlist</h3>
-                        <form method="POST" action="/added_to_playlist">
-                                <label for="playlist_name">Playlist Name:</label>
-                                <select name="playlist_to_add_to">
-                                {playlist_options}
-                                </select>
-                                <label for="track">Select Track:</label>
-                                <select name="track" id="track">
-                                        <option value="">Select Track</option>
-                                        {track_options}
-                                </select>
-                                <input type="submit" value="Add to Playlist...">
-                        </form>
-                                                      
-                        {basic_content}
-
-                        <h3>For Artists: View report</h3>
-                        <a href="/report" class="btn btn-primary">View report</a>
-
-                </div>
-                </body>""")
-
-                return merged_content
-                
-        except FileNotFoundError as e:
-                raise HTTPException(status_code=404, detail=f"File not found: {str(e)}")
-        except Exception as e:
-                raise HTTPException(status_code=500, detail=f"Error reading files: {str(e)}")
+        page_validators = conditional.validators('main_table', MAIN_TABLE_TABLES, sort_attribute, order.upper(), after)
+        if (response := conditional.not_modified(request, page_validators)) is not None:
+                return response
 
-@app.get("/report")
-async def report(request: Request, db:db_dependency):
         try:
-                result = db.execute(sqlalchemy.sql.text('CALL TopTracksPerArtist()'))
+                cache_key = (versions.get('tracks'), sort_attribute, order.upper(), after)
+                basic_content = track_table_cache.get(cache_key)
+                if basic_content is None:
+                        basic_content = await render_track_page(db, sort_attribute, order.upper(), after)
+                        track_table_cache.put(cache_key, basic_content)
+        except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+
+        fragments = await dropdowns.fragments(db, MAIN_TABLE_DROPDOWNS)
 
-                df = pd.DataFrame(columns=['artist_name', 'most_popular_track', 'playlist_count'])
+        # Every fragment is cached, assembling the page is one join
+        return conditional.respond(templates.pages['main_table'].render(basic_content=basic_content, **fragments), page_validators)
 
-                for artist, track, count in result.fetchall():
-                        df = df._append({'artist_name': artist, 'most_popular_track': track, 'playlist_count': count}, ignore_index=True)
+@app.get("/report")
+async def report(request: Request, db:db_dependency):
+        run, snapshot = analytics.reader(db)
+        page_validators = conditional.validators('report', analytics.tables(snapshot, REPORT_TABLES))
+        if (response := conditional.not_modified(request, page_validators)) is not None:
+                return response
 
-                print(df)
+        try:
+                # Read from the counters kept by popularity.py, in the database or the snapshot
+                rows = await popularity.report_rows(run)
 
-                html_table = df.to_html(index=False)
+                html_table = render_table(['artist_name', 'most_popular_track', 'playlist_count'], rows)
 
                 # Create HTML response
                 html_content = f"""
@@ -279,6 +176,7 @@ async def report(request: Request, db:db_dependency):
                 <h1>Report</h1>
                 <h2>This report shows each artists' most popular track and the number of times it was added to a playlist.</h2>
                 <h2>Multiple instances of an artist indicates a tie in their most popular track.</h2>
+                {analytics.staleness(snapshot)}
                 <table>
                         {html_table}
                 </table>
@@ -288,149 +186,134 @@ async def report(request: Request, db:db_dependency):
                 </html>
                 """
 
-                return HTMLResponse(content=html_content)
+                return conditional.respond(html_content, page_validators)
         except Exception as e:
-                db.rollback()
+                await db.rollback()
                 raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/added_playlist")
-async def added_playlist(request: Request, db:db_dependency, playlist_name: str = Form(...), user_id: str = Form(...)):
+async def _add(db, row):
+        """Insert `row` as part of a write batch, returns it as the database stored it and the version to bump"""
+        db.add(row)
+        await db.flush()
+        # Form values arrive as strings, read back the stored values and the generated id
+        await db.refresh(row)
+        return row, [row.__tablename__]
 
+def _form_id(value, field):
+        """The id in one of the forms' hidden inputs, which stay empty until a typeahead suggestion is picked"""
         try:
-                new_playlist = models.Playlists(playlist_name = playlist_name, user_id = user_id)
+                return int(value)
+        except (TypeError, ValueError):
+                raise HTTPException(status_code=400, detail=f"Pick the {field} from the suggestions")
 
-                db.add(new_playlist)
-                db.commit()
-                db.refresh(new_playlist)
+@app.post("/added_playlist")
+async def added_playlist(request: Request, playlist_name: str = Form(...), user_id: str = Form(None)):
+        user_id = _form_id(user_id, 'user')
+
+        try:
+                # Committed together with other writes when batching is on, see write_queue.py
+                await write_queue.submit(lambda db: _add(db, models.Playlists(playlist_name = playlist_name, user_id = user_id)))
 
                 return RedirectResponse(url="/main_table", status_code=status.HTTP_303_SEE_OTHER)
 
         except Exception as e:
-                db.rollback()
                 raise HTTPException(status_code=500, detail=str(e))
         
 @app.post("/added_to_playlist")
-async def added_to_playlist(request: Request, db:db_dependency, playlist_to_add_to: str = Form(...), track: str = Form(...)):
+async def added_to_playlist(request: Request, playlist_to_add_to: str = Form(None), track: str = Form(None)):
+        playlist_id = _form_id(playlist_to_add_to, 'playlist')
+        track_id = _form_id(track, 'track')
 
         try:
-                new_playlist_track = models.Playlist_Tracks(playlist_id = playlist_to_add_to, track_id = track)
-
-                db.add(new_playlist_track)
-                db.commit()
-                db.refresh(new_playlist_track)
+                # A track that is already in the playlist is skipped instead of raising
+                await write_queue.submit(lambda db: add_playlist_tracks(db, playlist_id, [track_id]))
 
                 return RedirectResponse(url="/main_table", status_code=status.HTTP_303_SEE_OTHER)
 
         except Exception as e:
-                db.rollback()
                 raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.post("/added_tracks")
-async def added_tracks(request: Request, db:db_dependency, track_name: str = Form(...), album_to_add_to: str = Form(...), artist_to_add_to: str = Form(...),
+async def added_tracks(request: Request, track_name: str = Form(...), album_to_add_to: str = Form(None), artist_to_add_to: str = Form(None),
                         genre_to_add_to: str = Form(...)):
-       
-        try:
-                new_track = models.Tracks(track_name = track_name, album_id = album_to_add_to, artist_id = artist_to_add_to, genre = genre_to_add_to)
-
-                db.add(new_track)
-                db.commit()
-                db.refresh(new_track)
-
-                all_tracks = db.query(models.Tracks).all()
+        album_to_add_to = _form_id(album_to_add_to, 'album')
+        artist_to_add_to = _form_id(artist_to_add_to, 'artist')
 
-                # Create an empty DataFrame with the desired columns
-                df = pd.DataFrame(columns=['track_id', 'track_name', 'album_id', 'artist_id', 'genre'])
-
-                track_dfs = [pd.DataFrame({'track_id': track.track_id,
-                                        'track_name': track.track_name,
-                                        'album_id': track.album_id,
-                                        'artist_id': track.artist_id,
-                                        'genre': track.genre}, index=[0]) for track in all_tracks]
-
-                df = pd.concat(track_dfs, ignore_index=True)
+        try:
+                new_track = await write_queue.submit(lambda db: _add(db, models.Tracks(track_name = track_name, album_id = album_to_add_to,
+                                                                                       artist_id = artist_to_add_to, genre = genre_to_add_to)))
 
-                df.to_html('./html_files/basic.html', index=False)
+                coherence.changed('tracks', [new_track.track_id])
+                lookup.indexes['tracks'].add(new_track.track_id, new_track.track_name)
+                search_index.add_track(new_track.track_id, new_track.track_name, new_track.album_id, new_track.artist_id, new_track.genre)
 
                 return RedirectResponse(url="/main_table", status_code=status.HTTP_303_SEE_OTHER)
 
         except Exception as e:
-                db.rollback()
                 raise HTTPException(status_code=500, detail=str(e))
         
 @app.post("/added_album")
-async def added_album(request: Request, db:db_dependency, album_name: str = Form(...), artist_to_add_to: str = Form(...)):
-       
-        try:
-                new_album = models.Albums(album_name = album_name, artist_id = artist_to_add_to)
+async def added_album(request: Request, album_name: str = Form(...), artist_to_add_to: str = Form(None)):
+        artist_to_add_to = _form_id(artist_to_add_to, 'artist')
 
-                db.add(new_album)
-                db.commit()
-                db.refresh(new_album)
+        try:
+                new_album = await write_queue.submit(lambda db: _add(db, models.Albums(album_name = album_name, artist_id = artist_to_add_to)))
+                coherence.changed('albums', [new_album.album_id])
+                lookup.indexes['albums'].add(new_album.album_id, new_album.album_name)
+                search_index.album_names[new_album.album_id] = new_album.album_name
 
                 return RedirectResponse(url="/main_table", status_code=status.HTTP_303_SEE_OTHER)
 
         except Exception as e:
-                db.rollback()
                 raise HTTPException(status_code=500, detail=str(e))
         
 @app.post("/added_artist")
-async def added_artist(request: Request, db:db_dependency, artist_name: str = Form(...)):
+async def added_artist(request: Request, artist_name: str = Form(...)):
        
         try:
-                new_artist = models.Artists(artist_name = artist_name)
-
-                db.add(new_artist)
-                db.commit()
-                db.refresh(new_artist)
+                new_artist = await write_queue.submit(lambda db: _add(db, models.Artists(artist_name = artist_name)))
+                coherence.changed('artists', [new_artist.artist_id])
+                lookup.indexes['artists'].add(new_artist.artist_id, new_artist.artist_name)
+                search_index.artist_names[new_artist.artist_id] = new_artist.artist_name
 
                 return RedirectResponse(url="/main_table", status_code=status.HTTP_303_SEE_OTHER)
 
         except Exception as e:
-                db.rollback()
                 raise HTTPException(status_code=500, detail=str(e))
         
 @app.post("/delete_track")
-async def delete_track(request: Request, db:db_dependency, track_to_delete: str = Form(...)):
-       
-        try:
-                track_to_delete = db.query(models.Tracks).filter(models.Tracks.track_id == track_to_delete).first()
-                #print(track_to_delete)
-
-                db.delete(track_to_delete)
-                db.commit()
+async def delete_track(request: Request, db:db_dependency, track_to_delete: str = Form(None)):
+        track_to_delete = _form_id(track_to_delete, 'track')
 
-                all_tracks = db.query(models.Tracks).all()
-
-                # Create an empty DataFrame with the desired columns
-                df = pd.DataFrame(columns=['track_id', 'track_name', 'album_id', 'artist_id', 'genre'])
-
-                track_dfs = [pd.DataFrame({'track_id': track.track_id,
-                                        'track_name': track.track_name,
-                                        'album_id': track.album_id,
-                                        'artist_id': track.artist_id,
-                                        'genre': track.genre}, index=[0]) for track in all_tracks]
-
-                df = pd.concat(track_dfs, ignore_index=True)
+        try:
+                # Also removes the track from the playlists it was in
+                deleted = await delete_tracks(db, [track_to_delete])
+                await db.commit()
 
-                df.to_html('./html_files/basic.html', index=False)
+                forget_deleted(deleted)
 
                 return RedirectResponse(url="/main_table", status_code=status.HTTP_303_SEE_OTHER)
 
         except Exception as e:
-                db.rollback()
+                await db.rollback()
                 raise HTTPException(status_code=500, detail=str(e))
         
 @app.post("/update_track")
 async def update_track(request: Request, db:db_dependency,
-                       track_to_update: str = Form(...),
+                       track_to_update: str = Form(None),
                        new_track_name: str = Form(None),
                        new_album_id: str = Form(None),
                        new_genre: str = Form(None)):
+        track_id = _form_id(track_to_update, 'track')
+        if new_album_id and not new_album_id.strip().isdigit():
+                raise HTTPException(status_code=400, detail="New album ID must be a number")
 
-        try:
+        track_to_update = await db.get(models.Tracks, track_id)
+        if track_to_update is None:
+                raise HTTPException(status_code=404, detail=f"Track {track_id} not found")
 
-                track_to_update = db.query(models.Tracks).filter(models.Tracks.track_id == track_to_update).first()
+        try:
 
                 if new_track_name:
                         track_to_update.track_name = new_track_name
@@ -438,139 +321,74 @@ async def update_track(request: Request, db:db_dependency,
                         track_to_update.album_id = new_album_id
                 if new_genre:
                         track_to_update.genre = new_genre
-                db.commit() 
-
-                all_tracks = db.query(models.Tracks).all()
-
-                # Create an empty DataFrame with the desired columns
-                df = pd.DataFrame(columns=['track_id', 'track_name', 'album_id', 'artist_id', 'genre'])
-
-                track_dfs = [pd.DataFrame({'track_id': track.track_id,
-                                        'track_name': track.track_name,
-                                        'album_id': track.album_id,
-                                        'artist_id': track.artist_id,
-                                        'genre': track.genre}, index=[0]) for track in all_tracks]
-
-                df = pd.concat(track_dfs, ignore_index=True)
-
-                df.to_html('./html_files/basic.html', index=False)
+                await db.commit()
+                await db.refresh(track_to_update)
+                versions.bump('tracks')
+                coherence.changed('tracks', [track_to_update.track_id])
 
+                lookup.indexes['tracks'].add(track_to_update.track_id, track_to_update.track_name)
+                search_index.add_track(track_to_update.track_id, track_to_update.track_name, track_to_update.album_id,
+                                       track_to_update.artist_id, track_to_update.genre)
 
                 return RedirectResponse(url="/main_table", status_code=status.HTTP_303_SEE_OTHER)
 
         except Exception as e:
-                db.rollback()
+                await db.rollback()
                 raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.post("/sorted")
-async def sorted_table(request: Request, db:db_dependency, sort_attribute: str = Form(...), order: str = Form(...)):
-        sorted_tracks = db.query(models.Tracks).all()
+async def sorted_table(request: Request, sort_attribute: str = Form(...), order: str = Form(...)):
+        if sort_attribute not in TRACK_SORT_COLUMNS or order.upper() not in ('ASC', 'DESC'):
+                raise HTTPException(status_code=400, detail=f"Cannot sort by {sort_attribute} {order}")
 
-        # Create an empty DataFrame with the desired columns
-        sorted_df = pd.DataFrame(columns=['track_id', 'track_name', 'album_id', 'artist_id', 'genre'])
- 
-        track_dfs = [pd.DataFrame({'track_id': track.track_id,
-                                'track_name': track.track_name,
-                                'album_id': track.album_id,
-                                'artist_id': track.artist_id,
-                                'genre': track.genre}, index=[0]) for track in sorted_tracks]
+        # Sort state travels with the request instead of being written to a shared file
+        return RedirectResponse(url=f"/main_table?sort_attribute={sort_attribute}&order={order.upper()}", status_code=status.HTTP_303_SEE_OTHER)
+        
+@app.get("/pool_stats")
+async def pool_stats():
+        """Connection pool usage, to size DB_POOL_SIZE / DB_MAX_OVERFLOW from real numbers"""
+        return pool_metrics.snapshot({'sync': engine, 'async': async_engine.sync_engine})
 
-        sorted_df = pd.concat(track_dfs, ignore_index=True)
+@app.get("/catalog/check")
+async def catalog_check(db:db_dependency, repair: bool = False):
+        """Compare the in-memory track names against the database, optionally reloading them"""
+        if not lookup.indexes['tracks'].loaded:
+                raise HTTPException(status_code=503, detail="The track index is still being loaded")
+        result = await lookup.check_consistency(db, 'tracks')
 
-        sort_applied = duckdb.query("SELECT * FROM sorted_df ORDER BY " + str(sort_attribute) + " " + str(order)).df()
+        if repair and not result['consistent']:
+                await coherence.reload('tracks')
+                result['repaired'] = True
 
-        sort_applied.to_html('./html_files/basic.html', index=False)
+        return result
 
-        return RedirectResponse(url="/main_table", status_code=status.HTTP_303_SEE_OTHER)
-        
 @app.get("/playlist_report", response_class=HTMLResponse)
-async def playlist_report(db:db_dependency):
-    all_playlists = db.query(models.Playlists).all()
-
-    try:
-        # Read playlist_main.html
-        with open("./html_files/playlist_main.html", "r") as main_file:
-            main_content = main_file.read()
-        
-        # Read playlist.html
-        with open("./html_files/playlist.html", "r") as basic_file:
-            basic_content = basic_file.read()
-
-        dropdown_options = ""
-        for playlist in all_playlists:
-                dropdown_options += f"<option value='{playlist.playlist_id}'>{playlist.playlist_name}</option>"
-            
-        # Find the closing </body> tag and insert basic_content before it
-        merged_content = main_content.replace("</body>", f"""
-            <div class="data-content">
-                <form method="POST" action="/playlist_access">
-                        <select name="chosen_playlist_id">
-                        {dropdown_options}
-                        </select>
-                        <input type="submit" value="Access Playlist...">
-                </form>
-                {basic_content}
-            </div>
-        </body>""")
-            
-        return merged_content
-            
-    except FileNotFoundError as e:
-        raise HTTPException(status_code=404, detail=f"File not found: {str(e)}")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error reading files: {str(e)}")
+async def playlist_report(request: Request, db:db_dependency):
+    page_validators = conditional.validators('playlist_report', PLAYLIST_REPORT_TABLES)
+    if (response := conditional.not_modified(request, page_validators)) is not None:
+        return response
+
+    # Rendered from the database instead of the html_files/playlist.html that / used to write
+    cache_key = (versions.get('playlists'),)
+    playlist_table = playlist_table_cache.get(cache_key)
+    if playlist_table is None:
+        rows = (await db.execute(select(models.Playlists.playlist_id, models.Playlists.playlist_name,
+                                        models.Playlists.user_id))).all()
+        playlist_table = render_table(PLAYLIST_COLUMNS, rows)
+        playlist_table_cache.put(cache_key, playlist_table)
+
+    playlist_options = await dropdowns.fragment(db, 'playlist_options')
+
+    return conditional.respond(templates.pages['playlist_report'].render(playlist_options=playlist_options,
+                                                                         playlist_table=playlist_table), page_validators)
     
 @app.post("/playlist_access")
-async def playlist_access(request: Request, db:db_dependency, chosen_playlist_id: str = Form(...)):
-        all_playlists = db.query(models.Playlists).all()
-        chosen_playlist = db.query(models.Playlist_Tracks).filter_by(playlist_id=chosen_playlist_id).all()
-
-        # Create an empty DataFrame with the desired columns
-        playlist_df = pd.DataFrame(columns=['playlist_id', 'playlist_name', 'user_id'])
-
-        playlists_dfs = [pd.DataFrame({'playlist_id': playlist.playlist_id,
-                                'playlist_name': playlist.playlist_name,
-                                'user_id': playlist.user_id}, index=[0]) for playlist in all_playlists]
-
-        playlist_df = pd.concat(playlists_dfs, ignore_index=True)
-
-        playlist_df = duckdb.query("SELECT * FROM playlist_df WHERE playlist_id = " + chosen_playlist_id).df()
-
-        tmp = duckdb.query("SELECT playlist_name FROM playlist_df WHERE playlist_id = " + chosen_playlist_id).fetchone()
-        chosen_playlist_name = tmp[0]
-
-        if (not chosen_playlist):
-               chosen_playlist_df = pd.DataFrame(columns=['playlist_id', 'track_id'])
-
-        else:
-                chosen_playlist_df = pd.DataFrame(columns=['playlist_id', 'track_id'])
-                chosen_playlists_dfs = [pd.DataFrame({'playlist_id': playlist_track.playlist_id,
-                                        'track_id': playlist_track.track_id}, index=[0]) for playlist_track in chosen_playlist]
-                chosen_playlist_df = pd.concat(chosen_playlists_dfs, ignore_index=True)
-
-        chosen_playlist_df.to_html('./html_files/chosen_playlist.html', index=False)
-        
+async def playlist_access(request: Request, chosen_playlist_id: str = Form(...)):
         try:
-              # Read playlist_access.html
-                with open("./html_files/playlist_access.html", "r") as main_file:
-                        main_content = main_file.read()
-
-                # Read chosen_playlist.html
-                with open("./html_files/chosen_playlist.html", "r") as main_file:
-                        chosen_playlist_content = main_file.read()
+                playlist_id = int(chosen_playlist_id)
+        except ValueError:
+                raise HTTPException(status_code=400, detail=f"Invalid playlist id {chosen_playlist_id}")
 
-                # Find the closing </body> tag and insert basic_content before it
-                merged_content = main_content.replace("</body>", f"""
-                <div class="data-content">
-                        <h3>{chosen_playlist_name}</h3>
-                        {chosen_playlist_content}
-                </div>
-                </body>""")
-
-                return HTMLResponse(content=merged_content)
-
-        except FileNotFoundError as e:
-                raise HTTPException(status_code=404, detail=f"File not found: {str(e)}")
-        except Exception as e:
-                raise HTTPException(status_code=500, detail=f"Error reading files: {str(e)}")
\ No newline at end of file
+        # The page itself is served (and cached per playlist) by playlist_view.py
+        return RedirectResponse(url=f"/playlist_access/{playlist_id}", status_code=status.HTTP_303_SEE_OTHER)
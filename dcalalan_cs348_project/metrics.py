@@ -0,0 +1,266 @@
+"""Request and SQL metrics, exposed at /metrics in Prometheus text format
+
+MetricsMiddleware times every request per route, and engine event hooks time
+every statement and attribute it to the request that ran it. A request is
+flagged, and logged with samples of its slowest statements, when it is slow,
+runs a slow statement, or runs the same statement many times (the N+1 pattern,
+e.g. one query per row of an earlier result).
+
+Configured through environment variables:
+
+METRICS_SERVER_TIMING      add a Server-Timing header (db, render, total) to every response (1/0)
+METRICS_SLOW_REQUEST_MS    requests slower than this are flagged
+METRICS_SLOW_QUERY_MS      statements slower than this are flagged
+METRICS_N_PLUS_ONE         flag a request running the same statement this many times
+"""
+
+import logging
+import os
+import re
+import time
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from contextvars import ContextVar
+
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from sqlalchemy import event
+
+import pool_metrics
+from write_queue import write_queue
+
+SERVER_TIMING = os.environ.get('METRICS_SERVER_TIMING', '0').lower() in ('1', 'true', 'yes')
+SLOW_REQUEST_SECONDS = float(os.environ.get('METRICS_SLOW_REQUEST_MS', 500)) / 1000
+SLOW_QUERY_SECONDS = float(os.environ.get('METRICS_SLOW_QUERY_MS', 100)) / 1000
+N_PLUS_ONE = int(os.environ.get('METRICS_N_PLUS_ONE', 10))
+
+# Upper bounds (in seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Upper bounds of the statements per request histogram buckets
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100, 250)
+
+SLOW_QUERY_SAMPLES = 3
+
+logger = logging.getLogger(__name__)
+
+# IN lists are expanded to one placeholder per value, count them as one statement
+_IN_LIST = re.compile(r'\((?:\s*(?:\?|%s|:\w+)\s*,)+\s*(?:\?|%s|:\w+)\s*\)')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize(statement):
+    return _WHITESPACE.sub(' ', _IN_LIST.sub('(...)', statement)).strip()
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        running = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            running += count
+            yield bound, running
+
+
+class RequestStats:
+    """What one request spent in the database"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.db_seconds = 0.0
+        self.statements = Counter()
+        # (seconds, statement) of the slowest statements
+        self.slowest = []
+
+    def record(self, statement, seconds):
+        self.db_seconds += seconds
+        self.statements[statement] += 1
+        self.slowest.append((seconds, statement))
+        if len(self.slowest) > SLOW_QUERY_SAMPLES:
+            self.slowest.sort(reverse=True)
+            del self.slowest[SLOW_QUERY_SAMPLES:]
+
+    def repeated(self):
+        """Statements run at least N_PLUS_ONE times"""
+        return {statement: count for statement, count in self.statements.items() if count >= N_PLUS_ONE}
+
+
+_current = ContextVar('request_stats', default=None)
+
+request_latency = defaultdict(lambda: Histogram(LATENCY_BUCKETS))
+request_db_latency = defaultdict(lambda: Histogram(LATENCY_BUCKETS))
+request_statements = defaultdict(lambda: Histogram(STATEMENT_BUCKETS))
+request_counts = Counter()
+flagged_counts = Counter()
+statement_latency = Histogram(LATENCY_BUCKETS)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    seconds = time.perf_counter() - conn.info['query_start'].pop()
+    statement_latency.observe(seconds)
+    stats = _current.get()
+    if stats is not None:
+        stats.record(normalize(statement), seconds)
+
+
+def instrument(*engines):
+    """Time the statements of `engines` (sync engines, pass async_engine.sync_engine)"""
+    for engine in engines:
+        event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+def _route(scope):
+    route = scope.get('route')
+    return getattr(route, 'path', None) or 'unmatched'
+
+
+def _finish(method, route, status, stats):
+    total = time.perf_counter() - stats.start
+    statement_count = sum(stats.statements.values())
+    key = (method, route)
+    request_latency[key].observe(total)
+    request_db_latency[key].observe(stats.db_seconds)
+    request_statements[key].observe(statement_count)
+    request_counts[(method, route, str(status))] += 1
+
+    reasons = []
+    if total >= SLOW_REQUEST_SECONDS:
+        reasons.append('slow_request')
+    if stats.slowest and max(stats.slowest)[0] >= SLOW_QUERY_SECONDS:
+        reasons.append('slow_query')
+    repeated = stats.repeated()
+    if repeated:
+        reasons.append('n_plus_one')
+    for reason in reasons:
+        flagged_counts[(method, route, reason)] += 1
+
+    if reasons:
+        samples = "".join(f"\n    {seconds * 1000:.1f} ms  {statement[:500]}"
+                          for seconds, statement in sorted(stats.slowest, reverse=True))
+        samples += "".join(f"\n    run {count} times  {statement[:500]}" for statement, count in repeated.items())
+        logger.warning("%s %s flagged (%s): %.1f ms total, %.1f ms in %d statements%s", method, route,
+                       ", ".join(reasons), total * 1000, stats.db_seconds * 1000, statement_count, samples)
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording per route latency and the statements each request ran"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = _current.set(stats)
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                if SERVER_TIMING:
+                    total = time.perf_counter() - stats.start
+                    header = (f"db;dur={stats.db_seconds * 1000:.2f};desc=\"{sum(stats.statements.values())} statements\", "
+                              f"render;dur={(total - stats.db_seconds) * 1000:.2f}, total;dur={total * 1000:.2f}")
+                    message['headers'] = list(message.get('headers', [])) + [(b'server-timing', header.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current.reset(token)
+            _finish(scope['method'], _route(scope), status, stats)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels):
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+def _histogram_lines(name, histograms):
+    for (method, route), histogram in sorted(histograms.items()):
+        for bound, count in histogram.cumulative():
+            yield f"{name}_bucket{_labels(method=method, route=route, le=bound)} {count}"
+        yield f"{name}_sum{_labels(method=method, route=route)} {histogram.sum}"
+        yield f"{name}_count{_labels(method=method, route=route)} {histogram.count}"
+
+
+def render():
+    """Every metric in the Prometheus text exposition format"""
+    lines = ["# HELP http_request_duration_seconds Time to handle a request",
+             "# TYPE http_request_duration_seconds histogram",
+             *_histogram_lines('http_request_duration_seconds', request_latency),
+             "# HELP http_request_db_seconds Time a request spent running SQL statements",
+             "# TYPE http_request_db_seconds histogram",
+             *_histogram_lines('http_request_db_seconds', request_db_latency),
+             "# HELP http_request_db_statements SQL statements run per request",
+             "# TYPE http_request_db_statements histogram",
+             *_histogram_lines('http_request_db_statements', request_statements),
+             "# HELP http_requests_total Requests handled",
+             "# TYPE http_requests_total counter"]
+    lines += [f"http_requests_total{_labels(method=method, route=route, status=status)} {count}"
+              for (method, route, status), count in sorted(request_counts.items())]
+
+    lines += ["# HELP http_requests_flagged_total Requests flagged as slow or running repeated statements",
+              "# TYPE http_requests_flagged_total counter"]
+    lines += [f"http_requests_flagged_total{_labels(method=method, route=route, reason=reason)} {count}"
+              for (method, route, reason), count in sorted(flagged_counts.items())]
+
+    lines += ["# HELP db_statement_duration_seconds Time to run one SQL statement",
+              "# TYPE db_statement_duration_seconds histogram"]
+    lines += [f"db_statement_duration_seconds_bucket{_labels(le=bound)} {count}"
+              for bound, count in statement_latency.cumulative()]
+    lines += [f"db_statement_duration_seconds_sum {statement_latency.sum}",
+              f"db_statement_duration_seconds_count {statement_latency.count}"]
+
+    lines += ["# HELP db_pool_wait_seconds Time spent waiting for a pooled connection",
+              "# TYPE db_pool_wait_seconds histogram"]
+    for pool, stats in sorted(pool_metrics.pool_stats.items()):
+        lines += [f"db_pool_wait_seconds_bucket{_labels(pool=pool, le=bound)} {count}"
+                  for bound, count in stats.histogram().items()]
+        lines += [f"db_pool_wait_seconds_sum{_labels(pool=pool)} {stats.wait_total}",
+                  f"db_pool_wait_seconds_count{_labels(pool=pool)} {stats.checkouts}"]
+
+    lines += ["# HELP db_pool_timeouts_total Checkouts that gave up waiting for a connection",
+              "# TYPE db_pool_timeouts_total counter"]
+    lines += [f"db_pool_timeouts_total{_labels(pool=pool)} {stats.timeouts}"
+              for pool, stats in sorted(pool_metrics.pool_stats.items())]
+
+    lines += ["# HELP db_write_batches_total Transactions committed by the write queue",
+              "# TYPE db_write_batches_total counter",
+              f"db_write_batches_total {write_queue.batches}",
+              "# HELP db_write_batch_writes_total Writes committed through the write queue",
+              "# TYPE db_write_batch_writes_total counter",
+              f"db_write_batch_writes_total {write_queue.writes}",
+              "# HELP db_write_batch_retries_total Batches rolled back and run again one write at a time",
+              "# TYPE db_write_batch_retries_total counter",
+              f"db_write_batch_retries_total {write_queue.retried_batches}"]
+    return "\n".join(lines) + "\n"
+
+
+router = APIRouter()
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(render(), media_type='text/plain; version=0.0.4')
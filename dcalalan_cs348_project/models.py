@@ -1,4 +1,4 @@
-from sqlalchemy import Boolean, Column, Integer, String, ForeignKey
+from sqlalchemy import Boolean, Column, Integer, String, ForeignKey, Index
 from database import Base
 
 """
@@ -44,6 +44,15 @@ class Tracks(Base):
     artist_id = Column(Integer, ForeignKey('artists.artist_id'))
     genre = Column(String(50), ForeignKey('genres.genre'))
 
+    # Support the sortable columns of the main table, the trailing track_id makes
+    # keyset pagination an index range scan
+    __table_args__ = (
+        Index('ix_tracks_track_name_track_id', 'track_name', 'track_id'),
+        Index('ix_tracks_album_id_track_id', 'album_id', 'track_id'),
+        Index('ix_tracks_artist_id_track_id', 'artist_id', 'track_id'),
+        Index('ix_tracks_genre_track_id', 'genre', 'track_id'),
+    )
+
 class Albums(Base):
     __tablename__ = 'albums'
 
@@ -51,6 +60,11 @@ class Albums(Base):
     album_name = Column(String(50))
     artist_id = Column(Integer, ForeignKey('artists.artist_id'))
 
+    # An artist's albums in album_id order
+    __table_args__ = (
+        Index('ix_albums_artist_id_album_id', 'artist_id', 'album_id'),
+    )
+
 class Genres(Base):
     __tablename__ = 'genres'
 
@@ -63,8 +77,39 @@ class Playlists(Base):
     playlist_name = Column(String(100))
     user_id = Column(Integer, ForeignKey('listeners.user_id'))
 
+    # A listener's playlists in playlist_id order
+    __table_args__ = (
+        Index('ix_playlists_user_id_playlist_id', 'user_id', 'playlist_id'),
+    )
+
 class Playlist_Tracks(Base):
     __tablename__ = 'playlist_tracks'
 
     playlist_id = Column(Integer, ForeignKey('playlists.playlist_id'), primary_key=True)
-    track_id = Column(Integer, ForeignKey('tracks.track_id'), primary_key=True)
\ No newline at end of file
+    track_id = Column(Integer, ForeignKey('tracks.track_id'), primary_key=True)
+
+    # The primary key starts with playlist_id, this finds the playlists of a track
+    # (popularity recounts, deleting a track)
+    __table_args__ = (
+        Index('ix_playlist_tracks_track_id_playlist_id', 'track_id', 'playlist_id'),
+    )
+
+class Track_Popularity(Base):
+    """Number of playlists each track is in, maintained by the write endpoints (see popularity.py)"""
+    __tablename__ = 'track_popularity'
+
+    track_id = Column(Integer, ForeignKey('tracks.track_id'), primary_key=True)
+    artist_id = Column(Integer, ForeignKey('artists.artist_id'))
+    playlist_count = Column(Integer, nullable=False, default=0)
+
+    # Finding an artist's most popular tracks is a seek on this index
+    __table_args__ = (
+        Index('ix_track_popularity_artist_id_playlist_count', 'artist_id', 'playlist_count'),
+    )
+
+class Artist_Popularity(Base):
+    """Highest playlist_count among each artist's tracks"""
+    __tablename__ = 'artist_popularity'
+
+    artist_id = Column(Integer, ForeignKey('artists.artist_id'), primary_key=True)
+    top_playlist_count = Column(Integer, nullable=False, default=0)
@@ -0,0 +1,102 @@
+"""Keyset (seek) pagination helpers
+
+A page is fetched with `WHERE sort_column >= last value AND (sort_column > last
+value OR key > last key) ORDER BY sort_column, key LIMIT n`, so the database
+walks an index from where the previous page stopped instead of sorting and
+skipping the whole table.
+The position of the last row is handed to the client as an opaque `after` cursor.
+"""
+
+import base64
+import json
+
+from sqlalchemy import and_, or_
+
+import models
+
+# Only these columns may be used in ORDER BY, each has a (column, track_id) index
+TRACK_SORT_COLUMNS = {
+    'track_id': models.Tracks.track_id,
+    'track_name': models.Tracks.track_name,
+    'album_id': models.Tracks.album_id,
+    'artist_id': models.Tracks.artist_id,
+    'genre': models.Tracks.genre,
+}
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Decode a cursor made by `encode_cursor`, raising ValueError if it is malformed."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except Exception:
+        raise ValueError(f"Invalid cursor {cursor!r}")
+    if not isinstance(values, list) or len(values) != 2:
+        raise ValueError(f"Invalid cursor {cursor!r}")
+    return values
+
+
+def _seek(sort_column, key_column, descending, last_value, last_key):
+    """WHERE clauses selecting the rows after (last_value, last_key) in the sort order.
+
+    NULLs come first ascending and last descending, which is how both MySQL and
+    SQLite order them. Each clause is a single range of the (sort_column, key)
+    index; an OR with `IS NULL` would make the database walk the index from its
+    start, so the rows are split into clauses to be fetched in turn.
+    """
+    if sort_column is key_column:
+        return [key_column < last_key if descending else key_column > last_key]
+
+    if not descending:
+        if last_value is None:
+            return [and_(sort_column.is_(None), key_column > last_key), sort_column.isnot(None)]
+        return [and_(sort_column >= last_value, or_(sort_column > last_value, key_column > last_key))]
+
+    if last_value is None:
+        return [and_(sort_column.is_(None), key_column < last_key)]
+    return [and_(sort_column <= last_value, or_(sort_column < last_value, key_column < last_key)),
+            sort_column.is_(None)]
+
+
+async def keyset_page(db, stmt, sort_column, key_column, order='ASC', after=None, limit=50, scalars=True):
+    """Run one page of `stmt` ordered by (sort_column, key_column).
+
+    Returns the rows (ORM objects, or Row tuples when `scalars` is False) and the
+    cursor for the next page, which is None on the last page.
+    """
+    if order.upper() not in ('ASC', 'DESC'):
+        raise ValueError(f"Unknown sort order {order!r}")
+    descending = order.upper() == 'DESC'
+
+    if after:
+        last_value, last_key = decode_cursor(after)
+        seeks = _seek(sort_column, key_column, descending, last_value, last_key)
+    else:
+        seeks = [None]
+
+    if sort_column is key_column:
+        ordering = [key_column.desc() if descending else key_column.asc()]
+    elif descending:
+        ordering = [sort_column.desc(), key_column.desc()]
+    else:
+        ordering = [sort_column.asc(), key_column.asc()]
+
+    # Fetch one extra row to find out whether there is a next page
+    rows = []
+    for seek in seeks:
+        page = stmt if seek is None else stmt.where(seek)
+        result = await db.execute(page.order_by(*ordering).limit(limit + 1 - len(rows)))
+        rows += result.scalars().all() if scalars else result.all()
+        if len(rows) > limit:
+            break
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor([getattr(last, sort_column.key), getattr(last, key_column.key)])
+
+    return rows, next_cursor
@@ -0,0 +1,135 @@
+"""Adding and removing many tracks of a playlist at once
+
+POST /playlists/{playlist_id}/tracks         {"track_ids": [...]}
+POST /playlists/{playlist_id}/tracks/remove  {"track_ids": [...]}
+
+Each request is one transaction with set-based statements: tracks already in the
+playlist (or that don't exist) are skipped instead of raising, and the response
+says how many tracks were added/removed and which ones were skipped.
+
+add_tracks and remove_tracks don't bump the versions themselves, they return the
+counters to bump once the transaction is committed: a page rendered between the
+bump and the commit would otherwise be cached under the new version with the old rows.
+"""
+
+from fastapi import APIRouter, HTTPException
+from sqlalchemy import select, insert, delete
+from sqlalchemy.dialects import postgresql, sqlite
+
+import models
+import popularity
+import versions
+from playlist_view import version_key
+from database import db_dependency
+from schemas import TrackIdsBatch
+
+MAX_BATCH_SIZE = 10000
+# Rows per INSERT statement, keeps each statement well under the backend's parameter limits
+CHUNK_SIZE = 500
+
+PT = models.Playlist_Tracks
+
+router = APIRouter()
+
+
+def _insert_ignore(db):
+    """INSERT that skips rows whose primary key already exists"""
+    dialect = db.bind.dialect.name
+    if dialect == 'mysql':
+        return insert(PT).prefix_with('IGNORE')
+    if dialect == 'sqlite':
+        return sqlite.insert(PT).on_conflict_do_nothing()
+    if dialect == 'postgresql':
+        return postgresql.insert(PT).on_conflict_do_nothing()
+    return insert(PT)
+
+
+async def add_tracks(db, playlist_id, track_ids):
+    """Add `track_ids` to a playlist without committing, returns the counts and the versions to bump"""
+    wanted = list(dict.fromkeys(int(track_id) for track_id in track_ids))
+
+    existing = set((await db.execute(select(models.Tracks.track_id)
+                                     .where(models.Tracks.track_id.in_(wanted)))).scalars())
+    already = set((await db.execute(select(PT.track_id)
+                                    .where(PT.playlist_id == playlist_id, PT.track_id.in_(wanted)))).scalars())
+    to_add = [track_id for track_id in wanted if track_id in existing and track_id not in already]
+
+    added = 0
+    exact = True
+    for start in range(0, len(to_add), CHUNK_SIZE):
+        chunk = to_add[start:start + CHUNK_SIZE]
+        result = await db.execute(_insert_ignore(db).values([{'playlist_id': playlist_id, 'track_id': track_id}
+                                                             for track_id in chunk]))
+        added += result.rowcount
+        # A concurrent request added some of the same tracks first
+        exact = exact and result.rowcount == len(chunk)
+
+    bumps = ['playlist_tracks', version_key(playlist_id)] if added else []
+    if exact:
+        bumps += await popularity.tracks_added(db, to_add)
+    else:
+        bumps += await popularity.recount_tracks(db, to_add)
+
+    return {'added': added,
+            'skipped': len(wanted) - added,
+            'already_in_playlist': sorted(already),
+            'unknown_tracks': sorted(set(wanted) - existing)}, bumps
+
+
+async def remove_tracks(db, playlist_id, track_ids):
+    """Remove `track_ids` from a playlist without committing, returns the counts and the versions to bump"""
+    wanted = list(dict.fromkeys(int(track_id) for track_id in track_ids))
+
+    present = list((await db.execute(select(PT.track_id)
+                                     .where(PT.playlist_id == playlist_id, PT.track_id.in_(wanted)))).scalars())
+
+    removed = 0
+    exact = True
+    for start in range(0, len(present), CHUNK_SIZE):
+        chunk = present[start:start + CHUNK_SIZE]
+        result = await db.execute(delete(PT).where(PT.playlist_id == playlist_id, PT.track_id.in_(chunk)))
+        removed += result.rowcount
+        exact = exact and result.rowcount == len(chunk)
+
+    bumps = ['playlist_tracks', version_key(playlist_id)] if removed else []
+    if exact:
+        bumps += await popularity.tracks_removed(db, present)
+    else:
+        bumps += await popularity.recount_tracks(db, present)
+
+    return {'removed': removed,
+            'skipped': len(wanted) - removed,
+            'not_in_playlist': sorted(set(wanted) - set(present))}, bumps
+
+
+async def _check(db, playlist_id, batch):
+    if len(batch.track_ids) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_SIZE} tracks per request")
+    if await db.get(models.Playlists, playlist_id) is None:
+        raise HTTPException(status_code=404, detail=f"Playlist {playlist_id} not found")
+
+
+@router.post("/playlists/{playlist_id}/tracks")
+async def add_playlist_tracks(playlist_id: int, batch: TrackIdsBatch, db: db_dependency):
+    await _check(db, playlist_id, batch)
+    try:
+        result, bumps = await add_tracks(db, playlist_id, batch.track_ids)
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(status_code=500, detail=str(e))
+    versions.bump(*bumps)
+    return result
+
+
+@router.post("/playlists/{playlist_id}/tracks/remove")
+async def remove_playlist_tracks(playlist_id: int, batch: TrackIdsBatch, db: db_dependency):
+    await _check(db, playlist_id, batch)
+    try:
+        result, bumps = await remove_tracks(db, playlist_id, batch.track_ids)
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(status_code=500, detail=str(e))
+    versions.bump(*bumps)
+    return result
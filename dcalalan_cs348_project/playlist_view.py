@@ -0,0 +1,118 @@
+"""Viewing one playlist with the details of its tracks
+
+GET /playlist_access/{playlist_id}?after=<cursor>
+
+The playlist is fetched by primary key and its tracks with a single join from
+playlist_tracks to tracks, albums and artists, one keyset page at a time. Rendered
+pages are cached per playlist and keyed by that playlist's version, which
+playlist_tracks.py bumps whenever tracks are added to or removed from it, so a
+change to one playlist doesn't throw away the cached pages of the others.
+"""
+
+from collections import OrderedDict
+from html import escape
+
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import HTMLResponse
+from sqlalchemy import select
+
+import conditional
+import models
+import templates
+import versions
+from database import db_dependency
+from pagination import keyset_page
+from render import render_table
+from render_cache import RenderCache
+
+PAGE_SIZE = 50
+# How many playlists keep their rendered pages around
+MAX_CACHED_PLAYLISTS = 256
+
+COLUMNS = ('track_id', 'track_name', 'album_name', 'artist_name', 'genre')
+
+PT = models.Playlist_Tracks
+
+
+def version_key(playlist_id):
+    """Name of the versions.py counter of one playlist's tracks"""
+    return f'playlist_tracks:{playlist_id}'
+
+
+class PlaylistPageCache:
+    """One RenderCache per playlist, least recently viewed playlists dropped first"""
+
+    def __init__(self, maxsize=MAX_CACHED_PLAYLISTS):
+        self.maxsize = maxsize
+        self._playlists = OrderedDict()
+
+    def __len__(self):
+        return len(self._playlists)
+
+    def for_playlist(self, playlist_id):
+        cache = self._playlists.get(playlist_id)
+        if cache is None:
+            cache = self._playlists[playlist_id] = RenderCache(maxsize=16)
+            if len(self._playlists) > self.maxsize:
+                self._playlists.popitem(last=False)
+        self._playlists.move_to_end(playlist_id)
+        return cache
+
+    def invalidate(self):
+        self._playlists.clear()
+
+
+playlist_page_cache = PlaylistPageCache()
+
+
+def _tables(playlist_id):
+    # Renaming, moving or deleting a track changes what every playlist shows
+    return [version_key(playlist_id), 'tracks']
+
+
+def _version(playlist_id):
+    return versions.snapshot(*_tables(playlist_id))
+
+
+async def render_playlist_page(db, playlist, after):
+    stmt = (select(PT.track_id, models.Tracks.track_name, models.Albums.album_name,
+                   models.Artists.artist_name, models.Tracks.genre)
+            .join(models.Tracks, models.Tracks.track_id == PT.track_id)
+            .outerjoin(models.Albums, models.Albums.album_id == models.Tracks.album_id)
+            .outerjoin(models.Artists, models.Artists.artist_id == models.Tracks.artist_id)
+            .where(PT.playlist_id == playlist.playlist_id))
+    rows, next_cursor = await keyset_page(db, stmt, PT.track_id, PT.track_id, after=after, limit=PAGE_SIZE, scalars=False)
+
+    links = [f"<a href='/playlist_access/{playlist.playlist_id}'>First page</a>"]
+    if next_cursor:
+        links.append(f"<a href='/playlist_access/{playlist.playlist_id}?after={next_cursor}'>Next</a>")
+
+    return render_table(COLUMNS, rows) + "\n<p>" + " | ".join(links) + "</p>"
+
+
+router = APIRouter()
+
+
+@router.get("/playlist_access/{playlist_id}", response_class=HTMLResponse)
+async def playlist_access(playlist_id: int, request: Request, db: db_dependency, after: str = None):
+    page_validators = conditional.validators('playlist_access', _tables(playlist_id), playlist_id, after)
+    if (response := conditional.not_modified(request, page_validators)) is not None:
+        return response
+
+    playlist = await db.get(models.Playlists, playlist_id)
+    if playlist is None:
+        raise HTTPException(status_code=404, detail=f"Playlist {playlist_id} not found")
+
+    cache = playlist_page_cache.for_playlist(playlist_id)
+    key = (_version(playlist_id), after)
+    content = cache.get(key)
+    if content is None:
+        try:
+            content = await render_playlist_page(db, playlist, after)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        cache.put(key, content)
+
+    page = templates.pages['playlist_access'].render(playlist_name=escape(str(playlist.playlist_name)),
+                                                     playlist_content=content)
+    return conditional.respond(page, page_validators)
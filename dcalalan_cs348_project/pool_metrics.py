@@ -0,0 +1,98 @@
+"""Connection pool statistics
+
+The engines in database.py are created with the pool classes below, which time
+how long each checkout waits for a connection. Together with the pool's own
+counters this is what /pool_stats reports, so the pool can be sized from real
+numbers instead of guesses.
+"""
+
+import time
+from bisect import bisect_left
+
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+
+# Upper bounds (in seconds) of the wait time histogram buckets
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class PoolStats:
+    """Counters and a wait time histogram for one pool"""
+
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        # One count per bucket plus a final +Inf bucket
+        self.wait_counts = [0] * (len(WAIT_BUCKETS) + 1)
+
+    def record_wait(self, seconds, timed_out=False):
+        self.checkouts += 1
+        if timed_out:
+            self.timeouts += 1
+        self.wait_total += seconds
+        self.wait_max = max(self.wait_max, seconds)
+        self.wait_counts[bisect_left(WAIT_BUCKETS, seconds)] += 1
+
+    def histogram(self):
+        """Cumulative bucket counts keyed by upper bound, Prometheus style"""
+        buckets = {}
+        running = 0
+        for bound, count in zip(WAIT_BUCKETS + ('+Inf',), self.wait_counts):
+            running += count
+            buckets[str(bound)] = running
+        return buckets
+
+
+class _TimedPoolMixin:
+    """Records how long every checkout spent waiting for a connection"""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            self.stats.record_wait(time.perf_counter() - start, timed_out=True)
+            raise
+        self.stats.record_wait(time.perf_counter() - start)
+        return connection
+
+    @property
+    def stats(self):
+        # Pools are recreated on dispose(), so the numbers live in the module-level registry
+        return pool_stats.setdefault(self._stats_name, PoolStats())
+
+
+class TimedQueuePool(_TimedPoolMixin, QueuePool):
+    _stats_name = 'sync'
+
+
+class TimedAsyncAdaptedQueuePool(_TimedPoolMixin, AsyncAdaptedQueuePool):
+    _stats_name = 'async'
+
+
+pool_stats = {}
+
+
+def snapshot(engines):
+    """Current state of each engine's pool, keyed by the names in `engines`"""
+    result = {}
+    for name, engine in engines.items():
+        pool = engine.pool
+        entry = {'pool_class': type(pool).__name__}
+        if isinstance(pool, QueuePool):
+            entry.update({'size': pool.size(),
+                          'checked_out': pool.checkedout(),
+                          'checked_in': pool.checkedin(),
+                          'overflow': pool.overflow(),
+                          'timeout': pool.timeout()})
+        stats = pool_stats.get(getattr(pool, '_stats_name', None))
+        if stats is not None:
+            entry.update({'checkouts': stats.checkouts,
+                          'timeouts': stats.timeouts,
+                          'wait_seconds_total': stats.wait_total,
+                          'wait_seconds_max': stats.wait_max,
+                          'wait_seconds_histogram': stats.histogram()})
+        result[name] = entry
+    return result
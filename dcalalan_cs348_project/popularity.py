@@ -0,0 +1,210 @@
+"""Incrementally maintained track popularity for the artist report
+
+`track_popularity` holds how many playlists each track is in and
+`artist_popularity` the highest of those counts per artist. The write endpoints
+call the functions below inside their own transaction, so the counters commit or
+roll back together with the playlist change, and /report only has to read one
+row per artist (plus ties) instead of re-aggregating playlist_tracks.
+
+Counts are changed with upserts and the per-artist maximum is recomputed by the
+UPDATE itself, so concurrent writes to the same track or artist neither fail on
+a duplicate key nor leave a stale maximum behind. The functions return the
+versions to bump, which the caller does once its transaction is committed.
+
+A schema migration (see schema.py) backfills the tables once, to repair them run
+`python popularity.py rebuild`.
+"""
+
+import argparse
+import asyncio
+from collections import Counter
+
+from sqlalchemy import select, insert, update, delete, func
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+
+import models
+import versions
+
+TP = models.Track_Popularity
+AP = models.Artist_Popularity
+
+# Rows per INSERT statement, keeps each statement well under the backend's parameter limits
+CHUNK_SIZE = 500
+BUMPS = ('track_popularity',)
+
+
+def _upsert(db, model, rows, **on_conflict):
+    """INSERT of `rows` that updates the columns in `on_conflict` (functions of the
+    row that was about to be inserted) when the primary key exists, or skips them
+    when `on_conflict` is empty"""
+    dialect = db.bind.dialect.name
+    if dialect == 'mysql':
+        stmt = mysql.insert(model).values(rows)
+        if not on_conflict:
+            return stmt.prefix_with('IGNORE')
+        return stmt.on_duplicate_key_update({column: value(stmt.inserted) for column, value in on_conflict.items()})
+    stmt = (sqlite.insert(model) if dialect == 'sqlite' else postgresql.insert(model)).values(rows)
+    if not on_conflict:
+        return stmt.on_conflict_do_nothing()
+    return stmt.on_conflict_do_update(index_elements=[key.name for key in model.__table__.primary_key],
+                                      set_={column: value(stmt.excluded) for column, value in on_conflict.items()})
+
+
+async def _refresh_artists(db, artist_ids):
+    """Recompute top_playlist_count for `artist_ids` from track_popularity"""
+    artist_ids = sorted({artist_id for artist_id in artist_ids if artist_id is not None})
+    if not artist_ids:
+        return
+
+    for start in range(0, len(artist_ids), CHUNK_SIZE):
+        chunk = artist_ids[start:start + CHUNK_SIZE]
+        await db.execute(_upsert(db, AP, [{'artist_id': artist_id, 'top_playlist_count': 0} for artist_id in chunk]))
+        top = (select(func.coalesce(func.max(TP.playlist_count), 0))
+               .where(TP.artist_id == AP.artist_id)
+               .scalar_subquery())
+        await db.execute(update(AP).where(AP.artist_id.in_(chunk)).values(top_playlist_count=top)
+                         .execution_options(synchronize_session=False))
+
+
+async def _change_counts(db, counts):
+    """Add counts[track_id] to each track's playlist_count, creating rows as needed"""
+    track_artists = dict((await db.execute(select(models.Tracks.track_id, models.Tracks.artist_id)
+                                           .where(models.Tracks.track_id.in_(counts)))).all())
+
+    rows = [{'track_id': track_id, 'artist_id': track_artists[track_id], 'playlist_count': change}
+            for track_id, change in counts.items() if track_id in track_artists and change]
+    for start in range(0, len(rows), CHUNK_SIZE):
+        await db.execute(_upsert(db, TP, rows[start:start + CHUNK_SIZE],
+                                 playlist_count=lambda new: TP.playlist_count + new.playlist_count))
+
+    # Tracks that are no longer in any playlist don't need a row
+    await db.execute(delete(TP).where(TP.track_id.in_(counts), TP.playlist_count <= 0))
+
+    await _refresh_artists(db, set(track_artists.values()))
+    return BUMPS
+
+
+async def tracks_added(db, track_ids):
+    """Record that each of `track_ids` was added to one more playlist"""
+    counts = Counter(int(track_id) for track_id in track_ids)
+    return await _change_counts(db, counts) if counts else ()
+
+
+async def tracks_removed(db, track_ids):
+    """Record that each of `track_ids` was removed from one playlist"""
+    counts = Counter({int(track_id): -n for track_id, n in Counter(track_ids).items()})
+    return await _change_counts(db, counts) if counts else ()
+
+
+async def _drop_tracks(db, condition):
+    artist_ids = set((await db.execute(select(TP.artist_id).where(condition).distinct())).scalars())
+    await db.execute(delete(TP).where(condition))
+    await _refresh_artists(db, artist_ids)
+    return BUMPS
+
+
+async def tracks_deleted(db, track_ids):
+    """Drop the counters of tracks deleted from the catalog"""
+    track_ids = [int(track_id) for track_id in track_ids]
+    return await _drop_tracks(db, TP.track_id.in_(track_ids)) if track_ids else ()
+
+
+async def tracks_deleted_in(db, tracks):
+    """Like tracks_deleted, for the track ids selected by the `tracks` statement"""
+    return await _drop_tracks(db, TP.track_id.in_(tracks))
+
+
+async def artists_deleted(db, artist_ids):
+    """Drop the counters of deleted artists, call after deleting their tracks' counters"""
+    artist_ids = [int(artist_id) for artist_id in artist_ids]
+    if not artist_ids:
+        return ()
+
+    await db.execute(delete(TP).where(TP.artist_id.in_(artist_ids)))
+    await db.execute(delete(AP).where(AP.artist_id.in_(artist_ids)))
+    return BUMPS
+
+
+async def recount_tracks(db, track_ids):
+    """Set the counters of `track_ids` from playlist_tracks, for when the exact change isn't known"""
+    track_ids = {int(track_id) for track_id in track_ids}
+    if not track_ids:
+        return ()
+
+    counts = Counter(dict((await db.execute(select(models.Playlist_Tracks.track_id, func.count())
+                                            .where(models.Playlist_Tracks.track_id.in_(track_ids))
+                                            .group_by(models.Playlist_Tracks.track_id))).all()))
+    current = dict((await db.execute(select(TP.track_id, TP.playlist_count).where(TP.track_id.in_(track_ids)))).all())
+
+    changes = Counter({track_id: counts[track_id] - current.get(track_id, 0) for track_id in track_ids})
+    return await _change_counts(db, changes)
+
+
+def _counters_report():
+    return (select(models.Artists.artist_name, models.Tracks.track_name, TP.playlist_count)
+            .select_from(AP)
+            .join(TP, (TP.artist_id == AP.artist_id) & (TP.playlist_count == AP.top_playlist_count))
+            .join(models.Tracks, models.Tracks.track_id == TP.track_id)
+            .join(models.Artists, models.Artists.artist_id == AP.artist_id)
+            .where(AP.top_playlist_count > 0)
+            .order_by(models.Artists.artist_name, models.Tracks.track_name))
+
+
+async def report_rows(run):
+    """(artist_name, most_popular_track, playlist_count) per artist, one row per tied track
+
+    `run` returns the rows of a statement, from the database or the analytics
+    snapshot (see analytics.reader)."""
+    return await run(_counters_report())
+
+
+def _rebuild_statements():
+    return [
+        delete(AP),
+        delete(TP),
+        insert(TP).from_select(
+            ['track_id', 'artist_id', 'playlist_count'],
+            select(models.Tracks.track_id, models.Tracks.artist_id, func.count())
+            .join(models.Playlist_Tracks, models.Playlist_Tracks.track_id == models.Tracks.track_id)
+            .group_by(models.Tracks.track_id, models.Tracks.artist_id)),
+        insert(AP).from_select(
+            ['artist_id', 'top_playlist_count'],
+            select(TP.artist_id, func.max(TP.playlist_count))
+            .where(TP.artist_id.isnot(None))
+            .group_by(TP.artist_id)),
+    ]
+
+
+async def rebuild(db):
+    """Recompute both tables from playlist_tracks and commit"""
+    for stmt in _rebuild_statements():
+        await db.execute(stmt)
+    await db.commit()
+    versions.bump('track_popularity')
+
+
+def backfill(conn):
+    """Recompute both tables on a sync connection, in its transaction
+
+    Run once by the schema migration that introduced the tables (see schema.py),
+    so workers starting together don't each rebuild them."""
+    for stmt in _rebuild_statements():
+        conn.execute(stmt)
+
+
+async def _main():
+    from database import async_session_local, async_engine
+
+    async with async_session_local() as db:
+        await rebuild(db)
+        artists = (await db.execute(select(func.count()).select_from(AP))).scalar()
+        tracks = (await db.execute(select(func.count()).select_from(TP))).scalar()
+    await async_engine.dispose()
+    print(f"Rebuilt popularity for {tracks} tracks and {artists} artists")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('command', choices=['rebuild'])
+    parser.parse_args()
+    asyncio.run(_main())
@@ -0,0 +1,254 @@
+""""Often playlisted together" recommendations
+
+A background task builds a snapshot from playlist_tracks: the playlist x track
+incidence matrix A (SciPy CSR), the track x track co-occurrence counts C = AᵀA,
+normalized by cosine (C_ij / sqrt(n_i n_j)) or lift (C_ij N / (n_i n_j)) where n_i
+is how many playlists track i is in, and the top-K neighbors of every track.
+C is computed a block of tracks at a time and only the top-K of each row is
+kept, so memory stays bounded by A plus one block.
+
+Requests only index into the snapshot's arrays, and a rebuild replaces the whole
+snapshot with one assignment, so requests never see a half-built one. NumPy and
+SciPy are imported by the first build, not when the app starts.
+
+GET /recommend/track/{track_id}?limit=10
+GET /recommend/playlist/{playlist_id}?limit=10   ("continue this playlist")
+POST /recommend/rebuild
+
+Configured through environment variables:
+
+RECOMMEND_SIMILARITY        cosine (default) or lift
+RECOMMEND_TOP_K             neighbors kept per track
+RECOMMEND_MIN_SUPPORT       with lift, ignore pairs in fewer playlists than this (a
+                            pair of rare tracks seen together once has a huge lift)
+RECOMMEND_REBUILD_SECONDS   how often to check whether playlists changed and rebuild
+"""
+
+import asyncio
+import logging
+import math
+import os
+import time
+
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import ORJSONResponse
+from sqlalchemy import select
+
+import models
+import versions
+import lookup
+from database import async_session_local
+
+SIMILARITY = os.environ.get('RECOMMEND_SIMILARITY', 'cosine')
+TOP_K = int(os.environ.get('RECOMMEND_TOP_K', 50))
+MIN_SUPPORT = int(os.environ.get('RECOMMEND_MIN_SUPPORT', 2))
+REBUILD_SECONDS = float(os.environ.get('RECOMMEND_REBUILD_SECONDS', 600))
+
+# Tracks per block of co-occurrence rows computed at once
+BLOCK_SIZE = 4096
+LOAD_BATCH_SIZE = 50000
+MAX_LIMIT = 100
+# Bounds the work of a playlist recommendation: neighbors of at most this many of
+# its tracks, and only the best few of each, are combined
+PLAYLIST_SEED_TRACKS = 50
+PLAYLIST_NEIGHBORS = 20
+
+PT = models.Playlist_Tracks
+
+logger = logging.getLogger(__name__)
+
+
+class Snapshot:
+    """Everything the endpoints need, built once and never modified"""
+
+    def __init__(self, version, track_ids, playlist_ids, incidence, neighbors, scores, seconds):
+        self.version = version
+        self.built_at = time.time()
+        self.build_seconds = seconds
+        # Sorted ids, the row of an id is found with searchsorted
+        self.track_ids = track_ids
+        self.playlist_ids = playlist_ids
+        self.incidence = incidence
+        # (tracks x TOP_K) neighbor rows (-1 where a track has fewer neighbors) and their scores
+        self.neighbors = neighbors
+        self.scores = scores
+
+    def _row(self, ids, wanted):
+        import numpy as np
+
+        row = int(np.searchsorted(ids, wanted))
+        return row if row < len(ids) and ids[row] == wanted else None
+
+    def for_track(self, track_id, limit):
+        row = self._row(self.track_ids, track_id)
+        if row is None:
+            return []
+        neighbors = self.neighbors[row, :limit]
+        found = neighbors >= 0
+        return list(zip(self.track_ids[neighbors[found]].tolist(), self.scores[row, :limit][found].tolist()))
+
+    def for_playlist(self, playlist_id, limit):
+        """Tracks most often playlisted with the playlist's tracks, summing their scores"""
+        import numpy as np
+
+        row = self._row(self.playlist_ids, playlist_id)
+        if row is None:
+            return []
+        members = self.incidence.indices[self.incidence.indptr[row]:self.incidence.indptr[row + 1]]
+        # An evenly spaced sample of long playlists
+        seeds = members[::max(1, math.ceil(len(members) / PLAYLIST_SEED_TRACKS))]
+        candidates = self.neighbors[seeds, :PLAYLIST_NEIGHBORS].ravel()
+        scores = self.scores[seeds, :PLAYLIST_NEIGHBORS].ravel()
+        found = candidates >= 0
+        if not found.any():
+            return []
+
+        unique, inverse = np.unique(candidates[found], return_inverse=True)
+        totals = np.bincount(inverse, weights=scores[found])
+        # Tracks already in the playlist aren't recommended
+        totals[np.isin(unique, members, assume_unique=True)] = 0
+        # A few extra in case some of the best ones were deleted since the build
+        top = np.argpartition(-totals, min(limit * 2, len(totals)) - 1)[:limit * 2]
+        top = top[totals[top] > 0]
+        top = top[np.lexsort((unique[top], -totals[top]))]
+        return list(zip(self.track_ids[unique[top]].tolist(), totals[top].tolist()))
+
+
+_snapshot = None
+_build_lock = asyncio.Lock()
+
+
+async def _load_pairs():
+    """playlist_tracks as two numpy arrays, read in batches"""
+    import numpy as np
+
+    playlist_chunks, track_chunks = [], []
+    async with async_session_local() as db:
+        result = await db.stream(select(PT.playlist_id, PT.track_id).execution_options(yield_per=LOAD_BATCH_SIZE))
+        async for partition in result.partitions():
+            pairs = np.array(partition, dtype=np.int64).reshape(-1, 2)
+            playlist_chunks.append(pairs[:, 0])
+            track_chunks.append(pairs[:, 1])
+    if not playlist_chunks:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return np.concatenate(playlist_chunks), np.concatenate(track_chunks)
+
+
+def _compute(version, playlist_column, track_column, similarity, top_k):
+    """Build a Snapshot from the (playlist_id, track_id) pairs, CPU bound"""
+    import numpy as np
+    from scipy import sparse
+
+    start = time.perf_counter()
+    playlist_ids, playlist_rows = np.unique(playlist_column, return_inverse=True)
+    track_ids, track_rows = np.unique(track_column, return_inverse=True)
+    incidence = sparse.csr_matrix((np.ones(len(track_rows), dtype=np.float32), (playlist_rows, track_rows)),
+                                  shape=(len(playlist_ids), len(track_ids)))
+    incidence.sum_duplicates()
+    incidence.sort_indices()
+    by_track = incidence.T.tocsr()
+    counts = np.asarray(by_track.sum(axis=1)).ravel()
+
+    # Track rows fit in 32 bits, which halves the largest array of the snapshot
+    neighbors = np.full((len(track_ids), top_k), -1, dtype=np.int32)
+    scores = np.zeros((len(track_ids), top_k), dtype=np.float32)
+    for start_row in range(0, len(track_ids), BLOCK_SIZE):
+        block = (by_track[start_row:start_row + BLOCK_SIZE] @ incidence).tocsr()
+        block.setdiag(0, k=start_row)
+        block.eliminate_zeros()
+        block.sort_indices()
+
+        # Score every pair of the block at once
+        rows = np.repeat(np.arange(block.shape[0], dtype=np.int32), np.diff(block.indptr))
+        columns = block.indices
+        values = block.data.astype(np.float64)
+        if similarity == 'lift':
+            supported = values >= MIN_SUPPORT
+            rows, columns, values = rows[supported], columns[supported], values[supported]
+            values = values * len(playlist_ids) / (counts[start_row + rows] * counts[columns])
+        else:
+            values = values / np.sqrt(counts[start_row + rows] * counts[columns])
+
+        # Best first within each row. Scores are kept as float32, and the bits of a positive
+        # float32 order like its value, so one integer key sorts by row, then by descending
+        # score. The pairs are in (row, column) order already and the sort is stable, so
+        # ties go to the lower track row
+        values = values.astype(np.float32)
+        key = (rows.astype(np.uint64) << np.uint64(32)) | (np.uint32(0xFFFFFFFF) - values.view(np.uint32)).astype(np.uint64)
+        order = np.argsort(key, kind='stable')
+        rows, columns, values = rows[order], columns[order], values[order]
+        # Then keep the first top_k of each row
+        rank = np.arange(len(rows)) - np.searchsorted(rows, rows)
+        kept = rank < top_k
+        neighbors[start_row + rows[kept], rank[kept]] = columns[kept]
+        scores[start_row + rows[kept], rank[kept]] = values[kept]
+
+    return Snapshot(version, track_ids, playlist_ids, incidence, neighbors, scores, time.perf_counter() - start)
+
+
+async def rebuild():
+    """Build a new snapshot and swap it in"""
+    global _snapshot
+    async with _build_lock:
+        version = versions.get('playlist_tracks')
+        playlist_column, track_column = await _load_pairs()
+        # The matrix work runs in a thread so requests keep being served meanwhile
+        new_snapshot = await asyncio.to_thread(_compute, version, playlist_column, track_column, SIMILARITY, TOP_K)
+        _snapshot = new_snapshot
+        logger.info("Rebuilt recommendations for %d tracks in %.1f s", len(new_snapshot.track_ids),
+                    new_snapshot.build_seconds)
+    return new_snapshot
+
+
+async def keep_fresh():
+    """Build at startup, then rebuild whenever playlist_tracks changed, run as a background task"""
+    while True:
+        if _snapshot is None or _snapshot.version != versions.get('playlist_tracks'):
+            try:
+                await rebuild()
+            except Exception:
+                logger.exception("Rebuilding recommendations failed")
+        await asyncio.sleep(REBUILD_SECONDS)
+
+
+def _current():
+    if _snapshot is None:
+        raise HTTPException(status_code=503, detail="Recommendations are still being built")
+    if not lookup.indexes['tracks'].loaded:
+        raise HTTPException(status_code=503, detail="Track names are still being loaded")
+    return _snapshot
+
+
+def _response(current, results, limit):
+    items = []
+    for track_id, score in results:
+        track_name = lookup.indexes['tracks'].name(track_id)
+        # Skip tracks deleted since the snapshot was built
+        if track_name is None:
+            continue
+        items.append({'track_id': track_id, 'track_name': track_name, 'score': round(score, 6)})
+        if len(items) == limit:
+            break
+    return {'items': items, 'snapshot_age_seconds': round(time.time() - current.built_at, 1)}
+
+
+router = APIRouter(prefix="/recommend", default_response_class=ORJSONResponse)
+
+
+@router.get("/track/{track_id}")
+async def recommend_for_track(track_id: int, limit: int = Query(10, ge=1, le=MAX_LIMIT)):
+    current = _current()
+    return ORJSONResponse(_response(current, current.for_track(track_id, limit * 2), limit))
+
+
+@router.get("/playlist/{playlist_id}")
+async def recommend_for_playlist(playlist_id: int, limit: int = Query(10, ge=1, le=MAX_LIMIT)):
+    current = _current()
+    return ORJSONResponse(_response(current, current.for_playlist(playlist_id, limit), limit))
+
+
+@router.post("/rebuild")
+async def rebuild_recommendations():
+    built = await rebuild()
+    return {'tracks': len(built.track_ids), 'playlists': len(built.playlist_ids),
+            'build_seconds': round(built.build_seconds, 3)}
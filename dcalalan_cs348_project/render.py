@@ -0,0 +1,24 @@
+"""Helpers for turning rows into the HTML tables shown on the pages
+
+Produces the same markup that `DataFrame.to_html(index=False)` used to write into
+the files under html_files/, without having to build a DataFrame first.
+"""
+
+from html import escape
+
+
+def render_table(columns, rows):
+    """Render `rows` (an iterable of tuples ordered like `columns`) as an HTML table."""
+    parts = ['<table border="1" class="dataframe">\n  <thead>\n    <tr style="text-align: right;">\n']
+    for column in columns:
+        parts.append(f"      <th>{escape(str(column))}</th>\n")
+    parts.append("    </tr>\n  </thead>\n  <tbody>\n")
+
+    for row in rows:
+        parts.append("    <tr>\n")
+        for value in row:
+            parts.append(f"      <td>{escape(str(value))}</td>\n")
+        parts.append("    </tr>\n")
+
+    parts.append("  </tbody>\n</table>")
+    return "".join(parts)
@@ -0,0 +1,60 @@
+"""In-memory cache for rendered HTML fragments
+
+Replaces the shared html_files/basic.html that every writer used to overwrite.
+Entries are keyed by the version of the data they were rendered from, so a
+version bump makes every older entry unreachable and they are dropped.
+"""
+
+from collections import OrderedDict
+
+
+class RenderCache:
+    """Least-recently-used cache of rendered fragments.
+
+    Keys are tuples whose first element is the data version, e.g.
+    (tracks version, sort attribute, order, page).
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._version = None
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def invalidate(self):
+        self._entries.clear()
+
+    def _check_version(self, version):
+        if version != self._version:
+            # Everything cached so far was rendered from older data
+            self._entries.clear()
+            self._version = version
+
+    def get(self, key):
+        """Return the fragment cached under `key`, or None on a miss."""
+        self._check_version(key[0])
+        try:
+            content = self._entries[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return content
+
+    def put(self, key, content):
+        if self._version is not None and key[0] < self._version:
+            # The data changed while this fragment was being rendered
+            return
+        self._check_version(key[0])
+        self._entries[key] = content
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+
+track_table_cache = RenderCache()
@@ -0,0 +1,127 @@
+"""Database schema creation and upgrades
+
+The schema used to be created on every import of main.py, which connected to the
+database and checked every table before a worker could serve anything. Now the
+database records how many of MIGRATIONS it has had applied in the schema_version
+table, and startup only reads that one row.
+
+Configured through the DB_SCHEMA environment variable:
+
+check     (default) refuse to start when the database is behind this code
+upgrade   apply the missing migrations at startup, handy with a new local database
+skip      don't look at the database at all
+
+To upgrade or check from the command line run `python schema.py upgrade|check`.
+Run the upgrade once before starting several workers, rather than letting each
+of them race to do it.
+"""
+
+import argparse
+import logging
+import os
+
+from sqlalchemy import Column, Integer, MetaData, Table, select, delete, insert
+from sqlalchemy.exc import DBAPIError
+
+import models
+import popularity
+from database import Base, engine, async_engine
+
+MODE = os.environ.get('DB_SCHEMA', 'check')
+
+logger = logging.getLogger(__name__)
+
+
+def _create_tables(conn):
+    """Every table in models.py, tables that already exist are left alone"""
+    Base.metadata.create_all(conn)
+
+
+def _create_indexes(conn):
+    """Indexes declared in models.py that tables created before them don't have"""
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+
+def _backfill_popularity(conn):
+    """Popularity counters for the playlists that existed before them"""
+    popularity.backfill(conn)
+
+
+# Applied in order, a database at version n has had the first n applied
+MIGRATIONS = [_create_tables, _create_indexes, _backfill_popularity]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+_metadata = MetaData()
+schema_version = Table('schema_version', _metadata, Column('version', Integer, nullable=False))
+
+
+def _read_version(conn):
+    try:
+        return conn.execute(select(schema_version.c.version)).scalar() or 0
+    except DBAPIError:
+        # No schema_version table, nothing was applied through this module yet
+        return 0
+
+
+def _upgrade(conn):
+    version = _read_version(conn)
+    schema_version.create(conn, checkfirst=True)
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        logger.info("Applying schema migration %d: %s", number, migration.__doc__)
+        migration(conn)
+        conn.execute(delete(schema_version))
+        conn.execute(insert(schema_version).values(version=number))
+    return version
+
+
+def upgrade():
+    """Apply the missing migrations, returns the version the database was at"""
+    with engine.begin() as conn:
+        return _upgrade(conn)
+
+
+def _outdated(version):
+    return (f"The database schema is at version {version}, this code needs {SCHEMA_VERSION}: "
+            f"run `python schema.py upgrade` or start with DB_SCHEMA=upgrade")
+
+
+async def ensure(mode=MODE):
+    """Check (and with mode='upgrade', upgrade) the schema at startup"""
+    if mode == 'skip':
+        return
+    async with async_engine.connect() as conn:
+        version = await conn.run_sync(_read_version)
+    if version == SCHEMA_VERSION:
+        return
+    if version > SCHEMA_VERSION:
+        raise RuntimeError(f"The database schema is at version {version}, newer than this code ({SCHEMA_VERSION})")
+    if mode != 'upgrade':
+        raise RuntimeError(_outdated(version))
+
+    try:
+        async with async_engine.begin() as conn:
+            await conn.run_sync(_upgrade)
+    except DBAPIError:
+        # Another worker upgrading at the same time is fine as long as one of them finished
+        async with async_engine.connect() as conn:
+            version = await conn.run_sync(_read_version)
+        if version != SCHEMA_VERSION:
+            raise
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('command', choices=['upgrade', 'check'])
+    args = parser.parse_args()
+
+    if args.command == 'upgrade':
+        logging.basicConfig(level=logging.INFO, format='%(message)s')
+        before = upgrade()
+        print(f"Schema upgraded from version {before} to {SCHEMA_VERSION}")
+    else:
+        with engine.connect() as conn:
+            current = _read_version(conn)
+        print(f"Schema is up to date (version {current})" if current == SCHEMA_VERSION else _outdated(current))
+        raise SystemExit(current != SCHEMA_VERSION)
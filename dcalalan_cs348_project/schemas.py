@@ -0,0 +1,54 @@
+"""Pydantic schemas for the tables in models.py
+
+The *Base classes hold the fields a client supplies, the *Out classes add the
+generated ids and are what the JSON API returns.
+"""
+
+from typing import Optional
+
+from pydantic import BaseModel
+
+class ArtistsBase(BaseModel):
+        artist_name: str
+
+class ListenersBase(BaseModel):
+        username: str
+
+class TracksBase(BaseModel):
+        track_name: str
+        album_id: int
+        genre: str
+
+class AlbumsBase(BaseModel):
+        album_name: str
+        artist_id: int
+
+#class GenresBase(BaseModel):
+        # Empty???
+
+class PlaylistsBase(BaseModel):
+        playlist_name: str
+        user_id: int
+
+#class PlaylistTracksBase(BaseModel):
+        # Also Empty???
+
+class TrackIdsBatch(BaseModel):
+        track_ids: list[int]
+
+class ArtistsOut(ArtistsBase):
+        artist_id: int
+
+class TracksOut(TracksBase):
+        track_id: int
+        album_id: Optional[int] = None
+        artist_id: Optional[int] = None
+        genre: Optional[str] = None
+
+class AlbumsOut(AlbumsBase):
+        album_id: int
+        artist_id: Optional[int] = None
+
+class PlaylistsOut(PlaylistsBase):
+        playlist_id: int
+        user_id: Optional[int] = None
@@ -0,0 +1,328 @@
+"""Full-text track search
+
+Every track is indexed by the words of its name, its album's name, its artist's
+name and its genre. Free text is ranked with BM25 over an in-memory inverted
+index, and `field:value` terms (track, album, artist, genre, with quotes for
+several words, e.g. `genre:Pop artist:"Taylor Swift"`) filter the results.
+
+The index is loaded in the background at startup (searches answer 503 until
+then) and kept current by the write endpoints through
+add_track/remove_track (and by coherence.py after other workers' writes).
+
+The postings of each term are grouped by (frequency, document length), the two
+things its share of a track's BM25 score depends on. A query visits the groups
+of its terms best first and stops once the tracks it hasn't seen can't reach its
+results any more, so common words (a genre, "track") no longer cost a pass over
+every track containing them.
+
+GET /search?q=...&limit=20
+"""
+
+import asyncio
+import functools
+import gc
+import heapq
+import math
+import re
+from collections import defaultdict
+
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import ORJSONResponse
+from sqlalchemy import select
+
+import coherence
+import models
+
+TOKEN = re.compile(r"\w+")
+QUERY_TERM = re.compile(r'(\w+):"([^"]*)"|(\w+):(\S+)|"([^"]*)"|(\S+)')
+
+# How much a word counts towards a track's score depending on where it appears
+FIELD_WEIGHTS = {'track': 2.0, 'album': 1.0, 'artist': 1.0, 'genre': 0.5}
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+MAX_LIMIT = 100
+
+# Groups up to this size are split by looking up the other terms in each track's
+# frequencies, bigger ones with a set of all the tracks of those terms
+SMALL_GROUP = 256
+
+TRACK_COLUMNS = (models.Tracks.track_id, models.Tracks.track_name, models.Tracks.album_id,
+                 models.Tracks.artist_id, models.Tracks.genre)
+
+
+def tokenize(text):
+    return TOKEN.findall(text.casefold()) if text else []
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def _shared_terms(text):
+    """Terms of an album or artist name or a genre, which many tracks share"""
+    return tuple(tokenize(text))
+
+
+def _norm(length, average_length):
+    return K1 * (1 - B + B * length / average_length)
+
+
+def _share(idf, frequency, norm):
+    """A term's part of the BM25 score of a document"""
+    return idf * frequency * (K1 + 1) / (frequency + norm)
+
+
+class SearchIndex:
+    def __init__(self):
+        self.clear()
+        # False until built, the app starts serving before the index is loaded
+        self.loaded = False
+
+    def clear(self):
+        # term -> (weighted term frequency, document length) -> track_ids
+        self._postings = defaultdict(dict)
+        # field -> term -> track_ids, for the field:value filters
+        self._fields = {field: defaultdict(set) for field in FIELD_WEIGHTS}
+        # track_id -> (track_name, album_id, artist_id, genre, terms of each field in the order of
+        #              FIELD_WEIGHTS, {term: weighted term frequency}, document length)
+        self._docs = {}
+        self._total_length = 0.0
+        self.album_names = {}
+        self.artist_names = {}
+
+    def __len__(self):
+        return len(self._docs)
+
+    async def load(self, db):
+        """(Re)build the whole index from the database, searches use the old one meanwhile"""
+        album_names = dict((await db.execute(select(models.Albums.album_id, models.Albums.album_name))).all())
+        artist_names = dict((await db.execute(select(models.Artists.artist_id, models.Artists.artist_name))).all())
+        tracks = (await db.execute(select(*TRACK_COLUMNS))).all()
+        fresh = await asyncio.to_thread(SearchIndex.build, album_names, artist_names, tracks)
+        # Taken over in one step, search_index is imported by name elsewhere
+        self.__dict__.update(fresh.__dict__)
+
+    @classmethod
+    def build(cls, album_names, artist_names, tracks):
+        index = cls()
+        index.album_names = album_names
+        index.artist_names = artist_names
+        # The index holds millions of set entries and no reference cycles, collecting
+        # garbage while it grows would only walk them over and over
+        collecting = gc.isenabled()
+        gc.disable()
+        try:
+            for row in tracks:
+                index.add_track(*row)
+        finally:
+            if collecting:
+                gc.enable()
+        index.loaded = True
+        return index
+
+    async def apply(self, db, changes):
+        """Re-read the tracks, albums and artists in {table: row ids}"""
+        for table, names, id_column, name_column in (
+                ('albums', self.album_names, models.Albums.album_id, models.Albums.album_name),
+                ('artists', self.artist_names, models.Artists.artist_id, models.Artists.artist_name)):
+            if table not in changes:
+                continue
+            found = dict(await coherence.rows_by_id(db, select(id_column, name_column), id_column, changes[table]))
+            for row_id in changes[table]:
+                if row_id in found:
+                    names[row_id] = found[row_id]
+                else:
+                    names.pop(row_id, None)
+
+        track_ids = changes.get('tracks', ())
+        rows = await coherence.rows_by_id(db, select(*TRACK_COLUMNS), models.Tracks.track_id, track_ids)
+        found = set()
+        for row in rows:
+            found.add(row[0])
+            self.add_track(*row)
+        for track_id in track_ids:
+            if track_id not in found:
+                self.remove_track(track_id)
+
+    def add_track(self, track_id, track_name, album_id, artist_id, genre):
+        """Index a track, replacing what was indexed for it before"""
+        if track_id in self._docs:
+            self.remove_track(track_id)
+
+        field_terms = (tuple(tokenize(track_name)), _shared_terms(self.album_names.get(album_id)),
+                       _shared_terms(self.artist_names.get(artist_id)), _shared_terms(genre))
+        frequencies = {}
+        for (field, weight), terms in zip(FIELD_WEIGHTS.items(), field_terms):
+            postings = self._fields[field]
+            for term in terms:
+                frequencies[term] = frequencies.get(term, 0) + weight
+                postings[term].add(track_id)
+
+        length = sum(frequencies.values())
+        for term, frequency in frequencies.items():
+            groups = self._postings[term]
+            group = groups.get((frequency, length))
+            if group is None:
+                group = groups[frequency, length] = set()
+            group.add(track_id)
+
+        self._docs[track_id] = (track_name, album_id, artist_id, genre, field_terms, frequencies, length)
+        self._total_length += length
+
+    def remove_track(self, track_id):
+        doc = self._docs.pop(track_id, None)
+        if doc is None:
+            return
+        field_terms, frequencies, length = doc[4:]
+        for field, terms in zip(FIELD_WEIGHTS, field_terms):
+            for term in terms:
+                postings = self._fields[field].get(term)
+                if postings is not None:
+                    postings.discard(track_id)
+                    if not postings:
+                        del self._fields[field][term]
+        for term, frequency in frequencies.items():
+            groups = self._postings[term]
+            groups[frequency, length].discard(track_id)
+            if not groups[frequency, length]:
+                del groups[frequency, length]
+                if not groups:
+                    del self._postings[term]
+        self._total_length -= length
+
+    def _filter_sets(self, field, value):
+        """One set of track_ids per word of `value` that has to appear in `field`"""
+        return [self._fields[field].get(term, set()) for term in tokenize(value)]
+
+    def search(self, query, limit=20):
+        """Return up to `limit` (track_id, score) pairs, best first"""
+        terms = []
+        filters = []
+        for field, quoted, field2, value, phrase, word in QUERY_TERM.findall(query):
+            field = (field or field2).lower()
+            if field in FIELD_WEIGHTS:
+                filters.extend(self._filter_sets(field, quoted if field2 == '' else value))
+            else:
+                # Unknown `name:value` prefixes are searched as plain text
+                terms.extend(tokenize(' '.join([field, quoted, value, phrase, word])))
+
+        candidates = None
+        if filters:
+            # Intersect starting from the smallest set, without copying the index's own sets
+            filters.sort(key=len)
+            candidates = filters[0]
+            for other in filters[1:]:
+                candidates = {track_id for track_id in candidates if track_id in other}
+
+        if not terms:
+            if candidates is None:
+                return []
+            return [(track_id, 0.0) for track_id in heapq.nsmallest(limit, candidates)]
+
+        count = len(self._docs)
+        average_length = self._total_length / count if count else 0.0
+        # (term, idf) of each term, and its groups as (score share, track_ids), best first
+        query_terms = []
+        groups = []
+        for term in set(terms):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            matching = sum(map(len, postings.values()))
+            idf = math.log(1 + (count - matching + 0.5) / (matching + 0.5))
+            query_terms.append((term, idf))
+            groups.append(sorted(((_share(idf, frequency, _norm(length, average_length)), track_ids)
+                                  for (frequency, length), track_ids in postings.items()),
+                                 key=lambda group: group[0], reverse=True))
+
+        def score(track_id):
+            frequencies, length = self._docs[track_id][5:]
+            norm = _norm(length, average_length)
+            total = 0.0
+            for term, idf in query_terms:
+                frequency = frequencies.get(term)
+                if frequency is not None:
+                    total += _share(idf, frequency, norm)
+            return total
+
+        # Tracks containing any query term but the one at a position, built when first needed
+        elsewhere = {}
+
+        def split(position, track_ids):
+            """`track_ids` of the term at `position` without and with other query terms"""
+            others = [term for other, (term, _) in enumerate(query_terms) if other != position]
+            if position not in elsewhere and len(track_ids) <= SMALL_GROUP:
+                shared = {track_id for track_id in track_ids
+                          if any(term in self._docs[track_id][5] for term in others)}
+            else:
+                if position not in elsewhere:
+                    elsewhere[position] = set().union(*(group for term in others
+                                                        for group in self._postings[term].values()))
+                shared = track_ids & elsewhere[position]
+            return track_ids - shared, shared
+
+        # Best share of each term among its groups not visited yet, a track not seen
+        # so far scores at most their sum (added up in the same order as its score)
+        remaining = [term_groups[0][0] for term_groups in groups]
+        upcoming = [(-term_groups[0][0], position, 0) for position, term_groups in enumerate(groups)]
+        heapq.heapify(upcoming)
+        # The best (score, -track_id) so far, worst first
+        top = []
+        seen = set()
+        while upcoming:
+            if len(top) == limit and top[0][0] > sum(remaining):
+                break
+            _, position, index = heapq.heappop(upcoming)
+            share, track_ids = groups[position][index]
+            if index + 1 < len(groups[position]):
+                remaining[position] = groups[position][index + 1][0]
+                heapq.heappush(upcoming, (-remaining[position], position, index + 1))
+            else:
+                remaining[position] = 0.0
+
+            if len(top) == limit and sum(share if other == position else best
+                                         for other, best in enumerate(remaining)) < top[0][0]:
+                # None of the tracks not seen yet can make it, those that also have other
+                # terms are scored with the groups of those
+                continue
+            if candidates is not None:
+                track_ids = track_ids & candidates
+            alone, shared = split(position, track_ids)
+            # Tracks with only this term all score `share`, only the lowest ids can make it
+            if len(top) < limit or share >= top[0][0]:
+                for track_id in heapq.nsmallest(limit, alone):
+                    _keep(top, limit, (share, -track_id))
+            shared -= seen
+            seen |= shared
+            for track_id in shared:
+                _keep(top, limit, (score(track_id), -track_id))
+
+        return [(-negative_id, track_score) for track_score, negative_id in sorted(top, reverse=True)]
+
+    def describe(self, track_id):
+        track_name, album_id, artist_id, genre = self._docs[track_id][:4]
+        return {'track_id': track_id, 'track_name': track_name,
+                'album_id': album_id, 'album_name': self.album_names.get(album_id),
+                'artist_id': artist_id, 'artist_name': self.artist_names.get(artist_id),
+                'genre': genre}
+
+
+def _keep(top, limit, item):
+    """Add `item` to the heap of the `limit` best items"""
+    if len(top) < limit:
+        heapq.heappush(top, item)
+    elif item > top[0]:
+        heapq.heapreplace(top, item)
+
+
+search_index = SearchIndex()
+
+router = APIRouter()
+
+
+@router.get("/search", response_class=ORJSONResponse)
+async def search(q: str, limit: int = Query(20, ge=1, le=MAX_LIMIT)):
+    if not search_index.loaded:
+        raise HTTPException(status_code=503, detail="The search index is still being loaded")
+    return ORJSONResponse([dict(search_index.describe(track_id), score=round(score, 4))
+                           for track_id, score in search_index.search(q, limit)])
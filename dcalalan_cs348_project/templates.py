@@ -0,0 +1,62 @@
+"""Page templates compiled once at startup
+
+A template is an HTML page with `{name}` placeholders. Compiling splits it into
+its static chunks and placeholder names, so rendering a page is a single join of
+the chunks with the fragments passed in.
+"""
+
+import re
+from functools import lru_cache
+
+# CSS blocks (`.data-content {` followed by a newline) don't match, only `{word}` does
+PLACEHOLDER = re.compile(r'\{(\w+)\}')
+
+
+@lru_cache(maxsize=None)
+def read_page(name):
+    """Read a page from html_files/ once and keep it in memory"""
+    with open(f"./html_files/{name}", "r") as page_file:
+        return page_file.read()
+
+
+class PageTemplate:
+    def __init__(self, text):
+        # Even positions are static text, odd positions placeholder names
+        self._parts = PLACEHOLDER.split(text)
+        self.names = self._parts[1::2]
+
+    def render(self, **fragments):
+        parts = list(self._parts)
+        parts[1::2] = [fragments[name] for name in self.names]
+        return "".join(parts)
+
+
+pages = {}
+
+
+def compile_pages():
+    """Compile every page template, called once when the app starts"""
+    main = read_page("main.html")
+    # The forms and the track table go at the end of main.html's body
+    pages['main_table'] = PageTemplate(main.replace("</body>", read_page("main_table_forms.html") + "</body>"))
+
+    page = read_page("playlist_access.html")
+    pages['playlist_access'] = PageTemplate(page.replace("</body>", """
+    <div class="data-content">
+        <h3>{playlist_name}</h3>
+        {playlist_content}
+    </div>
+</body>"""))
+
+    page = read_page("playlist_main.html")
+    pages['playlist_report'] = PageTemplate(page.replace("</body>", """
+    <div class="data-content">
+        <form method="POST" action="/playlist_access">
+            <select name="chosen_playlist_id">
+            {playlist_options}
+            </select>
+            <input type="submit" value="Access Playlist...">
+        </form>
+        {playlist_table}
+    </div>
+</body>"""))
@@ -0,0 +1,245 @@
+"""Per-table version counters, shared by every worker process
+
+Write paths bump the counter of every table they change. Anything derived from a
+table (cached fragments, the search index, ...) remembers the version it was
+built from and rebuilds once the counter has moved on.
+
+The counters live in a small memory-mapped file (VERSIONS_FILE, by default one
+per database in the temp directory), so a write handled by one uvicorn worker
+invalidates what every other worker derived from the table. Reading a counter is
+a read from shared memory; bumping one takes a file lock. Each slot holds a table
+name, its version and when it was last bumped, found by hashing the name.
+
+Counters of members of a table (`playlist_tracks:{playlist_id}`, any name with a
+colon) don't get a slot of their own, there can be any number of them. They are
+hashed into a fixed array of BUCKETS counters instead: members sharing a bucket
+invalidate each other, which only costs an unneeded rebuild.
+
+The file is reset (new epoch, every counter at 0) when a process opens it while
+no other process has it open, i.e. when the whole app restarts.
+
+After the counters comes a change log, a ring of the last LOG_SIZE (table, row id)
+pairs written by any process, so state kept in memory can apply another process's
+writes row by row instead of reloading the table (see coherence.py). Whoever falls
+further behind than the ring reaches gets None from changes_since and reloads.
+"""
+
+import functools
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # No file locks (Windows): the counters stay private to this process
+    fcntl = None
+
+from database import URL_DATABASE
+
+VERSIONS_FILE = os.environ.get(
+    'VERSIONS_FILE',
+    os.path.join(tempfile.gettempdir(), f"cs348-versions-{hashlib.sha1(URL_DATABASE.encode()).hexdigest()[:12]}"))
+
+# Table names only, members of a table go to the buckets
+SLOTS = 1 << 12
+NAME_SIZE = 40
+BUCKETS = 1 << 18
+_MAGIC = b'CS348VER'
+# magic, epoch
+_HEADER = struct.Struct('<8sd')
+# name, version, last bumped
+_SLOT = struct.Struct(f'<{NAME_SIZE}sQd')
+_COUNTER = struct.Struct('<Qd')
+_BUCKETS_OFFSET = _HEADER.size + SLOTS * _SLOT.size
+
+# Change log entries, and most entries one log_changes call writes
+LOG_SIZE = 1 << 16
+MAX_LOGGED_ROWS = 1 << 10
+# Row id of an entry saying the whole table changed
+ALL_ROWS = -1
+# head (sequence number of the latest entry)
+_LOG_HEAD = struct.Struct('<Q')
+# sequence number, table key, row id, pid of the writer
+_CHANGE = struct.Struct('<QQqI')
+_LOG_OFFSET = _BUCKETS_OFFSET + BUCKETS * _COUNTER.size
+_SIZE = _LOG_OFFSET + _LOG_HEAD.size + LOG_SIZE * _CHANGE.size
+
+
+def _is_member(table):
+    return ':' in table
+
+
+@functools.lru_cache(maxsize=4096)
+def _home(table):
+    """(stored name, first slot to probe) of `table`, or (None, counter offset) of a member"""
+    name = table.encode()
+    digest = hashlib.sha1(name).digest()
+    if _is_member(table):
+        return None, _BUCKETS_OFFSET + int.from_bytes(digest[:8], 'little') % BUCKETS * _COUNTER.size
+    # Longer names are stored by digest
+    key = name if len(name) <= NAME_SIZE else digest
+    return key.rstrip(b'\0'), int.from_bytes(digest[:8], 'little') % SLOTS
+
+
+def _open():
+    """Map VERSIONS_FILE, resetting it if no other process has it open"""
+    if fcntl is None or not VERSIONS_FILE:
+        return None, mmap.mmap(-1, _SIZE), time.time()
+
+    fd = os.open(VERSIONS_FILE, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        alone = True
+    except BlockingIOError:
+        # Wait for a process resetting it to finish
+        fcntl.flock(fd, fcntl.LOCK_SH)
+        alone = False
+    if alone or os.fstat(fd).st_size != _SIZE:
+        os.ftruncate(fd, 0)
+        os.ftruncate(fd, _SIZE)
+        os.pwrite(fd, _HEADER.pack(_MAGIC, time.time()), 0)
+    # Held until the process exits, it tells later processes they aren't alone
+    fcntl.flock(fd, fcntl.LOCK_SH)
+    shared = mmap.mmap(fd, _SIZE)
+    _, epoch = _HEADER.unpack_from(shared, 0)
+    return fd, shared, epoch
+
+
+_fd, _shared, _epoch = _open()
+_lock = threading.Lock()
+# table -> offset of its slot, slots never move once claimed
+_offsets = {}
+
+
+def _find(table, claim=False):
+    """Offset of the counter of `table`, claiming a free slot if `claim` (file lock held)"""
+    offset = _offsets.get(table)
+    if offset is not None:
+        return offset
+    key, start = _home(table)
+    if key is None:
+        return start
+    for probe in range(SLOTS):
+        slot_offset = _HEADER.size + (start + probe) % SLOTS * _SLOT.size
+        name = _shared[slot_offset:slot_offset + NAME_SIZE].rstrip(b'\0')
+        if name == key:
+            _offsets[table] = slot_offset + NAME_SIZE
+            return slot_offset + NAME_SIZE
+        if not name:
+            if not claim:
+                return None
+            _shared[slot_offset:slot_offset + NAME_SIZE] = key.ljust(NAME_SIZE, b'\0')
+            _offsets[table] = slot_offset + NAME_SIZE
+            return slot_offset + NAME_SIZE
+    raise RuntimeError(f"{VERSIONS_FILE} has no free slot for {table!r}")
+
+
+def _read(table):
+    offset = _find(table)
+    if offset is None:
+        return 0, None
+    return _COUNTER.unpack_from(_shared, offset)
+
+
+def bump(*tables):
+    if not tables:
+        return
+    now = time.time()
+    with _lock:
+        if _fd is not None:
+            fcntl.lockf(_fd, fcntl.LOCK_EX, 1, 0)
+        try:
+            for table in tables:
+                offset = _find(table, claim=True)
+                version, _ = _COUNTER.unpack_from(_shared, offset)
+                _COUNTER.pack_into(_shared, offset, version + 1, now)
+        finally:
+            if _fd is not None:
+                fcntl.lockf(_fd, fcntl.LOCK_UN, 1, 0)
+
+
+def get(table):
+    return _read(table)[0]
+
+
+def snapshot(*tables):
+    """Versions of `tables` as a tuple, for use in cache keys"""
+    return tuple(_read(table)[0] for table in tables)
+
+
+def epoch():
+    """When the counters were last reset, they only mean something together with it"""
+    return _epoch
+
+
+def last_modified(*tables):
+    """Time of the latest write to any of `tables`"""
+    return max([_read(table)[1] or _epoch for table in tables], default=_epoch)
+
+
+@functools.lru_cache(maxsize=256)
+def _table_key(table):
+    return int.from_bytes(hashlib.sha1(table.encode()).digest()[:8], 'little')
+
+
+def log_changes(table, row_ids=None):
+    """Record that `row_ids` of `table` changed, or the whole table when None"""
+    row_ids = [ALL_ROWS] if row_ids is None or len(row_ids) > MAX_LOGGED_ROWS else list(dict.fromkeys(row_ids))
+    if not row_ids:
+        return
+    key = _table_key(table)
+    pid = os.getpid()
+    with _lock:
+        if _fd is not None:
+            fcntl.lockf(_fd, fcntl.LOCK_EX, 1, 0)
+        try:
+            head, = _LOG_HEAD.unpack_from(_shared, _LOG_OFFSET)
+            for seq, row_id in enumerate(row_ids, head + 1):
+                _CHANGE.pack_into(_shared, _LOG_OFFSET + _LOG_HEAD.size + (seq - 1) % LOG_SIZE * _CHANGE.size,
+                                  seq, key, row_id, pid)
+            # Entries first, readers never look past the head
+            _LOG_HEAD.pack_into(_shared, _LOG_OFFSET, head + len(row_ids))
+        finally:
+            if _fd is not None:
+                fcntl.lockf(_fd, fcntl.LOCK_UN, 1, 0)
+
+
+def log_head():
+    """Sequence number of the latest change, to pass to changes_since later"""
+    return _LOG_HEAD.unpack_from(_shared, _LOG_OFFSET)[0]
+
+
+def changes_since(seq, tables, include_own=False):
+    """(head, {table: changed row ids, or None for all of them}) of `tables` after `seq`
+
+    The changes are None instead when the log no longer reaches back to `seq`.
+    Changes made by this process are left out unless `include_own`.
+    """
+    head = log_head()
+    if head - seq > LOG_SIZE - MAX_LOGGED_ROWS:
+        return head, None
+    keys = {_table_key(table): table for table in tables}
+    pid = os.getpid()
+    changes = {}
+    for position in range(seq + 1, head + 1):
+        entry_seq, key, row_id, writer = _CHANGE.unpack_from(
+            _shared, _LOG_OFFSET + _LOG_HEAD.size + (position - 1) % LOG_SIZE * _CHANGE.size)
+        if entry_seq != position:
+            return head, None
+        table = keys.get(key)
+        if table is None or (writer == pid and not include_own):
+            continue
+        if row_id == ALL_ROWS:
+            changes[table] = None
+        elif changes.get(table, ()) is not None:
+            changes.setdefault(table, set()).add(row_id)
+    # A writer may have been overwriting the oldest entries while they were read, it
+    # writes at most MAX_LOGGED_ROWS past the head it publishes
+    if log_head() - seq > LOG_SIZE - MAX_LOGGED_ROWS:
+        return head, None
+    return head, changes
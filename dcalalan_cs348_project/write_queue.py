@@ -0,0 +1,159 @@
+"""Group commit for the form write endpoints
+
+Each write endpoint used to open a transaction of its own, so under heavy
+listener activity every click paid for a commit (an fsync on the database
+server) and its round trips. With batching on, a request hands its mutation to
+the queue and awaits the result; a background writer runs the mutations queued
+within a few milliseconds of each other in one session and commits them together.
+
+    async def apply(db):
+        db.add(new_playlist)
+        await db.flush()
+        return new_playlist.playlist_id, ['playlists']
+
+    playlist_id = await write_queue.submit(apply)
+
+A mutation returns its result and the versions (see versions.py) its write
+changes. The writer bumps them once the batch is committed, and only then
+returns the results, so whatever the callers do afterwards (in-memory copies)
+happens after the write is durable, as before. When a mutation raises, or the
+commit fails, the batch is rolled back and its mutations are run again one
+transaction each: the request that failed gets its own exception and the others
+still succeed. Mutations may therefore run twice and must only touch the
+database, never the versions or anything in memory.
+
+Configured through environment variables:
+
+WRITE_BATCH_MS      how long the writer waits for more writes after the first
+                    one of a batch; 0 (default) turns batching off and every
+                    write commits on its own
+WRITE_BATCH_SIZE    most writes in one batch, a full batch is committed at once
+
+Waiting longer makes batches bigger (fewer commits under load) at the cost of
+that much extra latency per write when the app is quiet.
+"""
+
+import asyncio
+import logging
+import os
+
+import versions
+from database import async_session_local
+
+MAX_WAIT = float(os.environ.get('WRITE_BATCH_MS', 0)) / 1000
+MAX_ITEMS = int(os.environ.get('WRITE_BATCH_SIZE', 100))
+
+logger = logging.getLogger(__name__)
+
+
+async def _apply_alone(apply):
+    async with async_session_local() as db:
+        result, bumps = await apply(db)
+        await db.commit()
+    versions.bump(*bumps)
+    return result
+
+
+class WriteQueue:
+    def __init__(self, max_wait=MAX_WAIT, max_items=MAX_ITEMS):
+        self.max_wait = max_wait
+        self.max_items = max_items
+        self._queue = None
+        self._task = None
+        # Exposed at /metrics
+        self.batches = 0
+        self.writes = 0
+        self.retried_batches = 0
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        """Start the writer, does nothing when batching is off"""
+        if self.max_wait <= 0 or self.running:
+            return
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Commit what is still queued and stop the writer"""
+        if not self.running:
+            return
+        await self._queue.join()
+        self._task.cancel()
+        self._task = None
+
+    async def submit(self, apply):
+        """Run `await apply(db)`, which returns (result, versions to bump), and return
+        the result once it is committed and the versions are bumped"""
+        if not self.running:
+            return await _apply_alone(apply)
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((apply, future))
+        return await future
+
+    async def _collect(self):
+        batch = [await self._queue.get()]
+        deadline = asyncio.get_running_loop().time() + self.max_wait
+        while len(batch) < self.max_items:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            try:
+                await self._flush(batch)
+            except Exception:
+                logger.exception("Write batch of %d failed", len(batch))
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _flush(self, batch):
+        self.batches += 1
+        self.writes += len(batch)
+        try:
+            async with async_session_local() as db:
+                applied = [await apply(db) for apply, _ in batch]
+                await db.commit()
+        except Exception as e:
+            if len(batch) == 1:
+                _settle(batch[0][1], exception=e)
+                return
+            # Find out whose write failed, by giving each its own transaction
+            self.retried_batches += 1
+            for apply, future in batch:
+                try:
+                    _settle(future, result=await _apply_alone(apply))
+                except Exception as e:
+                    _settle(future, exception=e)
+            return
+
+        # One bump for the whole batch
+        versions.bump(*dict.fromkeys(table for _, bumps in applied for table in bumps))
+        for (_, future), (result, _) in zip(batch, applied):
+            _settle(future, result=result)
+
+
+def _settle(future, result=None, exception=None):
+    # The request may have been cancelled while its write was queued, the write still happens
+    if future.done():
+        return
+    if exception is not None:
+        future.set_exception(exception)
+    else:
+        future.set_result(result)
+
+
+write_queue = WriteQueue()
@@ -0,0 +1,81 @@
+import asyncio
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+from benchmarks.driver import APP_DIR
+
+
+def _forget_app_modules():
+    # The app's modules read their configuration (DATABASE_URL, VERSIONS_FILE) when
+    # imported, drop them so the next import picks up this test's database
+    for name, module in list(sys.modules.items()):
+        if getattr(module, '__file__', None) and module.__file__.startswith(str(APP_DIR)):
+            del sys.modules[name]
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    """The app's modules on a seeded SQLite database of its own
+
+    Two artists with two albums, five tracks and three playlists:
+
+        artist 1  album 1  tracks 1, 2, 3     playlist 1  tracks 1, 2
+        artist 2  album 2  tracks 4, 5        playlist 2  tracks 1, 4
+                                              playlist 3  (empty)
+
+    `app.run(function)` runs `await function(db)` in a session of its own and
+    returns the result, `app.rows(sql)` and `app.execute(sql)` read and write the
+    database outside the app.
+    """
+    monkeypatch.setenv('DATABASE_URL', f"sqlite:///{tmp_path / 'catalog.db'}")
+    monkeypatch.setenv('VERSIONS_FILE', str(tmp_path / 'versions'))
+    monkeypatch.setenv('ANALYTICS_DIR', str(tmp_path / 'analytics'))
+    monkeypatch.setenv('ANALYTICS_REFRESH_SECONDS', '0')
+    monkeypatch.setenv('WRITE_BATCH_MS', '0')
+    monkeypatch.setattr(sys, 'path', [str(APP_DIR)] + sys.path)
+    _forget_app_modules()
+
+    import schema
+    from database import engine, async_engine, async_session_local
+
+    schema.upgrade()
+    with engine.begin() as conn:
+        conn.exec_driver_sql("INSERT INTO genres (genre) VALUES ('Pop'), ('Rock')")
+        conn.exec_driver_sql("INSERT INTO artists (artist_id, artist_name) VALUES (1, 'First'), (2, 'Second')")
+        conn.exec_driver_sql("INSERT INTO albums (album_id, album_name, artist_id) VALUES (1, 'One', 1), (2, 'Two', 2)")
+        conn.exec_driver_sql("INSERT INTO tracks (track_id, track_name, album_id, artist_id, genre) VALUES "
+                             "(1, 'a', 1, 1, 'Pop'), (2, 'b', 1, 1, 'Pop'), (3, 'c', 1, 1, 'Rock'), "
+                             "(4, 'd', 2, 2, 'Rock'), (5, 'e', 2, 2, 'Pop')")
+        conn.exec_driver_sql("INSERT INTO listeners (user_id, username) VALUES (1, 'listener')")
+        conn.exec_driver_sql("INSERT INTO playlists (playlist_id, playlist_name, user_id) VALUES "
+                             "(1, 'p1', 1), (2, 'p2', 1), (3, 'p3', 1)")
+        conn.exec_driver_sql("INSERT INTO playlist_tracks (playlist_id, track_id) VALUES (1, 1), (1, 2), (2, 1), (2, 4)")
+    # The counters of the rows above, as the migration would have backfilled them
+    import popularity
+    with engine.begin() as conn:
+        popularity.backfill(conn)
+
+    def run(function):
+        async def main():
+            try:
+                async with async_session_local() as db:
+                    return await function(db)
+            finally:
+                # Connections belong to this event loop, don't hand them to the next one
+                await async_engine.dispose()
+        return asyncio.run(main())
+
+    def rows(sql):
+        with engine.connect() as conn:
+            return [tuple(row) for row in conn.exec_driver_sql(sql)]
+
+    def execute(sql):
+        with engine.begin() as conn:
+            conn.exec_driver_sql(sql)
+
+    yield SimpleNamespace(run=run, rows=rows, execute=execute)
+
+    engine.dispose()
+    _forget_app_modules()
@@ -0,0 +1,94 @@
+from sqlalchemy import event
+
+
+def _commit(deleting, *args):
+    async def run(db):
+        deleted = await deleting(db, *args)
+        await db.commit()
+        return deleted
+    return run
+
+
+def _remaining(app):
+    return {table: app.rows(f"SELECT * FROM {table} ORDER BY 1, 2")
+            for table in ('artists', 'albums', 'tracks', 'playlist_tracks', 'track_popularity', 'artist_popularity')}
+
+
+def test_deleting_tracks_removes_their_entries_and_counters(app):
+    import deletes
+
+    deleted = app.run(_commit(deletes.delete_tracks, [1, 4, 4, 99]))
+
+    assert sorted(deleted.track_ids) == [1, 4]
+    assert deleted.playlist_ids == {1, 2}
+    assert deleted.counts() == {'tracks': 2, 'albums': 0, 'artists': 0, 'playlists_changed': 2}
+    remaining = _remaining(app)
+    assert [row[0] for row in remaining['tracks']] == [2, 3, 5]
+    assert remaining['playlist_tracks'] == [(1, 2)]
+    assert remaining['track_popularity'] == [(2, 1, 1)]
+    assert remaining['artist_popularity'] == [(1, 1), (2, 0)]
+
+
+def test_deleting_an_album_removes_its_tracks(app):
+    import deletes
+
+    deleted = app.run(_commit(deletes.delete_album, 1))
+
+    assert deleted.counts() == {'tracks': 3, 'albums': 1, 'artists': 0, 'playlists_changed': 2}
+    remaining = _remaining(app)
+    assert remaining['albums'] == [(2, 'Two', 2)]
+    assert [row[0] for row in remaining['tracks']] == [4, 5]
+    assert remaining['playlist_tracks'] == [(2, 4)]
+    assert remaining['track_popularity'] == [(4, 2, 1)]
+    assert remaining['artist_popularity'] == [(1, 0), (2, 1)]
+
+
+def test_deleting_an_artist_removes_everything_of_theirs(app):
+    import deletes
+
+    # A track of artist 2 on artist 1's album goes too
+    app.execute("UPDATE tracks SET album_id = 1 WHERE track_id = 5")
+    deleted = app.run(_commit(deletes.delete_artist, 1))
+
+    assert sorted(deleted.track_ids) == [1, 2, 3, 5]
+    assert deleted.counts() == {'tracks': 4, 'albums': 1, 'artists': 1, 'playlists_changed': 2}
+    remaining = _remaining(app)
+    assert remaining['artists'] == [(2, 'Second')]
+    assert remaining['albums'] == [(2, 'Two', 2)]
+    assert [row[0] for row in remaining['tracks']] == [4]
+    assert remaining['playlist_tracks'] == [(2, 4)]
+    assert remaining['track_popularity'] == [(4, 2, 1)]
+    assert remaining['artist_popularity'] == [(2, 1)]
+
+
+def test_a_delete_is_rolled_back_as_a_whole(app):
+    import deletes
+
+    before = _remaining(app)
+
+    async def delete(db):
+        await deletes.delete_artist(db, 2)
+        await db.rollback()
+
+    app.run(delete)
+    assert _remaining(app) == before
+
+
+def test_deletes_are_set_based(app):
+    import deletes
+    from database import async_engine
+
+    statements = []
+    event.listen(async_engine.sync_engine, 'before_cursor_execute',
+                 lambda conn, cursor, statement, *args: statements.append(statement))
+
+    def count(deleting, *args):
+        statements.clear()
+        app.run(_commit(deleting, *args))
+        return len(statements)
+
+    # The same statements for one track as for several, none per row
+    app.execute("INSERT INTO playlist_tracks (playlist_id, track_id) VALUES (3, 2), (3, 5)")
+    one = count(deletes.delete_tracks, [1])
+    several = count(deletes.delete_tracks, [2, 4, 5])
+    assert 0 < one == several
@@ -0,0 +1,17 @@
+import sys
+from types import SimpleNamespace
+
+from benchmarks import plans
+
+
+def test_key_queries_use_indexes(tmp_path, monkeypatch, capsys):
+    # run() points the app at its seeded database, puts the app on sys.path and
+    # moves into its directory, all of which is undone after the test
+    monkeypatch.setenv('DATABASE_URL', '')
+    monkeypatch.setenv('VERSIONS_FILE', str(tmp_path / 'versions'))
+    monkeypatch.setenv('ANALYTICS_DIR', str(tmp_path / 'analytics'))
+    monkeypatch.setattr(sys, 'path', list(sys.path))
+    monkeypatch.chdir(tmp_path)
+
+    assert plans.run(SimpleNamespace(existing=False, tracks=2000, verbose=False)) == 0
+    assert "0 with a full scan" in capsys.readouterr().out
@@ -0,0 +1,66 @@
+ENTRIES = "SELECT playlist_id, track_id FROM playlist_tracks ORDER BY playlist_id, track_id"
+COUNTERS = "SELECT track_id, playlist_count FROM track_popularity ORDER BY track_id"
+
+
+def _commit(change, *args):
+    async def run(db):
+        result, bumps = await change(db, *args)
+        await db.commit()
+        return result, bumps
+    return run
+
+
+def test_adding_twice_adds_once(app):
+    import playlist_tracks
+
+    # Duplicates in the request, a track already in the playlist and one that doesn't exist
+    result, bumps = app.run(_commit(playlist_tracks.add_tracks, 1, [3, 3, 4, 2, 99]))
+    assert result == {'added': 2, 'skipped': 2, 'already_in_playlist': [2], 'unknown_tracks': [99]}
+    assert set(bumps) == {'playlist_tracks', 'playlist_tracks:1', 'track_popularity'}
+    assert app.rows(ENTRIES) == [(1, 1), (1, 2), (1, 3), (1, 4), (2, 1), (2, 4)]
+    assert app.rows(COUNTERS) == [(1, 2), (2, 1), (3, 1), (4, 2)]
+
+    result, bumps = app.run(_commit(playlist_tracks.add_tracks, 1, [3, 4]))
+    assert result == {'added': 0, 'skipped': 2, 'already_in_playlist': [3, 4], 'unknown_tracks': []}
+    assert 'playlist_tracks' not in bumps
+    assert app.rows(ENTRIES) == [(1, 1), (1, 2), (1, 3), (1, 4), (2, 1), (2, 4)]
+    assert app.rows(COUNTERS) == [(1, 2), (2, 1), (3, 1), (4, 2)]
+
+
+def test_removing_twice_removes_once(app):
+    import playlist_tracks
+
+    result, bumps = app.run(_commit(playlist_tracks.remove_tracks, 2, [1, 1, 4, 5]))
+    assert result == {'removed': 2, 'skipped': 1, 'not_in_playlist': [5]}
+    assert set(bumps) == {'playlist_tracks', 'playlist_tracks:2', 'track_popularity'}
+    assert app.rows(ENTRIES) == [(1, 1), (1, 2)]
+    assert app.rows(COUNTERS) == [(1, 1), (2, 1)]
+    assert app.rows("SELECT artist_id, top_playlist_count FROM artist_popularity ORDER BY artist_id") == [(1, 1), (2, 0)]
+
+    result, bumps = app.run(_commit(playlist_tracks.remove_tracks, 2, [1, 4]))
+    assert result == {'removed': 0, 'skipped': 2, 'not_in_playlist': [1, 4]}
+    assert 'playlist_tracks' not in bumps
+    assert app.rows(ENTRIES) == [(1, 1), (1, 2)]
+    assert app.rows(COUNTERS) == [(1, 1), (2, 1)]
+
+
+def test_concurrent_add_is_recounted(app, monkeypatch):
+    import playlist_tracks
+
+    # Another request commits track 3 between the check and the insert
+    insert_ignore = playlist_tracks._insert_ignore
+
+    def racing_insert_ignore(db):
+        app.execute("INSERT INTO playlist_tracks (playlist_id, track_id) VALUES (3, 3)")
+        return insert_ignore(db)
+    monkeypatch.setattr(playlist_tracks, '_insert_ignore', racing_insert_ignore)
+
+    async def add(db):
+        result, _ = await playlist_tracks.add_tracks(db, 3, [3, 5])
+        await db.commit()
+        return result
+
+    assert app.run(add)['added'] == 1
+    assert app.rows("SELECT track_id FROM playlist_tracks WHERE playlist_id = 3 ORDER BY track_id") == [(3,), (5,)]
+    # The other request didn't count its entry, the recount picks it up from playlist_tracks
+    assert app.rows(COUNTERS) == [(1, 2), (2, 1), (3, 1), (4, 1), (5, 1)]
@@ -0,0 +1,78 @@
+COUNTERS = "SELECT track_id, artist_id, playlist_count FROM track_popularity ORDER BY track_id"
+TOPS = "SELECT artist_id, top_playlist_count FROM artist_popularity ORDER BY artist_id"
+
+
+def test_backfill_counts_the_seeded_playlists(app):
+    assert app.rows(COUNTERS) == [(1, 1, 2), (2, 1, 1), (4, 2, 1)]
+    assert app.rows(TOPS) == [(1, 2), (2, 1)]
+
+
+def test_added_and_removed_tracks_change_the_counters(app):
+    import popularity
+
+    async def add(db):
+        # Track 2 twice, as in two playlists at once; track 5 has no counter yet
+        bumps = await popularity.tracks_added(db, [2, 2, 5, 5, 5])
+        await db.commit()
+        return bumps
+
+    assert app.run(add) == ('track_popularity',)
+    assert app.rows(COUNTERS) == [(1, 1, 2), (2, 1, 3), (4, 2, 1), (5, 2, 3)]
+    assert app.rows(TOPS) == [(1, 3), (2, 3)]
+
+    async def remove(db):
+        await popularity.tracks_removed(db, [2, 2, 2, 4])
+        await db.commit()
+
+    app.run(remove)
+    # Track 4 is in no playlist anymore and loses its row, the artists' tops follow
+    assert app.rows(COUNTERS) == [(1, 1, 2), (5, 2, 3)]
+    assert app.rows(TOPS) == [(1, 2), (2, 3)]
+
+
+def test_rolled_back_changes_leave_the_counters(app):
+    import popularity
+
+    async def add(db):
+        await popularity.tracks_added(db, [3, 4])
+        await db.rollback()
+
+    app.run(add)
+    assert app.rows(COUNTERS) == [(1, 1, 2), (2, 1, 1), (4, 2, 1)]
+
+
+def test_recount_and_rebuild_match_playlist_tracks(app):
+    import popularity
+
+    # Playlist entries written behind the counters' back
+    app.execute("INSERT INTO playlist_tracks (playlist_id, track_id) VALUES (3, 1), (3, 3), (2, 2)")
+    app.execute("DELETE FROM playlist_tracks WHERE playlist_id = 2 AND track_id = 4")
+    expected = [(1, 1, 3), (2, 1, 2), (3, 1, 1)]
+
+    async def recount(db):
+        await popularity.recount_tracks(db, [1, 2, 3, 4])
+        await db.commit()
+
+    app.run(recount)
+    assert app.rows(COUNTERS) == expected
+    assert app.rows(TOPS) == [(1, 3), (2, 0)]
+
+    app.run(popularity.rebuild)
+    assert app.rows(COUNTERS) == expected
+    # The rebuild only keeps artists with tracks in a playlist
+    assert app.rows(TOPS) == [(1, 3)]
+
+
+def test_report_reads_the_most_popular_tracks(app):
+    import popularity
+
+    async def add(db):
+        await popularity.tracks_added(db, [4])
+        await db.commit()
+
+        async def run(statement):
+            return [tuple(row) for row in (await db.execute(statement)).all()]
+        return await popularity.report_rows(run)
+
+    # Ties are all reported
+    assert app.run(add) == [('First', 'a', 2), ('Second', 'd', 2)]
@@ -0,0 +1,14 @@
+from types import SimpleNamespace
+
+from benchmarks import startup
+
+
+def test_startup_does_not_load_lazy_modules(capsys):
+    # A catalog big enough for the load to show, with budgets a few times what it takes on a
+    # laptop: the app has to serve right away and load its indexes in the background, and
+    # importing it has to leave pandas and co. to the endpoints that need them
+    args = SimpleNamespace(runs=1, tracks=20000, max_import_seconds=3, max_startup_seconds=0.5,
+                           max_ready_seconds=10)
+
+    assert startup.run(args) == 0
+    assert "median of 1 runs with 20000 tracks" in capsys.readouterr().out
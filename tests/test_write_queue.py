@@ -0,0 +1,79 @@
+import asyncio
+
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+GENRES = "SELECT genre FROM genres ORDER BY genre"
+
+
+def _add_genre(genre):
+    async def apply(db):
+        import models
+
+        db.add(models.Genres(genre=genre))
+        await db.flush()
+        return genre, ['genres']
+    return apply
+
+
+def _submit_together(queue, applies):
+    async def run(db):
+        queue.start()
+        try:
+            return await asyncio.gather(*(queue.submit(apply) for apply in applies), return_exceptions=True)
+        finally:
+            await queue.stop()
+    return run
+
+
+def test_writes_queued_together_commit_in_one_batch(app):
+    import versions
+    from write_queue import WriteQueue
+
+    queue = WriteQueue(max_wait=0.05, max_items=10)
+    before = versions.get('genres')
+    results = app.run(_submit_together(queue, [_add_genre(f'Genre {n}') for n in range(5)]))
+
+    assert results == [f'Genre {n}' for n in range(5)]
+    assert (queue.batches, queue.writes, queue.retried_batches) == (1, 5, 0)
+    assert app.rows(GENRES) == [('Genre 0',), ('Genre 1',), ('Genre 2',), ('Genre 3',), ('Genre 4',),
+                                ('Pop',), ('Rock',)]
+    # Bumped once for the whole batch
+    assert versions.get('genres') == before + 1
+
+
+def test_full_batches_are_committed_at_once(app):
+    from write_queue import WriteQueue
+
+    queue = WriteQueue(max_wait=1, max_items=2)
+    app.run(_submit_together(queue, [_add_genre(f'Genre {n}') for n in range(5)]))
+
+    assert (queue.batches, queue.writes) == (3, 5)
+    assert len(app.rows(GENRES)) == 7
+
+
+def test_a_failed_write_is_retried_alone(app):
+    from write_queue import WriteQueue
+
+    queue = WriteQueue(max_wait=0.05, max_items=10)
+    # 'Pop' already exists and fails the batch, the other writes are retried one by one
+    results = app.run(_submit_together(queue, [_add_genre('Jazz'), _add_genre('Pop'), _add_genre('Folk')]))
+
+    assert results[0] == 'Jazz' and results[2] == 'Folk'
+    assert isinstance(results[1], IntegrityError)
+    assert (queue.batches, queue.retried_batches) == (1, 1)
+    assert app.rows(GENRES) == [('Folk',), ('Jazz',), ('Pop',), ('Rock',)]
+
+
+def test_writes_commit_alone_when_batching_is_off(app):
+    from write_queue import WriteQueue
+
+    queue = WriteQueue(max_wait=0)
+    results = app.run(_submit_together(queue, [_add_genre('Jazz'), _add_genre('Folk')]))
+
+    assert results == ['Jazz', 'Folk']
+    assert queue.batches == 0
+
+    with pytest.raises(IntegrityError):
+        app.run(lambda db: queue.submit(_add_genre('Jazz')))
+